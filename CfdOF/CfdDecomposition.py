@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+
+# Automatic choice of the number of subdomains and the method for decomposing a case to run in parallel. The number
+# of subdomains is chosen from the number of cells in the mesh and a target number of cells per core, up to the
+# number of physical cores of the machine or the slots in the MPI hostfile. This module does not depend on FreeCAD,
+# so that it can be used without it.
+
+import os
+import re
+import glob
+import math
+import itertools
+
+from CfdOF.Mesh import CfdPolyMesh
+from CfdOF.Mesh import CfdMeshReport
+
+DEFAULT_CELLS_PER_CORE = 50000
+
+_HOSTFILE_OPTION = re.compile(r'(?:^|\s)--?(?:hostfile|machinefile)[\s=]+(\S+)')
+_HOSTFILE_SLOTS = re.compile(r'(?:\sslots\s*=\s*|:)(\d+)')
+_NUMBER_OF_SUBDOMAINS = re.compile(r'^\s*numberOfSubdomains\s+(\d+)\s*;', re.MULTILINE)
+
+
+def getPhysicalCoreCount():
+    """
+    The number of physical cores of this machine, not counting hyperthreads where this can be found
+    :return: The number of cores
+    """
+    cores = set()
+    try:
+        with open('/proc/cpuinfo') as f:
+            physical_id = None
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+    except OSError:
+        pass
+    return len(cores) or os.cpu_count() or 1
+
+
+def findHostfile(mpi_options):
+    """ The hostfile (or machinefile) given in a string of mpiexec options, or None if none is given """
+    match = _HOSTFILE_OPTION.search(mpi_options or '')
+    return match.group(1) if match else None
+
+
+def readHostfileSlots(path):
+    """
+    Count the slots in an MPI hostfile, in either the Open MPI ('host slots=n') or MPICH ('host:n') format. A host
+    without a number of slots counts as one.
+    :return: The number of slots, or None if the file could not be read or lists no hosts
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    slots = 0
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if line:
+            match = _HOSTFILE_SLOTS.search(line)
+            slots += int(match.group(1)) if match else 1
+    return slots or None
+
+
+def getMeshCellCount(mesh_dir):
+    """
+    The number of cells in a mesh, from the header of its owner file or else from the mesh report
+    :param mesh_dir: The mesh case directory
+    :return: The number of cells, or None if it is not known
+    """
+    try:
+        num_cells = CfdPolyMesh.readCellCount(mesh_dir)
+    except (OSError, RuntimeError, ValueError):
+        num_cells = None
+    if num_cells is None:
+        report = CfdMeshReport.readMeshReport(mesh_dir)
+        num_cells = report.get('checkMesh', {}).get('cells', report.get('polyMesh', {}).get('cells'))
+    return num_cells
+
+
+def readNumberOfSubdomains(case_dir):
+    """ The number of subdomains in the decomposeParDict of a case, or None if it could not be read """
+    try:
+        with open(os.path.join(case_dir, 'system', 'decomposeParDict')) as f:
+            match = _NUMBER_OF_SUBDOMAINS.search(f.read())
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
+
+
+def isKahipAvailable(foam_dir):
+    """ Whether the OpenFOAM installation in foam_dir has been built with the KaHIP decomposition library """
+    if not foam_dir:
+        return False
+    # An installation built without KaHIP has only a dummy library, in a subdirectory of lib
+    return len(glob.glob(os.path.join(foam_dir, 'platforms', '*', 'lib', 'libkahipDecomp.*'))) > 0
+
+
+def getNumberOfSubdomains(num_cells, cells_per_core, max_cores):
+    """
+    :return: The number of subdomains giving about cells_per_core cells in each, from 2 up to max_cores
+    """
+    num_subdomains = int(math.ceil(num_cells/max(cells_per_core, 1)))
+    return max(min(num_subdomains, max_cores), 2)
+
+
+def getHierarchicalCoefficients(num_subdomains, lengths):
+    """
+    Divide num_subdomains among the three directions for hierarchical decomposition, so that the total area of the
+    cuts through a domain with side lengths 'lengths' is least. Directions of zero length (such as the empty direction
+    of a 2D mesh) are not divided.
+    :return: The number of subdomains in each direction
+    """
+    divisors = [d for d in range(1, num_subdomains + 1) if num_subdomains % d == 0]
+    best = None
+    for nx, ny in itertools.product(divisors, divisors):
+        if num_subdomains % (nx*ny):
+            continue
+        n = (nx, ny, num_subdomains//(nx*ny))
+        if any(n[i] > 1 and lengths[i] <= 0 for i in range(3)):
+            continue
+        # Area of the cuts normal to each direction, not counting zero lengths
+        cut_area = sum((n[i] - 1)*math.prod(lengths[j] for j in range(3) if j != i and lengths[j] > 0)
+                       for i in range(3))
+        if best is None or cut_area < best[0]:
+            best = (cut_area, n)
+    if best is None:
+        raise ValueError("Cannot decompose a domain of zero size")
+    return best[1]
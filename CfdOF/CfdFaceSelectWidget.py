@@ -27,6 +27,8 @@
 import FreeCAD
 import os
 import os.path
+import bisect
+import itertools
 from CfdOF import CfdTools
 from CfdOF.Mesh import CfdMeshRefinement
 from CfdOF.Solve import CfdFluidBoundary
@@ -40,6 +42,121 @@ if FreeCAD.GuiUp:
 
 from PySide.QtCore import QT_TRANSLATE_NOOP
 
+# Number of rows added to the element list at a time as it is scrolled
+ELEMENT_LIST_FETCH_SIZE = 1000
+
+
+class ElementListModel(QtCore.QAbstractListModel):
+    """
+    Check list of the sub-elements of a shape (Face1, Face2, ..., Solid1, ...), which can be filtered by name. Names
+    are generated from the row only when displayed, and rows are added to the view in batches as it is scrolled, so
+    that shapes with very many elements are listed quickly. Toggling a check box emits checkToggled rather than
+    changing the check state, which is set with setChecked.
+    """
+    checkToggled = QtCore.Signal(int)
+
+    def __init__(self):
+        super().__init__()
+        self.prefixes = []
+        self.starts = [0]
+        self.checked = set()
+        self.filter = ''
+        self.rows = range(0)
+        self.num_fetched = 0
+
+    def setElements(self, sections, checked):
+        """
+        :param sections: List of (name prefix, number of elements), e.g. [('Face', 6), ('Solid', 1)]
+        :param checked: Names of the elements that are checked
+        """
+        self.beginResetModel()
+        self.prefixes = [prefix for prefix, count in sections]
+        self.starts = [0] + list(itertools.accumulate(count for prefix, count in sections))
+        self.checked = set(checked)
+        self.updateRows()
+        self.endResetModel()
+
+    def setFilter(self, text):
+        """ Show only the elements whose names contain text (ignoring case) """
+        self.beginResetModel()
+        self.filter = text.strip().lower()
+        self.updateRows()
+        self.endResetModel()
+
+    def updateRows(self):
+        num_elements = self.starts[-1]
+        if self.filter:
+            self.rows = [k for k in range(num_elements) if self.filter in self.getName(k).lower()]
+        else:
+            self.rows = range(num_elements)
+        self.num_fetched = min(len(self.rows), ELEMENT_LIST_FETCH_SIZE)
+
+    def getName(self, k):
+        section = bisect.bisect_right(self.starts, k) - 1
+        return self.prefixes[section] + str(k - self.starts[section] + 1)
+
+    def elementName(self, row):
+        """ The name of the element in a row, which need not have been fetched yet """
+        return self.getName(self.rows[row])
+
+    def numElements(self):
+        """ The number of rows that match the filter, including any not yet fetched """
+        return len(self.rows)
+
+    def isChecked(self, row):
+        return self.elementName(row) in self.checked
+
+    def setChecked(self, rows, checked):
+        """
+        Check or uncheck the elements in the given rows
+        :return: The names of the elements whose check state changed
+        """
+        changed = []
+        for row in rows:
+            name = self.elementName(row)
+            if (name in self.checked) != checked:
+                changed.append(name)
+                if checked:
+                    self.checked.add(name)
+                else:
+                    self.checked.discard(name)
+        if changed and self.num_fetched:
+            self.dataChanged.emit(self.index(0), self.index(self.num_fetched - 1))
+        return changed
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.num_fetched
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.num_fetched < len(self.rows)
+
+    def fetchMore(self, parent):
+        num_rows = min(len(self.rows) - self.num_fetched, ELEMENT_LIST_FETCH_SIZE)
+        if num_rows <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.num_fetched, self.num_fetched + num_rows - 1)
+        self.num_fetched += num_rows
+        self.endInsertRows()
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsUserCheckable
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.elementName(index.row())
+        elif role == QtCore.Qt.CheckStateRole:
+            return QtCore.Qt.Checked if self.isChecked(index.row()) else QtCore.Qt.Unchecked
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if index.isValid() and role == QtCore.Qt.CheckStateRole:
+            self.checkToggled.emit(index.row())
+            return True
+        return False
+
+
 class CfdFaceSelectWidget:
     def __init__(self, parent_widget, obj, allow_obj_sel, allow_face_sel, allow_solid_sel,
                  allow_point_sel=False, allow_edge_sel=False):
@@ -140,8 +257,11 @@ class CfdFaceSelectWidget:
         self.form.objectListWidget.itemSelectionChanged.connect(self.faceListShapeChosen)
         self.form.objectListWidget.itemChanged.connect(self.objectListItemChanged)
         self.form.faceSelectPushButton.toggled.connect(self.faceSelectPushButtonChanged)
-        self.form.faceListWidget.itemSelectionChanged.connect(self.faceHighlightChange)
-        self.form.faceListWidget.itemChanged.connect(self.faceListItemChanged)
+        self.element_model = ElementListModel()
+        self.element_model.checkToggled.connect(self.faceListCheckToggled)
+        self.form.faceListView.setModel(self.element_model)
+        self.form.faceListView.selectionModel().selectionChanged.connect(self.faceHighlightChange)
+        self.form.faceFilterLineEdit.textChanged.connect(self.element_model.setFilter)
         self.form.selectAllButton.clicked.connect(self.selectAllButtonClicked)
         self.form.selectNoneButton.clicked.connect(self.selectNoneButtonClicked)
         self.form.objectListWidget.setToolTip("Choose solid objects from the list and optionally select one or more of "
@@ -259,11 +379,9 @@ class CfdFaceSelectWidget:
         print('Selection: ' + selected_object.Shape.ShapeType + '  ' + selected_object.Name + ':' +
               str(sub) + " @ " + str(selected_point))
         if hasattr(selected_object, "Shape"):
+            element_index = CfdTools.getShapeElementIndex(selected_object.Shape)
             if sub:
-                if sub.startswith('Solid'):  # getElement doesn't work for solids
-                    elt = selected_object.Shape.Solids[int(sub.lstrip('Solid')) - 1]
-                else:
-                    elt = selected_object.Shape.getElement(sub)
+                elt = element_index.getElement(sub)
             else:
                 elt = selected_object.Shape
             selection = None
@@ -275,28 +393,12 @@ class CfdFaceSelectWidget:
             elif self.selection_mode_solid:
                 # in solid selection mode use edges and faces for selection of a solid
                 solid_to_add = None
-                if elt.ShapeType == 'Edge':
-                    found_edge = False
-                    for i, s in enumerate(selected_object.Shape.Solids):
-                        for e in s.Edges:
-                            if elt.isSame(e):
-                                if not found_edge:
-                                    solid_to_add = 'Solid' + str(i + 1)
-                                else:
-                                    FreeCAD.Console.PrintMessage('Edge belongs to more than one solid\n')
-                                    solid_to_add = None
-                                found_edge = True
-                elif elt.ShapeType == 'Face':
-                    found_face = False
-                    for i, s in enumerate(selected_object.Shape.Solids):
-                        for e in s.Faces:
-                            if elt.isSame(e):
-                                if not found_face:
-                                    solid_to_add = 'Solid' + str(i + 1)
-                                else:
-                                    FreeCAD.Console.PrintMessage('Face belongs to more than one solid\n')
-                                    solid_to_add = None
-                                found_face = True
+                if elt.ShapeType == 'Edge' or elt.ShapeType == 'Face':
+                    solids = element_index.getSolidsContaining(elt)
+                    if len(solids) == 1:
+                        solid_to_add = 'Solid' + str(solids[0] + 1)
+                    elif len(solids) > 1:
+                        FreeCAD.Console.PrintMessage(elt.ShapeType + ' belongs to more than one solid\n')
                 elif elt.ShapeType == 'Solid':
                     solid_to_add = sub
                 if solid_to_add:
@@ -389,7 +491,7 @@ class CfdFaceSelectWidget:
         self.scheduleRecompute()
 
     def faceListShapeChosen(self):
-        if self.form.faceListWidget.isVisible():
+        if self.form.faceListView.isVisible():
             self.populateFaceList()
 
     def faceSelectPushButtonChanged(self, checked):
@@ -402,117 +504,84 @@ class CfdFaceSelectWidget:
     def populateFaceList(self):
         ind = self.form.objectListWidget.currentIndex().row()
         object_name = self.shapeNames[ind]
-        # Disable change notifications while we add new items
-        self.form.faceListWidget.itemChanged.disconnect()
         self.shapeObj = FreeCADGui.ActiveDocument.Document.getObject(object_name)
         self.hideObjects()
-        refs = list(self.ShapeRefs)
-        self.form.faceListWidget.clear()
         FreeCADGui.showObject(self.shapeObj)
+        element_index = CfdTools.getShapeElementIndex(self.shapeObj.Shape)
+        sections = []
         if self.allow_face_sel:
-            self.listOfShapeFaces = self.shapeObj.Shape.Faces
-            selected_faces = []
-            for ref in refs:
-                if ref[0].Name == object_name:
-                    selected_faces += ref[1]
-            for i in range(len(self.listOfShapeFaces)):
-                face_name = "Face" + str(i + 1)
-                item = QtGui.QListWidgetItem(face_name, self.form.faceListWidget)
-                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
-                checked = face_name in selected_faces
-                if checked:
-                    item.setCheckState(QtCore.Qt.Checked)
-                else:
-                    item.setCheckState(QtCore.Qt.Unchecked)
-                self.form.faceListWidget.insertItem(i, item)
+            sections.append(('Face', len(element_index.getElements('Faces'))))
         if self.allow_solid_sel:
-            self.listOfShapeSolids = self.shapeObj.Shape.Solids
-            selected_solids = []
-            for ref in refs:
-                if ref[0].Name == object_name:
-                    selected_solids += ref[1]
-            for i in range(len(self.listOfShapeSolids)):
-                solid_name = "Solid" + str(i + 1)
-                item = QtGui.QListWidgetItem(solid_name, self.form.faceListWidget)
-                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
-                checked = solid_name in selected_solids
-                if checked:
-                    item.setCheckState(QtCore.Qt.Checked)
-                else:
-                    item.setCheckState(QtCore.Qt.Unchecked)
-                self.form.faceListWidget.insertItem(i, item)
+            sections.append(('Solid', len(element_index.getElements('Solids'))))
         if self.allow_edge_sel:
-            self.listOfShapeEdges = self.shapeObj.Shape.Edges
-            selected_edges = [ref[1] for ref in refs if ref[0].Name == object_name]
-            for i in range(len(self.listOfShapeEdges)):
-                face_name = "Edge" + str(i + 1)
-                item = QtGui.QListWidgetItem(face_name, self.form.faceListWidget)
-                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
-                checked = face_name in selected_edges
-                if checked:
-                    item.setCheckState(QtCore.Qt.Checked)
-                else:
-                    item.setCheckState(QtCore.Qt.Unchecked)
-                self.form.faceListWidget.insertItem(i, item)
+            sections.append(('Edge', len(element_index.getElements('Edges'))))
         if self.allow_point_sel:
-            self.listOfShapeVertices = self.shapeObj.Shape.Vertexes
-            selected_solids = [ref[1] for ref in refs if ref[0].Name == object_name]
-            for i in range(len(self.listOfShapeVertices)):
-                face_name = "Vertex" + str(i + 1)
-                item = QtGui.QListWidgetItem(face_name, self.form.faceListWidget)
-                item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
-                checked = face_name in selected_solids
-                if checked:
-                    item.setCheckState(QtCore.Qt.Checked)
-                else:
-                    item.setCheckState(QtCore.Qt.Unchecked)
-                self.form.faceListWidget.insertItem(i, item)
-
-        self.form.faceListWidget.itemChanged.connect(self.faceListItemChanged)
+            sections.append(('Vertex', len(element_index.getElements('Vertexes'))))
+        selected = set()
+        for ref in self.ShapeRefs:
+            if ref[0].Name == object_name:
+                selected.update(ref[1])
+        self.element_model.setElements(sections, selected)
 
     def hideObjects(self):
         for i in FreeCADGui.ActiveDocument.Document.Objects:
-            if 'Shape' in i.PropertiesList and len(i.Shape.Faces):
+            # Check visibility first, as listing the faces of a shape can be slow
+            if i.Visibility and 'Shape' in i.PropertiesList and len(i.Shape.Faces):
                 FreeCADGui.hideObject(i)
         self.view_object.show()
 
+    def selectedElementRows(self):
+        return [index.row() for index in self.form.faceListView.selectionModel().selectedRows()]
+
     def faceHighlightChange(self):
         FreeCADGui.Selection.clearSelection()
-        if self.form.faceListWidget.currentItem():
-            FreeCADGui.Selection.addSelection(self.shapeObj, self.form.faceListWidget.currentItem().text())
+        names = [self.element_model.elementName(row) for row in self.selectedElementRows()]
+        if names:
+            FreeCADGui.Selection.addSelection(self.shapeObj, names)
         self.scheduleRecompute()
 
-    def faceListItemChanged(self, item):
-        object_name = self.shapeNames[self.form.objectListWidget.currentIndex().row()]
-        face_name = item.text()
-        if item.checkState() == QtCore.Qt.Checked:
+    def faceListCheckToggled(self, row):
+        """ Toggle an element's check box, together with those of any other selected elements if it is selected """
+        rows = self.selectedElementRows()
+        if row not in rows:
+            rows = [row]
+        self.setElementsChecked(rows, not self.element_model.isChecked(row))
+
+    def setElementsChecked(self, rows, checked):
+        """ Add or remove the elements in the given rows of the element list to or from the references at once """
+        names = self.element_model.setChecked(rows, checked)
+        if not names:
+            return
+        object_name = self.shapeObj.Name
+        if checked:
             # If current object was already added in its entirety, remove it since we are now editing on the face level
-            for ref in self.ShapeRefs:
-                if ref[0].Name == object_name and ref[1] == ('',):
-                    self.ShapeRefs.remove(ref)
-            self.addSelection(self.doc_name, object_name, face_name, as_is=True)
+            existing = set()
+            for ref in list(self.ShapeRefs):
+                if ref[0].Name == object_name:
+                    if ref[1] == ('',):
+                        self.ShapeRefs.remove(ref)
+                    else:
+                        existing.update(ref[1])
+            new_names = tuple(name for name in names if name not in existing)
+            if new_names:
+                self.ShapeRefs.append((self.shapeObj, new_names))
         else:
-            if not self.ShapeRefs:
-                return
-            for i, ref in enumerate(self.ShapeRefs):
+            names = set(names)
+            for ref in list(self.ShapeRefs):
                 if ref[0].Name == object_name:
-                    newsub = tuple([rr for rr in ref[1] if rr != face_name])
+                    newsub = tuple([rr for rr in ref[1] if rr not in names])
                     if not len(newsub):
                         self.ShapeRefs.remove(ref)
-                    else:
-                        self.ShapeRefs[i] = (ref[0], newsub)
-            self.rebuildReferenceList()
+                    elif len(newsub) < len(ref[1]):
+                        self.ShapeRefs[self.ShapeRefs.index(ref)] = (ref[0], newsub)
+        self.rebuildReferenceList()
         self.scheduleRecompute()
 
     def selectAllButtonClicked(self):
-        for i in range(self.form.faceListWidget.count()):
-            item = self.form.faceListWidget.item(i)
-            item.setCheckState(QtCore.Qt.Checked)
+        self.setElementsChecked(range(self.element_model.numElements()), True)
 
     def selectNoneButtonClicked(self):
-        for i in range(self.form.faceListWidget.count()):
-            item = self.form.faceListWidget.item(i)
-            item.setCheckState(QtCore.Qt.Unchecked)
+        self.setElementsChecked(range(self.element_model.numElements()), False)
 
     def scheduleRecompute(self):
         """ Only do one (costly) recompute when done processing - call this in preference to document.recompute() """
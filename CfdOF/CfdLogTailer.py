@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+import os
+import json
+import hashlib
+
+# Number of bytes at the start of a log used to recognise it. OpenFOAM logs start with a banner
+# containing the date, time and process ID, so a new run of the same application gives a different
+# signature.
+SIGNATURE_LENGTH = 4096
+
+
+class LogTailer:
+    """
+    Follow a log file written by a running or finished process, independently of the process itself,
+    e.g. a log.* file written by Allrun or Allmesh. Each read returns the complete lines added since
+    the previous one. The read position can be saved, together with any state the caller derived from
+    the text, so that a later session can carry on from the same point rather than re-reading the log.
+    A log that has been replaced or truncated in the meantime is read again from the start, after
+    calling restart_hook.
+    """
+    def __init__(self, file_name, state_file_name=None, restart_hook=None, max_read_size=1 << 24):
+        self.file_name = file_name
+        self.state_file_name = state_file_name
+        self.restartHook = restart_hook
+        self.max_read_size = max_read_size
+        self.offset = 0
+        self.signature = None
+
+    def readSignature(self, fid, length):
+        fid.seek(0)
+        return hashlib.sha1(fid.read(length)).hexdigest()
+
+    def read(self):
+        """
+        Return the complete lines written since the last read, up to max_read_size bytes, or an empty string
+        if there are none (or the log does not exist)
+        """
+        try:
+            fid = open(self.file_name, 'rb')
+        except OSError:
+            return ''
+        with fid:
+            size = os.fstat(fid.fileno()).st_size
+            if self.offset and (size < self.offset or
+                                self.readSignature(fid, self.signature[1]) != self.signature[0]):
+                self.restart()
+            length = min(size, SIGNATURE_LENGTH)
+            if self.signature is None or self.signature[1] < length:
+                self.signature = (self.readSignature(fid, length), length)
+            fid.seek(self.offset)
+            data = fid.read(min(size - self.offset, self.max_read_size))
+        # Leave an incomplete last line to be read next time, unless it is too long to be read at once
+        end = data.rfind(b'\n') + 1
+        if not end and len(data) == self.max_read_size:
+            end = len(data)
+        self.offset += end
+        return data[:end].decode('utf-8', errors='replace')
+
+    def restart(self):
+        self.offset = 0
+        self.signature = None
+        if self.restartHook:
+            self.restartHook()
+
+    def save(self, state=None):
+        """ Save the read position and the caller's (JSON-serialisable) state """
+        if not self.state_file_name:
+            return
+        with open(self.state_file_name, 'w') as fid:
+            json.dump({'offset': self.offset, 'signature': self.signature, 'state': state}, fid)
+
+    def load(self):
+        """
+        Resume from the position saved by a previous session, provided the log is still the same one.
+        Returns the state saved with it, or None if the log must be read from the start.
+        """
+        try:
+            with open(self.state_file_name) as fid:
+                saved = json.load(fid)
+            with open(self.file_name, 'rb') as fid:
+                size = os.fstat(fid.fileno()).st_size
+                signature = saved['signature']
+                if saved['offset'] > size or self.readSignature(fid, signature[1]) != signature[0]:
+                    return None
+        except (OSError, TypeError, ValueError, KeyError):
+            return None
+        self.offset = saved['offset']
+        self.signature = tuple(signature)
+        return saved['state']
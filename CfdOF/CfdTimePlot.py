@@ -26,6 +26,9 @@
 
 import sys
 import math
+import time
+import weakref
+import numpy
 from PySide import QtCore
 import FreeCAD
 
@@ -47,12 +50,95 @@ if reload_PyQt5:
 from FreeCAD import Units
 from CfdOF import CfdTools
 
+# Interval between refreshes of the plots (ms), which is lengthened while refreshing is slow or the GUI is busy
+REFRESH_INTERVAL = 2000
+MAX_REFRESH_INTERVAL = 30000
+
+
+class RefreshScheduler:
+    """
+    Refreshes all plots from a single timer. If a refresh, together with any delay in the timer firing because the
+    GUI was busy, takes more than a tenth of the interval, the interval is doubled (up to MAX_REFRESH_INTERVAL);
+    otherwise it is halved, back to REFRESH_INTERVAL.
+    """
+    def __init__(self):
+        self.plots = weakref.WeakSet()
+        self.interval = REFRESH_INTERVAL
+        self.scheduled_time = None
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.refresh)
+
+    def addPlot(self, plot):
+        self.plots.add(plot)
+        if not self.timer.isActive():
+            self.schedule()
+
+    def schedule(self):
+        self.scheduled_time = time.monotonic() + self.interval/1000
+        self.timer.start(self.interval)
+
+    def refresh(self):
+        start = time.monotonic()
+        delay = max(start - self.scheduled_time, 0)
+        try:
+            for plot in list(self.plots):
+                plot.refresh()
+        finally:
+            busy = (time.monotonic() - start + delay)*1000
+            if busy > 0.1*self.interval:
+                self.interval = min(2*self.interval, MAX_REFRESH_INTERVAL)
+            else:
+                self.interval = max(self.interval//2, REFRESH_INTERVAL)
+            if len(self.plots):
+                self.schedule()
+
+
+refresh_scheduler = None
+
+
+def decimateMinMax(x, y, max_points):
+    """
+    Reduce a series to at most about max_points points for plotting, by dividing it into buckets of consecutive
+    samples and keeping only the smallest and largest value in each (in their original order). The first and last
+    points are always kept. Spikes therefore remain visible, however long the series.
+    """
+    n = len(y)
+    if n <= max_points:
+        return x, y
+    num_buckets = max(max_points//2, 1)
+    bucket_size = -(-n//num_buckets)
+    end = (n//bucket_size)*bucket_size
+    buckets = y[:end].reshape(-1, bucket_size)
+    nan = numpy.isnan(buckets)
+    extremes = numpy.stack((numpy.argmin(numpy.where(nan, numpy.inf, buckets), axis=1),
+                            numpy.argmax(numpy.where(nan, -numpy.inf, buckets), axis=1)), axis=1)
+    extremes.sort(axis=1)
+    extremes += numpy.arange(0, end, bucket_size)[:, numpy.newaxis]
+    indices = numpy.unique(numpy.concatenate(([0], extremes.ravel(), numpy.arange(end, n), [n-1])))
+    return x[indices], y[indices]
+
+
+def getRefreshScheduler():
+    global refresh_scheduler
+    if refresh_scheduler is None:
+        refresh_scheduler = RefreshScheduler()
+    return refresh_scheduler
+
+
 class TimePlot:
-    def __init__(self, title, y_label, is_log):
+    """
+    A plot of quantities against simulation time (or iteration). The plotted lines are kept between refreshes and
+    only their data is replaced, so that axes are set up again only when the plot is reinitialised. With blit,
+    only the lines are redrawn unless the axis limits or legend have changed. Long series are decimated for
+    plotting according to the width of the axes; times and values keep the full data.
+    """
+    def __init__(self, title, y_label, is_log, blit=False):
         self.fig = None
         self.title = title
         self.is_logarithmic = is_log
         self.y_label = y_label
+        self.blit = blit
 
         self.updated = False
         self.just_initialised = False
@@ -61,9 +147,12 @@ class TimePlot:
         self.transient = False
         self.ax_lim = 0
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.refresh)
-        self.timer.start(2000)
+        # Plotted lines by label, and the background behind them if blitting
+        self.lines = {}
+        self.axes_initialised = False
+        self.background = None
+
+        getRefreshScheduler().addPlot(self)
 
     def __del__(self):
         if FreeCAD.GuiUp:
@@ -73,6 +162,7 @@ class TimePlot:
         self.fig = None
 
     def updateValues(self, times, values):
+        # Only the references are stored here; the data is copied when the plot is next refreshed
         self.updated = True
         self.times = times
         self.values = values
@@ -83,6 +173,28 @@ class TimePlot:
         self.transient = (phys_model.Time == 'Transient')
         self.values = {}
         self.ax_lim = 100*solver_obj.TimeStep.getValueAs(Units.TimeSpan).Value if self.transient else 100
+        self.axes_initialised = False
+
+    def initAxes(self):
+        ax = self.fig.axes
+        ax.cla()
+        ax.set_title(self.title)
+        time_unit = str(Units.Quantity(1, Units.TimeSpan)).split()[-1]
+        ax.set_xlabel("Time [{}]".format(time_unit) if self.transient else "Iteration")
+        ax.set_ylabel(self.y_label)
+        ax.grid()
+        if self.is_logarithmic:
+            ax.set_yscale('log')
+        self.lines = {}
+        self.background = None
+        self.axes_initialised = True
+
+    def onDraw(self, event):
+        # Save the background without the (animated) lines, and draw them on top
+        if self.fig is not None:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.axes.bbox)
+            for line in self.lines.values():
+                self.fig.axes.draw_artist(line)
 
     def refresh(self):
         if self.updated:
@@ -90,36 +202,66 @@ class TimePlot:
             if self.fig is None:
                 self.fig = Plot.figure(FreeCAD.ActiveDocument.Name + ' : ' + self.title)
                 self.fig.destroyed.connect(self.figureClosed)
+                if self.blit:
+                    self.fig.canvas.mpl_connect('draw_event', self.onDraw)
+                self.axes_initialised = False
+            if not self.axes_initialised:
+                self.initAxes()
             ax = self.fig.axes
-            ax.cla()
-            ax.set_title(self.title)
-            time_unit = str(Units.Quantity(1, Units.TimeSpan)).split()[-1]
-            ax.set_xlabel("Time [{}]".format(time_unit) if self.transient else "Iteration")
-            ax.set_ylabel(self.y_label)
+            limits = (ax.get_xlim(), ax.get_ylim())
 
+            # Copy the data, as the arrays given may be extended in place
+            times = numpy.array(self.times, dtype=float)
+            # Plot the extremes within each pixel across the axes
+            max_points = 2*max(int(ax.bbox.width), 1)
+            labels_changed = False
             last_values_min = 1e-2
             for k in self.values:
-                if self.values[k]:
-                    ax.plot(self.times[0:len(self.values[k])], self.values[k], label=k, linewidth=1)
-                    last_values_min = min([last_values_min]+self.values[k][1:-1])
+                values = numpy.array(self.values[k], dtype=float)
+                if len(values):
+                    x, y = decimateMinMax(times[0:len(values)], values, max_points)
+                    line = self.lines.get(k)
+                    if line is None:
+                        self.lines[k], = ax.plot(x, y, label=k, linewidth=1, animated=self.blit)
+                        labels_changed = True
+                    else:
+                        line.set_data(x, y)
+                    # Zero cannot be shown on a log scale
+                    positive = values[1:-1][values[1:-1] > 0]
+                    if len(positive):
+                        last_values_min = min(last_values_min, positive.min())
+            for k in list(self.lines):
+                if not len(self.values.get(k, [])):
+                    self.lines.pop(k).remove()
+                    labels_changed = True
 
-            ax.grid()
             if self.is_logarithmic:
-                ax.set_yscale('log')
                 # Decrease in increments of 10
                 ax.set_ylim([10**(math.floor(math.log10(last_values_min))), 1])
+            else:
+                ax.relim()
+                ax.autoscale_view(scalex=False)
 
-            if self.just_initialised and len(self.times):
+            if self.just_initialised and len(times):
                 # Re-initialise based on the actual first time step taken, which may differ from the time step
                 # specified by the user
-                self.ax_lim = 100*self.times[0] if self.transient else 100
+                self.ax_lim = 100*times[0] if self.transient else 100
                 self.just_initialised = False
 
-            while float(self.times[-1]) > self.ax_lim:
+            while len(times) and times[-1] > self.ax_lim:
                 # Increase scale by 10%
                 self.ax_lim *= 1.1
             ax.set_xlim([0, self.ax_lim])
 
-            if len(self.times):
+            if labels_changed and self.lines:
                 ax.legend(loc='lower left')
-                self.fig.canvas.draw()
+
+            if len(times):
+                if (self.blit and not labels_changed and self.background is not None and
+                        limits == (ax.get_xlim(), ax.get_ylim())):
+                    self.fig.canvas.restore_region(self.background)
+                    for line in self.lines.values():
+                        ax.draw_artist(line)
+                    self.fig.canvas.blit(ax.bbox)
+                else:
+                    self.fig.canvas.draw()
@@ -37,6 +37,10 @@ import platform
 import subprocess
 import sys
 import math
+import re
+import numpy
+import hashlib
+import json
 import importlib
 import types
 from datetime import timedelta
@@ -237,6 +241,10 @@ def getReportingFunctionsGroup(analysis_object):
     return getModelsOfType(analysis_object, 'CfdReportingFunction')
 
 
+def getConvergenceCriteria(analysis_object):
+    return getModelsOfType(analysis_object, 'CfdConvergenceCriterion')
+
+
 def getScalarTransportFunctionsGroup(analysis_object):
     return getModelsOfType(analysis_object, 'CfdScalarTransportFunction')
 
@@ -1341,13 +1349,16 @@ def startGmsh(working_dir, args, console_message_fn, stdout_fn=None, stderr_fn=N
     return proc
 
 
+# Tolerances of floatEqual
+FLOAT_EQUAL_RELTOL = 10*sys.float_info.epsilon
+FLOAT_EQUAL_ABSTOL = 1e-11  # Seems to be necessary on file read/write
+
+
 def floatEqual(a, b):
     """
     Test whether a and b are equal within an absolute and relative tolerance
     """
-    reltol = 10*sys.float_info.epsilon
-    abstol = 1e-11  # Seems to be necessary on file read/write
-    return abs(a-b) < abstol or abs(a - b) <= reltol*max(abs(a), abs(b))
+    return abs(a-b) < FLOAT_EQUAL_ABSTOL or abs(a - b) <= FLOAT_EQUAL_RELTOL*max(abs(a), abs(b))
 
 
 def isSameGeometry(shape1, shape2):
@@ -1383,49 +1394,197 @@ def isSameGeometry(shape1, shape2):
 
 def findElementInShape(a_shape, an_element):
     """
-    Copy of FemMeshTools.find_element_in_shape, but calling isSameGeometry
+    Copy of FemMeshTools.find_element_in_shape, but calling isSameGeometry. The elements of a_shape are looked up in
+    its (cached) ShapeElementIndex rather than compared one by one.
     """
-    # import Part
     ele_st = an_element.ShapeType
+    if ele_st == 'Compound':
+        FreeCAD.Console.PrintError('Compound is not supported.\n')
+        return None
+    index = getShapeElementIndex(a_shape).findSameGeometry(an_element)
+    if index is not None:
+        return ele_st + str(index + 1)
     if ele_st == 'Solid' or ele_st == 'CompSolid':
-        for index, solid in enumerate(a_shape.Solids):
-            # print(is_same_geometry(solid, anElement))
-            if isSameGeometry(solid, an_element):
-                # print(index)
-                # Part.show(aShape.Solids[index])
-                ele = ele_st + str(index + 1)
-                return ele
         FreeCAD.Console.PrintError('Solid ' + str(an_element) + ' not found in: ' + str(a_shape) + '\n')
         if ele_st == 'Solid' and a_shape.ShapeType == 'Solid':
             print('We have been searching for a Solid in a Solid and we have not found it. In most cases this should be searching for a Solid inside a CompSolid. Check the ShapeType of your Part to mesh.')
-        # Part.show(anElement)
-        # Part.show(aShape)
-    elif ele_st == 'Face' or ele_st == 'Shell':
-        for index, face in enumerate(a_shape.Faces):
-            # print(is_same_geometry(face, anElement))
-            if isSameGeometry(face, an_element):
-                # print(index)
-                # Part.show(aShape.Faces[index])
-                ele = ele_st + str(index + 1)
-                return ele
-    elif ele_st == 'Edge' or ele_st == 'Wire':
-        for index, edge in enumerate(a_shape.Edges):
-            # print(is_same_geometry(edge, anElement))
-            if isSameGeometry(edge, an_element):
-                # print(index)
-                # Part.show(aShape.Edges[index])
-                ele = ele_st + str(index + 1)
-                return ele
-    elif ele_st == 'Vertex':
-        for index, vertex in enumerate(a_shape.Vertexes):
-            # print(is_same_geometry(vertex, anElement))
-            if isSameGeometry(vertex, an_element):
-                # print(index)
-                # Part.show(aShape.Vertexes[index])
-                ele = ele_st + str(index + 1)
-                return ele
-    elif ele_st == 'Compound':
-        FreeCAD.Console.PrintError('Compound is not supported.\n')
+    return None
+
+
+# Weights projecting a shape's vertex bounding box onto a single sort key. Irrational, so that different bounding
+# boxes (which commonly share some coordinates) are unlikely to have the same key.
+_SIGNATURE_KEY_WEIGHTS = numpy.array([1.0, math.sqrt(2), math.sqrt(3), math.sqrt(5), math.sqrt(7), math.sqrt(11)])
+
+
+def floatEqualArray(a, b):
+    """
+    Element-wise floatEqual of arrays
+    """
+    diff = numpy.abs(a - b)
+    return (diff < FLOAT_EQUAL_ABSTOL) | (diff <= FLOAT_EQUAL_RELTOL*numpy.maximum(numpy.abs(a), numpy.abs(b)))
+
+
+class ShapeSignatures:
+    """
+    The geometric properties of a list of shapes that are compared by isSameGeometry, read from each shape once and
+    stored in arrays: vertex coordinates, centre of mass and area (NaN if the shape has none). The bounding box of
+    the vertices is projected onto a sort key used to find candidate matches.
+    """
+    def __init__(self, shapes):
+        num_shapes = len(shapes)
+        self.num_vertices = numpy.zeros(num_shapes, dtype=int)
+        self.centre_of_mass = numpy.full((num_shapes, 3), numpy.nan)
+        self.area = numpy.full(num_shapes, numpy.nan)
+        points = []
+        for i, shape in enumerate(shapes):
+            vertices = shape.Vertexes
+            self.num_vertices[i] = len(vertices)
+            points += [tuple(v.Point) for v in vertices]
+            if hasattr(shape, "CenterOfMass"):
+                self.centre_of_mass[i] = tuple(shape.CenterOfMass)
+            if hasattr(shape, "Area"):
+                self.area[i] = shape.Area
+        self.points = numpy.array(points, dtype=float).reshape(-1, 3)
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(self.num_vertices)))
+        self.computeKeys()
+        self.hash = None
+
+    def __len__(self):
+        return len(self.num_vertices)
+
+    @classmethod
+    def concatenate(cls, signatures):
+        """ The signatures of all the shapes in a list of ShapeSignatures, in order """
+        sig = cls([])
+        if signatures:
+            sig.num_vertices = numpy.concatenate([s.num_vertices for s in signatures])
+            sig.centre_of_mass = numpy.concatenate([s.centre_of_mass for s in signatures])
+            sig.area = numpy.concatenate([s.area for s in signatures])
+            sig.points = numpy.concatenate([s.points for s in signatures])
+            sig.offsets = numpy.concatenate(([0], numpy.cumsum(sig.num_vertices)))
+            sig.computeKeys()
+        return sig
+
+    def computeKeys(self):
+        bbox = numpy.zeros((len(self.num_vertices), 6))
+        has_vertices = self.num_vertices > 0
+        if len(self.points):
+            starts = self.offsets[:-1][has_vertices]
+            bbox[has_vertices, :3] = numpy.minimum.reduceat(self.points, starts)
+            bbox[has_vertices, 3:] = numpy.maximum.reduceat(self.points, starts)
+        self.key = bbox.dot(_SIGNATURE_KEY_WEIGHTS)
+        # Largest difference in key between shapes whose bounding boxes are equal within the tolerance
+        self.key_tol = _SIGNATURE_KEY_WEIGHTS.sum()*(
+            FLOAT_EQUAL_ABSTOL + 2*FLOAT_EQUAL_RELTOL*(numpy.abs(bbox).max() if len(bbox) else 0))
+
+    def getPoints(self, indices, num_vertices):
+        """ The vertex coordinates of the given shapes, which all have num_vertices vertices """
+        return self.points[self.offsets[indices][:, numpy.newaxis] + numpy.arange(num_vertices)]
+
+    def getHash(self):
+        """ A checksum of the signatures, identifying the geometry of the shapes """
+        if self.hash is None:
+            h = hashlib.sha1()
+            for a in (self.num_vertices, self.centre_of_mass, self.area, self.points):
+                h.update(numpy.ascontiguousarray(a).tobytes())
+            self.hash = h.hexdigest()
+        return self.hash
+
+
+# Signatures of the elements of document objects, kept between mesh writes. Keyed on the document name, object name,
+# element names and element type, most recently used last; each entry holds the shape the signatures were computed
+# from, so that they are recomputed only once the object's shape has been recomputed. The least recently used are
+# dropped, so that entries for closed documents and deleted objects do not accumulate.
+_signature_cache = {}
+SIGNATURE_CACHE_SIZE = 1024
+
+# Results of matchShapeSignatures, keyed on the hashes of the signatures matched, most recently used last
+_match_cache = {}
+MATCH_CACHE_SIZE = 32
+
+
+def getReferenceSignatures(ref, element_type='Faces'):
+    """
+    Signatures of the faces (or other elements, according to element_type) of each shape resolved from a reference
+    as by resolveReference. Cached until the referenced object's shape changes, when the reference is resolved again.
+    :return: List of ShapeSignatures, one for each shape resolved
+    """
+    obj = ref[0]
+    shape = obj.Shape
+    key = (obj.Document.Name, obj.Name, tuple(ref[1]), element_type)
+    cached = _signature_cache.pop(key, None)
+    # Holding the shape in the cache means that a new shape cannot re-use its identity
+    if cached is None or not cached[0].isSame(shape):
+        signatures = [ShapeSignatures(getattr(s[0], element_type)) for s in resolveReference(ref)]
+        cached = (shape, signatures)
+    _signature_cache[key] = cached
+    while len(_signature_cache) > SIGNATURE_CACHE_SIZE:
+        del _signature_cache[next(iter(_signature_cache))]
+    return cached[1]
+
+
+def getShapeSignatures(obj, element_type='Faces'):
+    """ Cached signatures of the faces (or other elements) of the whole shape of obj """
+    return getReferenceSignatures((obj, ()), element_type)[0]
+
+
+def matchShapeSignatures(sig1, sig2):
+    """
+    Find the pairs of shapes that are the same geometry (as tested by isSameGeometry). The result is cached, so
+    that matching the same geometry again is immediate.
+    :return: Lists of the indices of the matching shapes in sig1 and sig2, ordered by index in sig1 then sig2
+    """
+    key = (sig1.getHash(), sig2.getHash())
+    match = _match_cache.pop(key, None)
+    if match is None:
+        match = _matchShapeSignatures(sig1, sig2)
+    _match_cache[key] = match
+    while len(_match_cache) > MATCH_CACHE_SIZE:
+        del _match_cache[next(iter(_match_cache))]
+    return match[0].tolist(), match[1].tolist()
+
+
+def _matchShapeSignatures(sig1, sig2):
+    # Candidates: shapes with the same number of vertices and, within tolerance, the same bounding box
+    order2 = numpy.argsort(sig2.key, kind='stable')
+    sorted_keys2 = sig2.key[order2]
+    key_tol = max(sig1.key_tol, sig2.key_tol)
+    start = numpy.searchsorted(sorted_keys2, sig1.key - key_tol, side='left')
+    end = numpy.searchsorted(sorted_keys2, sig1.key + key_tol, side='right')
+    num_candidates = end - start
+    i = numpy.repeat(numpy.arange(len(sig1.key)), num_candidates)
+    # Position of each candidate in sorted_keys2: its position in the flattened list, less the flattened position
+    # of the first candidate for the same shape, plus the start of that shape's range
+    first_candidate = numpy.cumsum(num_candidates) - num_candidates
+    j = order2[numpy.arange(len(i)) + numpy.repeat(start - first_candidate, num_candidates)]
+    keep = (sig1.num_vertices[i] == sig2.num_vertices[j]) & (sig1.num_vertices[i] > 0)
+
+    # Centre of mass and area must be equal where both shapes have them
+    for a1, a2 in ((sig1.centre_of_mass, sig2.centre_of_mass),
+                   (sig1.area[:, numpy.newaxis], sig2.area[:, numpy.newaxis])):
+        v1 = a1[i]
+        v2 = a2[j]
+        keep &= numpy.all(numpy.isnan(v1) | numpy.isnan(v2) | floatEqualArray(v1, v2), axis=1)
+    i = i[keep]
+    j = j[keep]
+
+    # Every vertex of the first shape must coincide with one of the second, checking shapes with the same number of
+    # vertices together
+    same = numpy.zeros(len(i), dtype=bool)
+    for num_vertices in numpy.unique(sig1.num_vertices[i]):
+        pairs = numpy.nonzero(sig1.num_vertices[i] == num_vertices)[0]
+        # Limit the size of the arrays compared at once
+        chunk_size = max(1, 1000000//(num_vertices*num_vertices))
+        for c in range(0, len(pairs), chunk_size):
+            chunk = pairs[c:c+chunk_size]
+            p1 = sig1.getPoints(i[chunk], num_vertices)
+            p2 = sig2.getPoints(j[chunk], num_vertices)
+            coincident = numpy.all(floatEqualArray(p1[:, :, numpy.newaxis, :], p2[:, numpy.newaxis, :, :]), axis=3)
+            same[chunk] = numpy.all(numpy.any(coincident, axis=2), axis=1)
+    i = i[same]
+    j = j[same]
+    order = numpy.lexsort((j, i))
+    return i[order], j[order]
 
 
 def matchFaces(faces1, faces2):
@@ -1433,91 +1592,99 @@ def matchFaces(faces1, faces2):
     This function does a geometric matching of face lists much faster than doing face-by-face search
     :param faces1: List of tuples - first item is face object, second is any user data
     :param faces2: List of tuples - first item is face object, second is any user data
-    :return:  A list of (data1, data2) containing the user data for any/all matching faces
-    Note that faces1 and faces2 are sorted in place and can be reused for faster subsequent searches
-    """
-
-    def compKeyFn(key):
-        class K(object):
-            def __init__(self, val, *args):
-                self.val = key(val)
-
-            def __eq__(self, other):
-                return floatEqual(self.val, other.val)
-
-            def __ne__(self, other):
-                return not floatEqual(self.val, other.val)
-
-            def __lt__(self, other):
-                return self.val < other.val and not floatEqual(self.val, other.val)
-
-            def __gt__(self, other):
-                return self.val > other.val and not floatEqual(self.val, other.val)
-
-            def __le__(self, other):
-                return self.val < other.val or floatEqual(self.val, other.val)
-
-            def __ge__(self, other):
-                return self.val > other.val or floatEqual(self.val, other.val)
-
-        return K
-
-    # Sort face list by first vertex, x then y then z in case all in plane
-    faces1.sort(key=compKeyFn(lambda bf: bf[0].Vertexes[0].Point.z))
-    faces1.sort(key=compKeyFn(lambda bf: bf[0].Vertexes[0].Point.y))
-    faces1.sort(key=compKeyFn(lambda bf: bf[0].Vertexes[0].Point.x))
-
-    # Same on other face list
-    faces2.sort(key=compKeyFn(lambda mf: mf[0].Vertexes[0].Point.z))
-    faces2.sort(key=compKeyFn(lambda mf: mf[0].Vertexes[0].Point.y))
-    faces2.sort(key=compKeyFn(lambda mf: mf[0].Vertexes[0].Point.x))
-
-    # Find faces with matching first vertex
-    i = 0
-    j = 0
-    j_match_start = 0
-    matching = False
-    candidate_mesh_faces = []
-    while i < len(faces1) and j < len(faces2):
-        bf = faces1[i][0]
-        mf = faces2[j][0]
-        if floatEqual(bf.Vertexes[0].Point.x, mf.Vertexes[0].Point.x):
-            if floatEqual(bf.Vertexes[0].Point.y, mf.Vertexes[0].Point.y):
-                if floatEqual(bf.Vertexes[0].Point.z, mf.Vertexes[0].Point.z):
-                    candidate_mesh_faces.append((i, j))
-                    cmp = 0
-                else:
-                    cmp = (-1 if bf.Vertexes[0].Point.z < mf.Vertexes[0].Point.z else 1)
-            else:
-                cmp = (-1 if bf.Vertexes[0].Point.y < mf.Vertexes[0].Point.y else 1)
-        else:
-            cmp = (-1 if bf.Vertexes[0].Point.x < mf.Vertexes[0].Point.x else 1)
-        if cmp == 0:
-            if not matching:
-                j_match_start = j
-            j += 1
-            matching = True
-            if j == len(faces2):
-                i += 1
-                j = j_match_start
-                matching = False
-        elif cmp < 0:
-            i += 1
-            if matching:
-                j = j_match_start
-            matching = False
-        elif cmp > 0:
-            j += 1
-            matching = False
-
-    # Do comprehensive matching, and reallocate to original index
-    successful_candidates = []
-    for k in range(len(candidate_mesh_faces)):
-        i, j = candidate_mesh_faces[k]
-        if isSameGeometry(faces1[i][0], faces2[j][0]):
-            successful_candidates.append((faces1[i][1], faces2[j][1]))
-
-    return successful_candidates
+    :return:  A list of (data1, data2) containing the user data for any/all matching faces, in the order of faces1
+    """
+    sig1 = ShapeSignatures([f[0] for f in faces1])
+    sig2 = ShapeSignatures([f[0] for f in faces2])
+    return [(faces1[i][1], faces2[j][1]) for i, j in zip(*matchShapeSignatures(sig1, sig2))]
+
+
+# Element type (as in the lists of a shape's elements) searched for a shape of each ShapeType, and the sub-element
+# types named by element names such as 'Face3'
+_ELEMENT_TYPES = {'Solid': 'Solids', 'CompSolid': 'Solids', 'Face': 'Faces', 'Shell': 'Faces', 'Edge': 'Edges',
+                  'Wire': 'Edges', 'Vertex': 'Vertexes'}
+_ELEMENT_NAME = re.compile(r'^(Solid|Face|Edge|Vertex)(\d+)$')
+
+
+class ShapeElementIndex:
+    """
+    Index of the elements of a shape, each part of which is built when first needed: the lists of solids, faces,
+    edges and vertices, their signatures for finding an element by its geometry, and the solids that each face and
+    edge belong to. Valid only for the shape it was built from; see getShapeElementIndex.
+    """
+    def __init__(self, shape):
+        self.shape = shape
+        self.elements = {}
+        self.signatures = {}
+        self.solids_containing = {}
+
+    def getElements(self, element_type):
+        """ The list of elements of the given type ('Solids', 'Faces', 'Edges' or 'Vertexes') """
+        elements = self.elements.get(element_type)
+        if elements is None:
+            elements = self.elements[element_type] = getattr(self.shape, element_type)
+        return elements
+
+    def getElement(self, name):
+        """ The element with the given name, e.g. 'Face3', or None if the shape has no such element """
+        match = _ELEMENT_NAME.match(name)
+        if not match:
+            return self.shape.getElement(name)
+        elements = self.getElements(_ELEMENT_TYPES[match.group(1)])
+        i = int(match.group(2)) - 1
+        return elements[i] if 0 <= i < len(elements) else None
+
+    def findSameGeometry(self, element):
+        """
+        Find the first element of the shape that is the same geometry (as tested by isSameGeometry) as element,
+        looking among the solids, faces, edges or vertices according to its ShapeType
+        :return: The index of the element in its list, or None if there is none
+        """
+        element_type = _ELEMENT_TYPES[element.ShapeType]
+        signatures = self.signatures.get(element_type)
+        if signatures is None:
+            signatures = self.signatures[element_type] = ShapeSignatures(self.getElements(element_type))
+        i, j = matchShapeSignatures(ShapeSignatures([element]), signatures)
+        return j[0] if j else None
+
+    def getSolidsContaining(self, element):
+        """ The indices of the solids that a face, edge or vertex of the shape is part of """
+        element_type = _ELEMENT_TYPES[element.ShapeType]
+        owners = self.solids_containing.get(element_type)
+        if owners is None:
+            # Bucket the solids' elements by hash code, which is the same for elements that are the same
+            owners = self.solids_containing[element_type] = {}
+            for k, solid in enumerate(self.getElements('Solids')):
+                for e in getattr(solid, element_type):
+                    owners.setdefault(e.hashCode(), []).append((e, k))
+        solids = []
+        for e, k in owners.get(element.hashCode(), []):
+            if e.isSame(element) and k not in solids:
+                solids.append(k)
+        return solids
+
+
+# Element indices of recently used shapes, most recently used last
+_element_index_cache = []
+ELEMENT_INDEX_CACHE_SIZE = 16
+
+
+def getShapeElementIndex(shape):
+    """
+    The ShapeElementIndex of a shape, re-used for as long as the same shape is passed. A document object's shape
+    changes when it is recomputed, so that its index is then built again.
+    """
+    for k, index in enumerate(_element_index_cache):
+        # Holding the shape in the index means that a new shape cannot re-use its identity
+        if index.shape.isSame(shape):
+            del _element_index_cache[k]
+            break
+    else:
+        index = ShapeElementIndex(shape)
+    _element_index_cache.append(index)
+    if len(_element_index_cache) > ELEMENT_INDEX_CACHE_SIZE:
+        del _element_index_cache[0]
+    return index
 
 
 def makeShapeFromReferences(refs, raise_error=True):
@@ -1537,18 +1704,16 @@ def resolveReference(r, raise_error=True):
     obj = r[0]
     if not r[1] or r[1] == ('',):
         return [(obj.Shape, (r[0], None))]
+    index = getShapeElementIndex(obj.Shape)
     f = []
     for rr in r[1]:
         try:
-            if rr.startswith('Solid'):  # getElement doesn't work with solids for some reason
-                f += [(obj.Shape.Solids[int(rr.lstrip('Solid')) - 1], (r[0], rr))]
+            ff = index.getElement(rr)
+            if ff is None:
+                if raise_error:
+                    raise RuntimeError("Face '{}:{}' was not found - geometry may have changed".format(r[0].Name, rr))
             else:
-                ff = obj.Shape.getElement(rr)
-                if ff is None:
-                    if raise_error:
-                        raise RuntimeError("Face '{}:{}' was not found - geometry may have changed".format(r[0].Name, rr))
-                else:
-                    f += [(ff, (r[0], rr))]
+                f += [(ff, (r[0], rr))]
         except Part.OCCError:
             if raise_error:
                 raise RuntimeError("Face '{}:{}' was not found - geometry may have changed".format(r[0].Name, r[1]))
@@ -1659,20 +1824,6 @@ def openFileManager(case_path):
         subprocess.Popen(['explorer', case_path])
 
 
-def writePatchToStl(solid_name, face_mesh, fid, scale=1):
-    fid.write("solid {}\n".format(solid_name))
-    for face in face_mesh.Facets:
-        n = face.Normal
-        fid.write(" facet normal {} {} {}\n".format(n[0], n[1], n[2]))
-        fid.write("  outer loop\n")
-        for i in range(3):
-            p = [i * scale for i in face.Points[i]]
-            fid.write("   vertex {} {} {}\n".format(p[0], p[1], p[2]))
-        fid.write("  endloop\n")
-        fid.write(" endfacet\n")
-    fid.write("endsolid {}\n".format(solid_name))
-
-
 def enableLayoutRows(layout, selected_rows):
     if isinstance(layout, QFormLayout):
         for rowi in range(layout.count()):
@@ -1717,6 +1868,48 @@ def clearCase(case_path, backup_path=None):
         os.makedirs(case_path)  # mkdir -p
 
 
+def clearCaseResults(case_path):
+    """
+    Remove the solution time directories (other than the initial one) and post-processing output from the case
+    directory and its processor directories, leaving the mesh, decomposition and input files in place
+    """
+    proc_dirs = [d for d in glob.glob(os.path.join(case_path, 'processor*')) if os.path.isdir(d)]
+    for d in [case_path] + proc_dirs:
+        for entry in os.scandir(d):
+            if entry.is_dir() and entry.name != '0':
+                try:
+                    float(entry.name)
+                except ValueError:
+                    continue
+                shutil.rmtree(entry.path)
+    shutil.rmtree(os.path.join(case_path, 'postProcessing'), ignore_errors=True)
+
+
+CASE_MANIFEST_NAME = 'caseManifest.json'
+
+
+def hashFileContents(contents):
+    """ Content hash used to detect changed case files """
+    return hashlib.sha1(contents).hexdigest()
+
+
+def readCaseManifest(case_path):
+    """
+    Return the dictionary of {relative file path: content hash} recorded by the last incremental case write,
+    or None if there is none
+    """
+    try:
+        with open(os.path.join(case_path, CASE_MANIFEST_NAME)) as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return None
+
+
+def writeCaseManifest(case_path, manifest):
+    with open(os.path.join(case_path, CASE_MANIFEST_NAME), 'w') as fid:
+        json.dump(manifest, fid, indent=1, sort_keys=True)
+
+
 def executeMacro(macro_name):
     macro_contents = "import FreeCAD\nimport FreeCADGui\nimport FreeCAD as App\nimport FreeCADGui as Gui\n"
     macro_contents += open(macro_name).read()
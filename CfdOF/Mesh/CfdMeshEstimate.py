@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+
+# Estimation, before meshing, of the number of cells a mesher will produce and the memory it will need, so that
+# meshes too large for the machine can be caught before they are run. The estimates are from the base cell size,
+# the volume and surface area of the part and the refinement regions, and are only expected to be good to within a
+# factor of about two.
+
+import os
+import math
+import ctypes
+import multiprocessing
+
+from FreeCAD import Units
+from CfdOF import CfdTools
+from CfdOF.Mesh import CfdMeshTools
+
+# Cells per cube of the local cell size: hexahedra for cfMesh and snappyHexMesh, and regular tetrahedra for gmsh
+CELLS_PER_VOLUME = {'cfMesh': 1.0, 'snappyHexMesh': 1.0, 'gmsh': 6*math.sqrt(2)}
+# Faces per square of the local cell size on a surface: quadrilaterals, or equilateral triangles for gmsh
+FACES_PER_AREA = {'cfMesh': 1.0, 'snappyHexMesh': 1.0, 'gmsh': 4/math.sqrt(3)}
+# A polyhedral dual mesh has a cell per point of the tetrahedral mesh, and a 2D one a cell per point of the triangles
+DUAL_CELLS_PER_CELL = 1/5.5
+DUAL_FACES_PER_FACE = 1/2
+# Peak memory of each mesher per cell while meshing, and of each process regardless of the mesh (bytes)
+MEMORY_PER_CELL = {'cfMesh': 1000, 'snappyHexMesh': 2000, 'gmsh': 1500}
+MEMORY_PER_PROCESS = 200*1024**2
+# Size of mesh for which it is worth adding a process to snappyHexMesh
+CELLS_PER_PROCESS = 200000
+
+
+def getAvailableMemory():
+    """
+    The memory available to new processes without swapping
+    :return: The size in bytes, or None if it could not be found
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1])*1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if os.name == 'nt':
+        class MemoryStatusEx(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong),
+                        ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong),
+                        ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong),
+                        ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong),
+                        ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MemoryStatusEx()
+        status.dwLength = ctypes.sizeof(MemoryStatusEx)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+    try:
+        # No measure of available memory, so fall back to the physical memory
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def formatBytes(num_bytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if num_bytes < 1024:
+            return '{:.1f} {}'.format(num_bytes, unit)
+        num_bytes /= 1024
+    return '{:.1f} TB'.format(num_bytes)
+
+
+def sumLevels(level, factor, start=1):
+    """
+    :return: The sum of factor**l for refinement levels l from start to level
+    """
+    return sum(factor**l for l in range(start, level + 1))
+
+
+def clampRelativeLength(rel_len):
+    return min(max(rel_len, 0.001), 1.0)
+
+
+def estimateMesh(mesh_obj):
+    """
+    Estimate the size of the mesh of mesh_obj, the peak memory needed to make it, and the number of processes
+    (snappyHexMesh) or threads (cfMesh, gmsh) to use. Cells are counted as the volume of the part at the base cell
+    size, plus bands of CellsBetweenLevels cells at each level of refinement around refined surfaces and edges, refined
+    internal volumes, boundary layers and extrusions.
+    :return: A dictionary of the estimate, with 'cells' in the final mesh, 'meshingCells' before any extrusion to 2D,
+    'memory' and 'availableMemory' in bytes, the suggested 'numberOfProcesses' and 'numberOfThreads', and 'warnings'
+    """
+    mesher = mesh_obj.MeshUtility
+    dual = mesh_obj.ConvertToDualMesh
+    shape = mesh_obj.Part.Shape
+    h0 = CfdMeshTools.getCharacteristicLengthMax(mesh_obj)
+    if h0 <= 0:
+        raise RuntimeError("The characteristic length of the mesh must be positive.")
+    if mesher == 'snappyHexMesh':
+        num_between = max(mesh_obj.CellsBetweenLevels, 1)
+    else:
+        num_between = 1
+
+    volume = shape.Volume
+    if volume <= 0:
+        bound_box = shape.BoundBox
+        volume = bound_box.XLength*bound_box.YLength*bound_box.ZLength
+    cells = volume/h0**3
+    faces_2d = None
+
+    if mesher == 'snappyHexMesh':
+        edge_level = CfdTools.relLenToRefinementLevel(clampRelativeLength(mesh_obj.EdgeRefinement))
+        if edge_level > 0:
+            edge_length = sum(e.Length for e in shape.Edges)
+            cells += math.pi*num_between**2*edge_length/h0*sumLevels(edge_level, 2)
+
+    for mr_obj in CfdTools.getMeshRefinementObjs(mesh_obj):
+        level = CfdTools.relLenToRefinementLevel(clampRelativeLength(mr_obj.RelativeLength))
+        if mr_obj.Extrusion:
+            area = mr_obj.Shape.Area
+            if mr_obj.ExtrusionType in ['2DPlanar', '2DWedge']:
+                faces_2d = area/h0**2
+            else:
+                cells += mr_obj.ExtrusionLayers*area/h0**2
+            continue
+        ref_shape = CfdTools.makeShapeFromReferences(mr_obj.ShapeRefs, False)
+        if ref_shape is None:
+            continue
+        if mr_obj.Internal:
+            cells += ref_shape.Volume*(8**level - 1)/h0**3
+            continue
+        area = ref_shape.Area
+        cells += area*num_between/h0**2*sumLevels(level, 4)
+        if mesher == 'cfMesh':
+            thickness = Units.Quantity(mr_obj.RefinementThickness).Value
+            cells += area*thickness*8**level/h0**3
+        elif mesher == 'snappyHexMesh':
+            region_edge_level = CfdTools.relLenToRefinementLevel(clampRelativeLength(mr_obj.RegionEdgeRefinement))
+            if region_edge_level > level:
+                edge_length = sum(e.Length for e in ref_shape.Edges)
+                cells += math.pi*num_between**2*edge_length/h0*sumLevels(region_edge_level, 2, level + 1)
+        if mesher != 'gmsh' and mr_obj.NumberLayers > 0:
+            cells += mr_obj.NumberLayers*area*4**level/h0**2
+
+    meshing_cells = cells*CELLS_PER_VOLUME[mesher]
+    if dual:
+        meshing_cells *= DUAL_CELLS_PER_CELL
+    if faces_2d is None:
+        final_cells = meshing_cells
+    else:
+        final_cells = faces_2d*FACES_PER_AREA[mesher]
+        if dual:
+            final_cells *= DUAL_FACES_PER_FACE
+
+    num_cpus = multiprocessing.cpu_count()
+    num_processes = mesh_obj.NumberOfProcesses if mesh_obj.NumberOfProcesses > 0 else num_cpus
+    memory = MEMORY_PER_PROCESS*num_processes + MEMORY_PER_CELL[mesher]*meshing_cells
+    available_memory = getAvailableMemory()
+
+    if mesher == 'snappyHexMesh':
+        suggested_processes = min(max(int(math.ceil(meshing_cells/CELLS_PER_PROCESS)), 1), num_cpus)
+        suggested_threads = 1
+    else:
+        # cfMesh and gmsh are multi-threaded; running in parallel processes only adds the cost of decomposing
+        suggested_processes = 1
+        suggested_threads = num_cpus
+
+    warnings = []
+    if available_memory is not None and memory > available_memory:
+        warnings.append("The mesher is estimated to need {} of memory, but only {} is available. Consider "
+                        "increasing the characteristic length or reducing refinement.".format(
+                            formatBytes(memory), formatBytes(available_memory)))
+
+    return {'cells': int(final_cells),
+            'meshingCells': int(meshing_cells),
+            'memory': int(memory),
+            'availableMemory': available_memory,
+            'numberOfProcesses': suggested_processes,
+            'numberOfThreads': suggested_threads,
+            'warnings': warnings}
+
+
+def formatMeshEstimate(estimate):
+    """
+    :return: The estimate as a list of lines of text
+    """
+    lines = ['Estimated cells: {:,}'.format(estimate['cells'])]
+    if estimate['meshingCells'] != estimate['cells']:
+        lines.append('Estimated cells before extrusion to 2D: {:,}'.format(estimate['meshingCells']))
+    memory = 'Estimated peak memory: ' + formatBytes(estimate['memory'])
+    if estimate['availableMemory'] is not None:
+        memory += ' (available: {})'.format(formatBytes(estimate['availableMemory']))
+    lines.append(memory)
+    lines.append('Suggested number of processes: {}, threads: {}'.format(
+        estimate['numberOfProcesses'], estimate['numberOfThreads']))
+    return lines
@@ -0,0 +1,277 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+
+# Analysis of the logs of the meshers and of checkMesh into a report of the size, quality and cost of a mesh, which
+# is stored as JSON in the mesh case. This module does not depend on FreeCAD, so that it can be used without it.
+
+import os
+import re
+import json
+import tempfile
+
+from CfdOF.Mesh import CfdPolyMesh
+
+MESH_REPORT_FILE_NAME = 'meshReport.json'
+
+_NUMBER = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+_EXECUTION_TIME = re.compile(r'^ExecutionTime = {0} s\s+ClockTime = {0} s'.format(_NUMBER), re.MULTILINE)
+
+# checkMesh
+_CHECK_MESH_TIME = re.compile(r'^Time = .*$', re.MULTILINE)
+_MESH_STAT = re.compile(r'^\s+(points|faces|internal faces|cells|faces per cell|boundary patches|point zones|'
+                        r'face zones|cell zones):\s+{}\s*$'.format(_NUMBER), re.MULTILINE)
+_CELL_TYPES = re.compile(r'^Overall number of cells of each type:\n((?:\s+[\w ]+:\s+\d+\n)+)', re.MULTILINE)
+_CELL_TYPE = re.compile(r'^\s+([\w ]+?):\s+(\d+)$', re.MULTILINE)
+_PATCH_TABLE = re.compile(r'^\s+Patch\s+Faces\s+Points\s+.*\n((?:\s+\S+\s+\d+\s+\d+.*\n)+)', re.MULTILINE)
+_PATCH_ROW = re.compile(r'^\s+(\S+)\s+(\d+)\s+(\d+)\s+(.*?)\s*$', re.MULTILINE)
+_CHECK_MESH_VALUES = [
+    ('boundingBox', re.compile(r'Overall domain bounding box \({0} {0} {0}\) \({0} {0} {0}\)'.format(_NUMBER))),
+    ('nonOrthogonality', re.compile(r'Mesh non-orthogonality Max: {0} average: {0}'.format(_NUMBER))),
+    ('maxSkewness', re.compile(r'Max skewness = {}'.format(_NUMBER))),
+    ('maxAspectRatio', re.compile(r'Max aspect ratio = {}'.format(_NUMBER))),
+    ('faceArea', re.compile(r'Minimum face area = {0}\. Maximum face area = {0}\.'.format(_NUMBER))),
+    ('volume', re.compile(r'Min volume = {0}\. Max volume = {0}\.\s+Total volume = {0}\.'.format(_NUMBER))),
+    ('faceFlatness', re.compile(r'Face flatness \(1 = flat, 0 = butterfly\) : min = {0}\s+average = {0}'.format(
+        _NUMBER))),
+    ('cellDeterminant', re.compile(r'Cell determinant \(wellposedness\) : minimum: {0} average: {0}'.format(_NUMBER)))
+]
+_FAILED_CHECKS = re.compile(r'^Failed (\d+) mesh checks', re.MULTILINE)
+_FAILED_CHECK_MESSAGE = re.compile(r'^\s*\*\*\*(.*?)\s*$', re.MULTILINE)
+_MESH_QUALITY_FACES = re.compile(r'(\d+) faces in error to set meshQualityFaces')
+
+# snappyHexMesh
+_SNAPPY_PHASE_TIME = re.compile(r'^(Mesh refined|Mesh snapped|Layers added|Finished meshing) in = {} s'.format(
+    _NUMBER), re.MULTILINE)
+_SNAPPY_PHASE_MESH = re.compile(r'^(Refined|Snapped|Layer) mesh : cells:(\d+)\s+faces:(\d+)\s+points:(\d+)',
+                                re.MULTILINE)
+_LAYER_TABLE = re.compile(r'^patch\s+faces\s+layers.*\n.*\n\s*-----.*\n((?:.+\n)*)', re.MULTILINE)
+_LAYER_ROW = re.compile(r'^\s*(\S+)\s+(\d+)\s+{0}\s+{0}\s+{0}\s*$'.format(_NUMBER), re.MULTILINE)
+
+# gmsh
+_GMSH_PHASE_TIME = re.compile(r'Done meshing (\d)D \((?:Wall )?{}\s*s'.format(_NUMBER))
+_GMSH_SIZE = re.compile(r'Info\s*:\s*(\d+) nodes (\d+) elements')
+_GMSH_WARNING = re.compile(r'^Warning\s*:', re.MULTILINE)
+
+
+def parseExecutionTime(text, report):
+    match = None
+    for match in _EXECUTION_TIME.finditer(text):
+        pass
+    if match:
+        report['executionTime'] = float(match.group(1))
+        report['clockTime'] = float(match.group(2))
+
+
+def parseCheckMeshLog(text):
+    """
+    Analyse the output of checkMesh (with or without -meshQuality). If several times were checked, only the last is
+    reported.
+    :return: Dictionary of mesh statistics and quality measures
+    """
+    times = list(_CHECK_MESH_TIME.finditer(text))
+    if times:
+        text = text[times[-1].end():]
+    report = {}
+    for match in _MESH_STAT.finditer(text):
+        key = re.sub(r' (\w)', lambda m: m.group(1).upper(), match.group(1))
+        # The number of faces per cell is an average; the rest are counts
+        report[key] = float(match.group(2)) if key == 'facesPerCell' else int(float(match.group(2)))
+    match = _CELL_TYPES.search(text)
+    if match:
+        report['cellTypes'] = {name.strip(): int(count) for name, count in _CELL_TYPE.findall(match.group(1))}
+    match = _PATCH_TABLE.search(text)
+    if match:
+        report['patches'] = [{'name': name, 'faces': int(faces), 'points': int(points), 'topology': topology}
+                             for name, faces, points, topology in _PATCH_ROW.findall(match.group(1))]
+    for key, regex in _CHECK_MESH_VALUES:
+        match = regex.search(text)
+        if match:
+            values = [float(v) for v in match.groups()]
+            if key == 'boundingBox':
+                report[key] = [values[:3], values[3:]]
+            elif key == 'nonOrthogonality':
+                report['maxNonOrthogonality'], report['averageNonOrthogonality'] = values
+            elif key == 'faceArea':
+                report['minFaceArea'], report['maxFaceArea'] = values
+            elif key == 'volume':
+                report['minVolume'], report['maxVolume'], report['totalVolume'] = values
+            elif key == 'faceFlatness':
+                report['minFaceFlatness'], report['averageFaceFlatness'] = values
+            elif key == 'cellDeterminant':
+                report['minCellDeterminant'], report['averageCellDeterminant'] = values
+            else:
+                report[key] = values[0]
+    match = _FAILED_CHECKS.search(text)
+    if match:
+        report['failedChecks'] = int(match.group(1))
+    elif 'Mesh OK.' in text:
+        report['failedChecks'] = 0
+    report['failedCheckMessages'] = _FAILED_CHECK_MESSAGE.findall(text)
+    match = _MESH_QUALITY_FACES.search(text)
+    report['meshQualityFaces'] = int(match.group(1)) if match else 0
+    parseExecutionTime(text, report)
+    return report
+
+
+def parseSnappyHexMeshLog(text):
+    """
+    Analyse the output of snappyHexMesh
+    :return: Dictionary of the time taken by each phase (s), the mesh size after each phase, and the layers added to
+    each patch
+    """
+    report = {}
+    phase_names = {'Mesh refined': 'refine', 'Mesh snapped': 'snap', 'Layers added': 'addLayers',
+                   'Finished meshing': 'total'}
+    for phase, seconds in _SNAPPY_PHASE_TIME.findall(text):
+        report.setdefault('phaseTimes', {})[phase_names[phase]] = float(seconds)
+    mesh_names = {'Refined': 'refine', 'Snapped': 'snap', 'Layer': 'addLayers'}
+    for phase, cells, faces, points in _SNAPPY_PHASE_MESH.findall(text):
+        report.setdefault('phaseMeshes', {})[mesh_names[phase]] = {
+            'cells': int(cells), 'faces': int(faces), 'points': int(points)}
+    tables = _LAYER_TABLE.findall(text)
+    if tables:
+        report['layers'] = [{'patch': patch, 'faces': int(faces), 'layers': float(layers),
+                             'thickness': float(thickness), 'thicknessFraction': float(fraction)/100}
+                            for patch, faces, layers, thickness, fraction in _LAYER_ROW.findall(tables[-1])]
+    parseExecutionTime(text, report)
+    return report
+
+
+def parseCartesianMeshLog(text):
+    """
+    Analyse the output of cfMesh's cartesianMesh
+    :return: Dictionary of the time taken
+    """
+    report = {}
+    parseExecutionTime(text, report)
+    return report
+
+
+def parseGmshLog(text):
+    """
+    Analyse the output of gmsh
+    :return: Dictionary of the time taken to mesh in each dimension (s), the mesh size and the number of warnings
+    """
+    report = {}
+    for dimension, seconds in _GMSH_PHASE_TIME.findall(text):
+        report.setdefault('phaseTimes', {})[dimension + 'D'] = float(seconds)
+    sizes = _GMSH_SIZE.findall(text)
+    if sizes:
+        report['nodes'] = int(sizes[-1][0])
+        report['elements'] = int(sizes[-1][1])
+    report['warnings'] = len(_GMSH_WARNING.findall(text))
+    return report
+
+
+# Parser for the log of each application
+LOG_PARSERS = {
+    'snappyHexMesh': parseSnappyHexMeshLog,
+    'cartesianMesh': parseCartesianMeshLog,
+    'gmsh': parseGmshLog,
+    'checkMesh': parseCheckMeshLog
+}
+
+
+def parseMeshLogs(case_dir):
+    """
+    Analyse the logs (log.<application>) of the meshers and of checkMesh in a mesh case. A checkMesh log is ignored
+    if it is older than the mesh.
+    :return: Dictionary of the report from each log, by application
+    """
+    try:
+        mesh_time = os.path.getmtime(CfdPolyMesh.findFoamFile(
+            os.path.join(case_dir, 'constant', 'polyMesh', 'owner')))
+    except (OSError, RuntimeError):
+        mesh_time = None
+    report = {}
+    for application, parser in LOG_PARSERS.items():
+        log_file = os.path.join(case_dir, 'log.' + application)
+        try:
+            if application == 'checkMesh' and mesh_time is not None and os.path.getmtime(log_file) < mesh_time:
+                continue
+            with open(log_file, errors='replace') as fid:
+                report[application] = parser(fid.read())
+        except OSError:
+            pass
+    return report
+
+
+def readMeshReport(case_dir):
+    """ :return: The report stored in a mesh case, or an empty dictionary if there is none """
+    try:
+        with open(os.path.join(case_dir, MESH_REPORT_FILE_NAME)) as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return {}
+
+
+def writeMeshReport(case_dir, report):
+    """ Store a report in a mesh case """
+    fd, temp_file = tempfile.mkstemp(dir=case_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fid:
+            json.dump(report, fid, indent=4)
+        os.replace(temp_file, os.path.join(case_dir, MESH_REPORT_FILE_NAME))
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def formatMeshReport(report):
+    """ :return: Lines of text describing a report from parseMeshLogs, with any polyMesh summary """
+    lines = []
+    snappy = report.get('snappyHexMesh')
+    if snappy:
+        phase_labels = [('refine', 'refined'), ('snap', 'snapped'), ('addLayers', 'layers added'), ('total', 'total')]
+        times = snappy.get('phaseTimes', {})
+        if times:
+            lines.append("snappyHexMesh: " + ", ".join(
+                "{} in {:g} s".format(label, times[phase]) for phase, label in phase_labels if phase in times))
+        for layer in snappy.get('layers', []):
+            lines.append("Layers on {}: {:g} on average, {:.0f}% of specified thickness".format(
+                layer['patch'], layer['layers'], 100*layer['thicknessFraction']))
+    gmsh = report.get('gmsh')
+    if gmsh:
+        times = gmsh.get('phaseTimes', {})
+        lines.append("gmsh: " + ", ".join(["{} in {:g} s".format(dim, times[dim]) for dim in sorted(times)] +
+                                          ["{} warnings".format(gmsh['warnings'])]))
+    for application in ('snappyHexMesh', 'cartesianMesh'):
+        if 'clockTime' in report.get(application, {}):
+            lines.append("{} clock time: {:g} s".format(application, report[application]['clockTime']))
+    if 'polyMesh' in report:
+        lines += CfdPolyMesh.formatSummary(report['polyMesh'])
+    check = report.get('checkMesh')
+    if check:
+        if 'cellTypes' in check:
+            lines.append("Cells by type: " + ", ".join(
+                "{} {}".format(count, name) for name, count in check['cellTypes'].items() if count))
+        if 'maxNonOrthogonality' in check:
+            lines.append("checkMesh non-orthogonality max: {:g}, average: {:g}".format(
+                check['maxNonOrthogonality'], check['averageNonOrthogonality']))
+        if 'maxSkewness' in check:
+            lines.append("checkMesh max skewness: {:g}".format(check['maxSkewness']))
+        if 'failedChecks' in check:
+            lines.append("Failed mesh checks: {}".format(check['failedChecks']))
+        lines += check.get('failedCheckMessages', [])
+    return lines
@@ -27,14 +27,32 @@
 import FreeCAD
 from FreeCAD import Units
 import os
+import re
+import shutil
 import tempfile
 from CfdOF import CfdTools
+from CfdOF import CfdDecomposition
 import math
-import MeshPart
+import multiprocessing
 from CfdOF.TemplateBuilder import TemplateBuilder
+from CfdOF.Mesh import CfdSurfaceTriangulation
 import Part
 
 
+def getCharacteristicLengthMax(mesh_obj):
+    """
+    The base cell size of the mesh, defaulting to 2 % of the bounding box characteristic length
+    :return: The length in internal format, i.e. mm
+    """
+    clmax = Units.Quantity(mesh_obj.CharacteristicLengthMax).Value
+    if clmax <= 0.0:
+        shape = mesh_obj.Part.Shape
+        cl_bound_mag = math.sqrt(shape.BoundBox.XLength**2 + shape.BoundBox.YLength**2 + shape.BoundBox.ZLength**2)
+        cl_bound_min = min(min(shape.BoundBox.XLength, shape.BoundBox.YLength), shape.BoundBox.ZLength)
+        clmax = min(0.02*cl_bound_mag, 0.4*cl_bound_min)
+    return clmax
+
+
 class CfdMeshTools:
     def __init__(self, cart_mesh_obj):
         self.mesh_obj = cart_mesh_obj
@@ -43,13 +61,7 @@ class CfdMeshTools:
         self.part_obj = self.mesh_obj.Part  # Part to mesh
         self.scale = 0.001  # Scale mm to m
 
-        # Default to 2 % of bounding box characteristic length
-        self.clmax = Units.Quantity(self.mesh_obj.CharacteristicLengthMax).Value
-        if self.clmax <= 0.0:
-            shape = self.part_obj.Shape
-            cl_bound_mag = math.sqrt(shape.BoundBox.XLength**2 + shape.BoundBox.YLength**2 + shape.BoundBox.ZLength**2)
-            cl_bound_min = min(min(shape.BoundBox.XLength, shape.BoundBox.YLength), shape.BoundBox.ZLength)
-            self.clmax = min(0.02*cl_bound_mag, 0.4*cl_bound_min)  # Always in internal format, i.e. mm
+        self.clmax = getCharacteristicLengthMax(self.mesh_obj)
 
         # Only used by gmsh - what purpose?
         self.clmin = 0.0
@@ -184,6 +196,7 @@ class CfdMeshTools:
         self.triSurfaceDir = os.path.join(self.constantDir, 'triSurface')
         self.gmshDir = os.path.join(self.mesh_case_dir, 'gmsh')
         self.systemDir = os.path.join(self.mesh_case_dir, 'system')
+        self.triangulation_cache_dir = getTriangulationCacheDir(output_dir)
 
         if self.mesh_obj.MeshUtility == "gmsh":
             self.temp_file_shape = os.path.join(self.gmshDir, self.part_obj.Name +"_Geometry.brep")
@@ -212,12 +225,18 @@ class CfdMeshTools:
         snappy_settings['InternalRegions'] = {}
         snappy_settings['MovingMeshRegions'] = {}
 
-        # Make list of all faces in meshed shape with original index
-        mesh_face_list = list(zip(self.mesh_obj.Part.Shape.Faces, range(len(self.mesh_obj.Part.Shape.Faces))))
+        # Surfaces to be triangulated once all have been collected: (shape, path, name)
+        surface_meshes = []
+
+        # Signatures of all faces in meshed shape, by original index. These, and those of the references below, are
+        # cached with the document and only recomputed once the geometry has changed
+        mesh_face_sigs = CfdTools.getShapeSignatures(self.mesh_obj.Part)
+        num_mesh_faces = len(mesh_face_sigs)
 
         # Make list of all boundary references
         CfdTools.cfdMessage("Matching boundary patches\n")
-        boundary_face_list = []
+        boundary_face_sigs = []
+        boundary_face_data = []
         bc_group = None
         analysis_obj = CfdTools.getParentAnalysisObject(self.mesh_obj)
         if not analysis_obj:
@@ -227,17 +246,20 @@ class CfdMeshTools:
         for bc_id, bc_obj in enumerate(bc_group):
             for ri, ref in enumerate(bc_obj.ShapeRefs):
                 try:
-                    bf = CfdTools.resolveReference(ref)
+                    bf = CfdTools.getReferenceSignatures(ref)
                 except RuntimeError as re:
                     raise RuntimeError("Error processing boundary condition {}: {}".format(bc_obj.Label, str(re)))
                 for si, s in enumerate(bf):
-                    boundary_face_list += [(sf, (bc_id, ri, si)) for sf in s[0].Faces]
+                    boundary_face_sigs.append(s)
+                    boundary_face_data += [(bc_id, ri, si)]*len(s)
+        boundary_face_sigs = CfdTools.ShapeSignatures.concatenate(boundary_face_sigs)
 
         # Match them up to faces in the main geometry
-        bc_matched_faces = CfdTools.matchFaces(boundary_face_list, mesh_face_list)
+        bc_matched_faces = [(boundary_face_data[i], j)
+                            for i, j in zip(*CfdTools.matchShapeSignatures(boundary_face_sigs, mesh_face_sigs))]
 
         # Check for and filter duplicates
-        bc_match_per_shape_face = [-1] * len(mesh_face_list)
+        bc_match_per_shape_face = [-1] * num_mesh_faces
         bc_matched = [False] * len(bc_group)
         for k in range(len(bc_matched_faces)):
             match = bc_matched_faces[k][1]
@@ -260,7 +282,8 @@ class CfdMeshTools:
         # all surface mesh refinements for snappyHexMesh, and extrusion patches for all meshers.
         # For cfMesh, surface mesh refinements are written as separate surfaces so need not be matched
         CfdTools.cfdMessage("Matching mesh refinement regions\n")
-        mr_face_list = []
+        mr_face_sigs = []
+        mr_face_data = []
         for mr_id, mr_obj in enumerate(mr_objs):
             if mr_obj.Extrusion or (
                 self.mesh_obj.MeshUtility == 'cfMesh' and not mr_obj.Internal and mr_obj.NumberLayers > 0) or (
@@ -268,18 +291,21 @@ class CfdMeshTools:
             ):
                 for ri, r in enumerate(mr_obj.ShapeRefs):
                     try:
-                        bf = CfdTools.resolveReference(r)
+                        bf = CfdTools.getReferenceSignatures(r)
                     except RuntimeError as re:
                         raise RuntimeError("Error processing mesh refinement {}: {}".format(
                             mr_obj.Label, str(re)))
                     for si, s in enumerate(bf):
-                        mr_face_list += [(f, (mr_id, ri, si)) for f in s[0].Faces]
+                        mr_face_sigs.append(s)
+                        mr_face_data += [(mr_id, ri, si)]*len(s)
+        mr_face_sigs = CfdTools.ShapeSignatures.concatenate(mr_face_sigs)
 
         # Match them up to the primary geometry
-        mr_matched_faces = CfdTools.matchFaces(mr_face_list, mesh_face_list)
+        mr_matched_faces = [(mr_face_data[i], j)
+                            for i, j in zip(*CfdTools.matchShapeSignatures(mr_face_sigs, mesh_face_sigs))]
 
         # Check for and filter duplicates
-        mr_match_per_shape_face = [-1] * len(mesh_face_list)
+        mr_match_per_shape_face = [-1] * num_mesh_faces
         for k in range(len(mr_matched_faces)):
             match = mr_matched_faces[k][1]
             prev_k = mr_match_per_shape_face[match]
@@ -302,7 +328,7 @@ class CfdMeshTools:
             for l in range(len(mr_objs)+1):
                 self.patch_faces[k].append([])
                 self.patch_names[k].append("patch_"+str(k)+"_"+str(l))
-        for i in range(len(mesh_face_list)):
+        for i in range(num_mesh_faces):
             k = bc_match_per_shape_face[i]
             l = mr_match_per_shape_face[i]
             nb = -1
@@ -316,24 +342,27 @@ class CfdMeshTools:
         # For gmsh, match mesh refinement with vertices in original mesh
         mr_matched_vertices = []
         if self.mesh_obj.MeshUtility == 'gmsh':
-            # Make list of all vertices in meshed shape with original index
-            mesh_vertices_list = list(
-                zip(self.mesh_obj.Part.Shape.Vertexes, range(len(self.mesh_obj.Part.Shape.Vertexes))))
+            # Signatures of all vertices in meshed shape, by original index
+            mesh_vertex_sigs = CfdTools.getShapeSignatures(self.mesh_obj.Part, 'Vertexes')
 
             CfdTools.cfdMessage("Matching mesh refinements\n")
-            mr_vertices_list = []
+            mr_vertex_sigs = []
+            mr_vertex_data = []
             for mr_id, mr_obj in enumerate(mr_objs):
                 if not mr_obj.Internal:
                     for ri, r in enumerate(mr_obj.ShapeRefs):
                         try:
-                            bf = CfdTools.resolveReference(r)
+                            bf = CfdTools.getReferenceSignatures(r, 'Vertexes')
                         except RuntimeError as re:
                             raise RuntimeError("Error processing mesh refinement {}: {}".format(
                                 mr_obj.Label, str(re)))
                         for si, s in enumerate(bf):
-                            mr_vertices_list += [(v, (mr_id, ri, si)) for v in s[0].Vertexes]
+                            mr_vertex_sigs.append(s)
+                            mr_vertex_data += [(mr_id, ri, si)]*len(s)
+            mr_vertex_sigs = CfdTools.ShapeSignatures.concatenate(mr_vertex_sigs)
 
-            mr_matched_vertices = CfdTools.matchFaces(mr_vertices_list, mesh_vertices_list)
+            mr_matched_vertices = [(mr_vertex_data[i], j)
+                                   for i, j in zip(*CfdTools.matchShapeSignatures(mr_vertex_sigs, mesh_vertex_sigs))]
             self.ele_length_map = {}
             self.ele_node_map = {}
 
@@ -342,7 +371,8 @@ class CfdMeshTools:
         # Also matches baffles to surface mesh refinements
         bc_mr_matched_faces = []
         if self.mesh_obj.MeshUtility == 'snappyHexMesh':
-            bc_mr_matched_faces = CfdTools.matchFaces(boundary_face_list, mr_face_list)
+            bc_mr_matched_faces = [(boundary_face_data[i], mr_face_data[j])
+                                   for i, j in zip(*CfdTools.matchShapeSignatures(boundary_face_sigs, mr_face_sigs))]
             for k in range(len(bc_mr_matched_faces)):
                 nb, ri, si = bc_mr_matched_faces[k][0]
                 bc_matched[nb] = True
@@ -377,7 +407,7 @@ class CfdMeshTools:
                     solid_name = bc_obj.Name + "_" + str(ri)
                     if shape:
                         CfdTools.cfdMessage("Triangulating baffle {}, section {}\n".format(bc_obj.Label, ri))
-                        writeSurfaceMeshFromShape(shape, self.triSurfaceDir, solid_name, self.mesh_obj)
+                        surface_meshes.append((shape, self.triSurfaceDir, solid_name))
 
                         if ri > 0:  # The parts of the baffle corresponding to a surface mesh region obj
                             mr_obj = mr_objs[ri-1]
@@ -453,7 +483,7 @@ class CfdMeshTools:
                             raise RuntimeError("Error processing mesh refinement region {}: {}".format(
                                 mr_obj.Label, str(re)))
                         if shape:
-                            writeSurfaceMeshFromShape(shape, self.triSurfaceDir, mr_patch_name, self.mesh_obj)
+                            surface_meshes.append((shape, self.triSurfaceDir, mr_patch_name))
 
                         refinement_level = CfdTools.relLenToRefinementLevel(mr_obj.RelativeLength)
                         if self.mesh_obj.MeshUtility == 'cfMesh':
@@ -514,6 +544,8 @@ class CfdMeshTools:
                                 # 'FinalLayerHeight': self.scale * Units.Quantity(mr_obj.FinalLayerHeight).Value
                             }
 
+        writeSurfaceMeshesFromShapes(surface_meshes, self.mesh_obj, cache_dir=self.triangulation_cache_dir)
+
     def automaticInsidePointDetect(self):
         # Snappy requires that the chosen internal point must remain internal during the meshing process and therefore
         # the meshing algorithm might fail if the point accidentally falls in a sliver between the mesh and the geometry
@@ -559,22 +591,27 @@ class CfdMeshTools:
             print(self.temp_file_shape)
             self.part_obj.Shape.exportBrep(self.temp_file_shape)
         else:
-            with open(self.temp_file_geo, 'w') as fid:
-                for k in range(len(self.patch_faces)):
-                    for l in range(len(self.patch_faces[k])):
-                        patch_faces = self.patch_faces[k][l]
-                        patch_name = self.patch_names[k][l]
-                        if len(patch_faces):
-                            # Put together the faces making up this patch; mesh them and output to file
-                            faces = self.mesh_obj.Part.Shape.Faces
-                            patch_shape = Part.makeCompound([faces[f] for f in patch_faces])
-                            CfdTools.cfdMessage(
-                                "Triangulating part {}, patch {}\n".format(self.part_obj.Label, patch_name))
-                            writeSurfaceMeshFromShape(patch_shape, self.triSurfaceDir, patch_name, self.mesh_obj)
-                            # Append to the main file
-                            with open(os.path.join(self.triSurfaceDir, patch_name + '.stl'), 'r') as fid2:
-                                for ln in fid2:
-                                    fid.write(ln)
+            # Put together the faces making up each patch
+            faces = self.mesh_obj.Part.Shape.Faces
+            patches = []
+            for k in range(len(self.patch_faces)):
+                for l in range(len(self.patch_faces[k])):
+                    patch_faces = self.patch_faces[k][l]
+                    patch_name = self.patch_names[k][l]
+                    if len(patch_faces):
+                        patch_shape = Part.makeCompound([faces[f] for f in patch_faces])
+                        patches.append((patch_shape, self.triSurfaceDir, patch_name))
+            CfdTools.cfdMessage("Triangulating part {}, {} patches\n".format(self.part_obj.Label, len(patches)))
+
+            # Mesh them and output to file, appending each to the main file in turn. These are written as ASCII, as
+            # binary STL cannot hold the multiple named solids that become the patches.
+            with open(self.temp_file_geo, 'wb') as fid:
+                def appendPatch(file_name):
+                    with open(file_name, 'rb') as fid2:
+                        shutil.copyfileobj(fid2, fid)
+
+                writeSurfaceMeshesFromShapes(
+                    patches, self.mesh_obj, appendPatch, binary=False, cache_dir=self.triangulation_cache_dir)
 
     def loadSurfMesh(self):
         if not self.error:
@@ -748,6 +785,14 @@ class CfdMeshTools:
         else:
             self.settings['ParallelMesh'] = True
             self.settings['NumberOfProcesses'] = self.mesh_obj.NumberOfProcesses
+        # Scotch is used unless automatic decomposition has been chosen for the solver. The mesh is
+        # three-dimensional while it is being made, even if it is later extruded.
+        solver_obj = CfdTools.getSolver(self.analysis)
+        if solver_obj is not None and solver_obj.AutoParallelCores and \
+                not CfdTools.DockerContainer.usedocker and CfdDecomposition.isKahipAvailable(installation_path):
+            self.settings['DecompositionMethod'] = 'kahip'
+        else:
+            self.settings['DecompositionMethod'] = 'scotch'
         self.settings['NumberOfThreads'] = self.mesh_obj.NumberOfThreads
 
         self.settings['MPIOptionsOMPI'], self.settings['MPIOptionsMSMPI'] = CfdTools.getMPISettings()
@@ -763,32 +808,119 @@ class CfdMeshTools:
         self.analysis.NeedsMeshRewrite = False
         CfdTools.cfdMessage("Successfully wrote meshCase to folder {}\n".format(self.mesh_case_dir))
 
-def writeSurfaceMeshFromShape(shape, path, name, mesh_obj):
+def getTriangulationCacheDir(output_path):
+    """ The directory in which surface triangulations are cached, within the output directory of the analysis """
+    return os.path.join(output_path, 'triangulationCache')
+
+
+def writeSurfaceMeshesFromShapes(shapes, mesh_obj, written_fn=None, binary=None, cache_dir=None):
+    """
+    Triangulate each of a list of (shape, path, name) and write it to the STL file path/name.stl. If given,
+    written_fn is called with the name of each file once written, in the order of the list. Unless gmsh is used,
+    the shapes are triangulated in parallel by a pool of worker processes, and written as ASCII STL unless binary
+    is True or the preferences say otherwise; ASCII STL files contain a solid with the given name. If cache_dir is
+    given, the triangulations are cached there and reused while the shape and settings are unchanged. With gmsh, the
+    shapes are all triangulated in a single run, and written as ASCII.
+    """
     prefs = CfdTools.getPreferencesLocation()
     use_gmsh = FreeCAD.ParamGet(prefs).GetBool("SurfaceTriangulationUsingGMSH", False)
+    if binary is None:
+        binary = FreeCAD.ParamGet(prefs).GetBool("SurfaceTriangulationBinarySTL", False)
     max_num_threads = FreeCAD.ParamGet(prefs).GetUnsigned("SurfaceTriangulationMaxThreads", 0)
-    output_file_name = os.path.join(path, name + '.stl')
+    if max_num_threads < 1:
+        max_num_threads = multiprocessing.cpu_count()  # This is the virtual CPU count, i.e. max num threads
+    output_file_names = [os.path.join(path, name + '.stl') for shape, path, name in shapes]
     scaling_factor = FreeCAD.Units.Quantity(1, FreeCAD.Units.Length).getValueAs("m")
     if use_gmsh:
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            settings = {
-                'Name': name, 
-                'OutputFileName': output_file_name, 
-                'AngularMeshDensity': mesh_obj.STLAngularMeshDensity, 
-                'ScalingFactor': scaling_factor}
-            TemplateBuilder(
-                tmpdirname, os.path.join(CfdTools.getModulePath(), "Data", "Templates", "surfaceMesh"), settings)
-            shape.exportBrep(os.path.join(tmpdirname, name+'.brep'))
-            # Run gmsh...
-            if max_num_threads < 1:
-                import multiprocessing
-                max_num_threads = multiprocessing.cpu_count()  # This is the virtual CPU count, i.e. max num threads
-            proc = CfdTools.startGmsh(
-                tmpdirname, ['-nt', str(max_num_threads), '-', name+'.geo'], (lambda msg: CfdTools.cfdMessage(msg+'\n')))
-            if not proc.waitForFinished():
-                raise RuntimeError("GMSH command failed")
+        writeSurfaceMeshesUsingGmsh(
+            [shape for shape, path, name in shapes], [name for shape, path, name in shapes], output_file_names,
+            mesh_obj, max_num_threads, scaling_factor)
+        if written_fn:
+            for output_file_name in output_file_names:
+                written_fn(output_file_name)
     else:
-        facemesh = MeshPart.meshFromShape(
-            shape, LinearDeflection=mesh_obj.STLRelativeLinearDeflection, Relative=True)
-        with open(output_file_name, 'w') as fid:
-            CfdTools.writePatchToStl(name, facemesh, fid, scaling_factor)
+        def writeStl(k, stl):
+            with open(output_file_names[k], 'wb') as fid:
+                fid.write(stl)
+            if written_fn:
+                written_fn(output_file_names[k])
+
+        CfdSurfaceTriangulation.triangulateShapes(
+            [(shape, name) for shape, path, name in shapes], mesh_obj.STLRelativeLinearDeflection, scaling_factor,
+            binary, max_num_threads, writeStl, cache_dir)
+
+
+def writeSurfaceMeshesUsingGmsh(shapes, names, output_file_names, mesh_obj, num_threads, scaling_factor):
+    """
+    Triangulate a list of shapes with a single run of gmsh, and write each to an ASCII STL file containing a solid
+    with the corresponding name. All the faces are written to one BREP file, with a physical surface for the faces of
+    each shape; gmsh writes a solid for each, which are then separated into the output files.
+    """
+    if not shapes:
+        return
+    # Faces of all the shapes, without repetition, and the (one-based) index of each shape's faces among them
+    faces = []
+    face_indices = {}
+    patches = {}
+    for k, shape in enumerate(shapes):
+        indices = []
+        for face in shape.Faces:
+            same_faces = face_indices.setdefault(face.hashCode(), [])
+            for i in same_faces:
+                if faces[i].isSame(face):
+                    break
+            else:
+                i = len(faces)
+                faces.append(face)
+                same_faces.append(i)
+            indices.append(str(i+1))
+        # Named by index, as the names given may not be unique
+        patches['patch{}'.format(k)] = ', '.join(indices)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        name = 'surfaces'
+        output_file_name = os.path.join(tmpdirname, name + '.stl')
+        settings = {
+            'Name': name,
+            'OutputFileName': output_file_name,
+            'AngularMeshDensity': mesh_obj.STLAngularMeshDensity,
+            'ScalingFactor': scaling_factor,
+            'Patches': patches}
+        TemplateBuilder(
+            tmpdirname, os.path.join(CfdTools.getModulePath(), "Data", "Templates", "surfaceMesh"), settings)
+        Part.makeCompound(faces).exportBrep(os.path.join(tmpdirname, name + '.brep'))
+        CfdTools.cfdMessage("Triangulating {} surfaces using gmsh\n".format(len(shapes)))
+        proc = CfdTools.startGmsh(
+            tmpdirname, ['-nt', str(num_threads), '-', name + '.geo'], (lambda msg: CfdTools.cfdMessage(msg+'\n')))
+        if not proc.waitForFinished():
+            raise RuntimeError("GMSH command failed")
+
+        with open(output_file_name, 'rb') as fid:
+            stl = fid.read()
+    solids = splitStlSolids(stl)
+    for k, (name, file_name) in enumerate(zip(names, output_file_names)):
+        body = solids.get('patch{}'.format(k))
+        if body is None:
+            raise RuntimeError("Surface '{}' is missing from the output of gmsh".format(name))
+        with open(file_name, 'wb') as fid:
+            fid.write("solid {}\n".format(name).encode())
+            fid.write(body)
+            fid.write("endsolid {}\n".format(name).encode())
+
+
+def splitStlSolids(stl):
+    """
+    Separate the solids of an ASCII STL file
+    :return: Dictionary of the facets of each solid (as bytes, excluding the solid and endsolid lines) by name
+    """
+    solids = {}
+    starts = list(re.finditer(rb'^solid[ \t]*([^\r\n]*?)[ \t]*\r?\n', stl, re.MULTILINE))
+    for k, start in enumerate(starts):
+        end = starts[k+1].start() if k+1 < len(starts) else len(stl)
+        endsolid = stl.rfind(b'endsolid', start.end(), end)
+        solids[start.group(1).decode()] = stl[start.end():endsolid if endsolid >= 0 else end]
+    return solids
+
+
+def writeSurfaceMeshFromShape(shape, path, name, mesh_obj):
+    writeSurfaceMeshesFromShapes([(shape, path, name)], mesh_obj)
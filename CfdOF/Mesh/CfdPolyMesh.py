@@ -0,0 +1,485 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+
+# Reader for OpenFOAM meshes (constant/polyMesh), in ASCII or binary format, into NumPy arrays, together with the
+# mesh statistics and quality measures reported by checkMesh. Uncompressed binary files are memory-mapped. This module
+# does not depend on FreeCAD, so that it can be used without it.
+
+import os
+import re
+import mmap
+import gzip
+import numpy
+
+# Whitespace and comments
+_SPACE = re.compile(rb'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+_COMMENT = re.compile(rb'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_FOAM_FILE_HEADER = re.compile(rb'FoamFile\s*\{(.*?)\}', re.DOTALL)
+_HEADER_ENTRY = re.compile(rb'(\w+)\s+("[^"]*"|[^;]*);')
+# Size of a list and its opening bracket: '(' or, for a list with all entries the same, '{'
+_LIST_START = re.compile(rb'(\d+)\s*([({])')
+_PATCH = re.compile(rb'([^\s{}()]+)\s*\{([^}]*)\}')
+
+# Translates the brackets of ASCII lists to spaces, leaving only the numbers
+_BRACKETS_TO_SPACE = bytes.maketrans(b'()', b'  ')
+# Bytes that separate the tokens of ASCII lists
+_SEPARATORS = numpy.zeros(256, dtype=bool)
+_SEPARATORS[list(b' \t\n\r\f\v()')] = True
+
+ROOTVSMALL = 1e-150
+
+
+def findFoamFile(path):
+    """ The path of an OpenFOAM file, which may have been compressed (with the extension .gz) """
+    if os.path.isfile(path):
+        return path
+    elif os.path.isfile(path + '.gz'):
+        return path + '.gz'
+    raise RuntimeError("File '{}' not found".format(path))
+
+
+class FoamFile:
+    """
+    An OpenFOAM file, read as a header followed by lists. Binary lists are read directly from the file, which is
+    memory-mapped unless it is compressed or use_mmap is False, without copying.
+    """
+    def __init__(self, path, use_mmap=True):
+        self.path = findFoamFile(path)
+        if self.path.endswith('.gz'):
+            with gzip.open(self.path, 'rb') as fid:
+                self.buffer = fid.read()
+        else:
+            with open(self.path, 'rb') as fid:
+                if use_mmap and os.fstat(fid.fileno()).st_size:
+                    self.buffer = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self.buffer = fid.read()
+        self.pos = 0
+        self.header = {}
+        self.skipSpace()
+        match = _FOAM_FILE_HEADER.match(self.buffer, self.pos)
+        if match:
+            for key, value in _HEADER_ENTRY.findall(match.group(1)):
+                self.header[key.decode()] = value.decode().strip().strip('"')
+            self.pos = match.end()
+        self.binary = self.header.get('format') == 'binary'
+        arch = self.header.get('arch', '')
+        endian = '>' if 'MSB' in arch else '<'
+        label_size = re.search(r'label=(\d+)', arch)
+        scalar_size = re.search(r'scalar=(\d+)', arch)
+        self.label_dtype = numpy.dtype('{}i{}'.format(endian, int(label_size.group(1))//8 if label_size else 4))
+        self.scalar_dtype = numpy.dtype('{}f{}'.format(endian, int(scalar_size.group(1))//8 if scalar_size else 8))
+
+    def error(self, message):
+        return RuntimeError("{} in '{}' at offset {}".format(message, self.path, self.pos))
+
+    def skipSpace(self):
+        self.pos = _SPACE.match(self.buffer, self.pos).end()
+
+    def readListStart(self):
+        self.skipSpace()
+        match = _LIST_START.match(self.buffer, self.pos)
+        if not match:
+            raise self.error("Expected a list")
+        self.pos = match.end()
+        return int(match.group(1)), match.group(2)
+
+    def findListEnd(self, num_nested):
+        """ The position of the bracket closing the current list, whose entries contain num_nested bracketed lists """
+        if not num_nested:
+            end = self.buffer.find(b')', self.pos)
+        else:
+            # Find the closing brackets in blocks, so as not to search the whole file at once
+            end = -1
+            pos = self.pos
+            block_size = max(1 << 20, 64*num_nested)
+            while pos < len(self.buffer):
+                block = numpy.frombuffer(self.buffer[pos:pos + block_size], dtype=numpy.uint8)
+                closing = numpy.flatnonzero(block == ord(')'))
+                if len(closing) > num_nested:
+                    end = pos + closing[num_nested]
+                    break
+                num_nested -= len(closing)
+                pos += block_size
+        if end < 0:
+            raise self.error("Unterminated list")
+        return int(end)
+
+    def readAsciiNumbers(self, end, dtype):
+        text = bytes(self.buffer[self.pos:end]).translate(_BRACKETS_TO_SPACE)
+        return numpy.fromstring(text.decode('ascii'), dtype=dtype, sep=' ')
+
+    def readList(self, kind='label', num_components=1):
+        """
+        Read the next list of labels (kind 'label') or scalars (kind 'scalar'), or of vectors of them if
+        num_components is 3
+        :return: Array with a row for each entry of the list
+        """
+        num_entries, bracket = self.readListStart()
+        dtype = self.label_dtype if kind == 'label' else self.scalar_dtype
+        shape = (num_entries, num_components) if num_components > 1 else (num_entries,)
+        if bracket == b'{':
+            end = self.buffer.find(b'}', self.pos)
+            if end < 0:
+                raise self.error("Unterminated list")
+            value = self.readAsciiNumbers(end, dtype.newbyteorder('='))
+            self.pos = end + 1
+            return numpy.broadcast_to(value, shape)
+        if self.binary and num_entries:
+            count = num_entries*num_components
+            values = numpy.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.pos)
+            self.pos += count*dtype.itemsize
+            if self.buffer[self.pos:self.pos + 1] != b')':
+                raise self.error("Expected end of list")
+            self.pos += 1
+        else:
+            # ASCII values are read as 64-bit, whatever the size in the file
+            end = self.findListEnd(num_entries if num_components > 1 else 0)
+            values = self.readAsciiNumbers(end, numpy.int64 if kind == 'label' else numpy.float64)
+            self.pos = end + 1
+            if len(values) != num_entries*num_components:
+                raise self.error("Wrong number of entries in list")
+        return values.reshape(shape)
+
+    def readFaces(self):
+        """
+        Read a list of faces, either as a faceCompactList (the offset of each face's points in a list of the points
+        of all faces, followed by that list) or a faceList (each face as a list of points)
+        :return: Tuple of the offsets (with the total number of points appended) and the points of all faces
+        """
+        if self.header.get('class') == 'faceCompactList':
+            offsets = self.readList('label')
+            points = self.readList('label')
+            return offsets, points
+        num_faces, bracket = self.readListStart()
+        if bracket != b'(' or (self.binary and num_faces):
+            raise self.error("Unsupported face list format")
+        end = self.findListEnd(num_faces)
+        values = self.readAsciiNumbers(end, numpy.int64)
+        # Each face is written as its number of points followed by its points in brackets. The first point of each
+        # face is the token following its opening bracket.
+        text = numpy.frombuffer(self.buffer[self.pos:end], dtype=numpy.uint8)
+        is_separator = _SEPARATORS[text]
+        token_start = ~is_separator
+        token_start[1:] &= is_separator[:-1]
+        num_tokens_before = numpy.cumsum(token_start)
+        first_point = num_tokens_before[numpy.flatnonzero(text == ord('('))]
+        self.pos = end + 1
+        if len(first_point) != num_faces:
+            raise self.error("Wrong number of entries in list")
+        sizes = values[first_point - 1]
+        points = numpy.delete(values, first_point - 1)
+        offsets = numpy.concatenate(([0], numpy.cumsum(sizes)))
+        if offsets[-1] != len(points):
+            raise self.error("Inconsistent face sizes")
+        return offsets, points
+
+    def readPatches(self):
+        """
+        Read a list of boundary patches (as in the 'boundary' file)
+        :return: List of dictionaries of each patch's entries, together with its name
+        """
+        num_patches, bracket = self.readListStart()
+        text = _COMMENT.sub(b' ', bytes(self.buffer[self.pos:]))
+        patches = []
+        for match in _PATCH.finditer(text):
+            if len(patches) == num_patches:
+                break
+            patch = {'name': match.group(1).decode()}
+            for key, value in _HEADER_ENTRY.findall(match.group(2)):
+                patch[key.decode()] = value.decode().strip()
+            patches.append(patch)
+        if len(patches) != num_patches:
+            raise self.error("Wrong number of patches")
+        return patches
+
+
+def getPolyMeshDir(path):
+    """ The polyMesh directory of a case directory (or the directory itself if it is a polyMesh directory) """
+    poly_mesh_dir = os.path.join(path, 'constant', 'polyMesh')
+    return poly_mesh_dir if os.path.isdir(poly_mesh_dir) else path
+
+
+def readPolyMesh(path, use_mmap=True):
+    """
+    Read an OpenFOAM mesh
+    :param path: The case directory, or the polyMesh directory
+    :return: PolyMesh
+    """
+    poly_mesh_dir = getPolyMeshDir(path)
+    points = FoamFile(os.path.join(poly_mesh_dir, 'points'), use_mmap).readList('scalar', 3)
+    face_offsets, face_points = FoamFile(os.path.join(poly_mesh_dir, 'faces'), use_mmap).readFaces()
+    owner_file = FoamFile(os.path.join(poly_mesh_dir, 'owner'), use_mmap)
+    owner = owner_file.readList('label')
+    neighbour = FoamFile(os.path.join(poly_mesh_dir, 'neighbour'), use_mmap).readList('label')
+    patches = FoamFile(os.path.join(poly_mesh_dir, 'boundary'), use_mmap).readPatches()
+    return PolyMesh(points, face_offsets, face_points, owner, neighbour, patches, getNumberOfCells(owner_file))
+
+
+def getNumberOfCells(owner_file):
+    """ The number of cells noted in the header of the owner file, or None if it is not noted """
+    num_cells = re.search(r'nCells:\s*(\d+)', owner_file.header.get('note', ''))
+    return int(num_cells.group(1)) if num_cells else None
+
+
+def readCellCount(path):
+    """
+    Read the number of cells in an OpenFOAM mesh from the header of its owner file, without reading the mesh
+    :param path: The case directory, or the polyMesh directory
+    :return: The number of cells, or None if it is not noted in the header
+    """
+    return getNumberOfCells(FoamFile(os.path.join(getPolyMeshDir(path), 'owner')))
+
+
+def cross(a, b):
+    """ Cross products of the rows of a and b (faster than numpy.cross for many short vectors) """
+    return numpy.stack((a[:, 1]*b[:, 2] - a[:, 2]*b[:, 1],
+                        a[:, 2]*b[:, 0] - a[:, 0]*b[:, 2],
+                        a[:, 0]*b[:, 1] - a[:, 1]*b[:, 0]), axis=1)
+
+
+def sumPerCell(values, cells, num_cells):
+    """ Sum the values (one row per face) of each cell in cells """
+    if values.ndim == 1:
+        return numpy.bincount(cells, values, minlength=num_cells)
+    return numpy.stack([numpy.bincount(cells, values[:, k], minlength=num_cells) for k in range(values.shape[1])],
+                       axis=1)
+
+
+class PolyMesh:
+    """
+    An OpenFOAM mesh as arrays: the points, the faces (as offsets into a list of the points of all faces), the owner
+    and neighbour cells of each face, and the boundary patches. Geometry and quality measures are calculated as in
+    OpenFOAM, for all faces or cells at once, and kept once calculated.
+    """
+    def __init__(self, points, face_offsets, face_points, owner, neighbour, patches, num_cells=None):
+        self.points = points
+        self.face_offsets = face_offsets
+        self.face_points = face_points
+        self.owner = owner
+        self.neighbour = neighbour
+        self.patches = patches
+        self.num_points = len(points)
+        self.num_faces = len(owner)
+        self.num_internal_faces = len(neighbour)
+        if num_cells is None:
+            num_cells = int(max(owner.max(initial=-1), neighbour.max(initial=-1))) + 1
+        self.num_cells = num_cells
+        if len(face_offsets) != self.num_faces + 1:
+            raise RuntimeError("Numbers of faces and owners differ")
+        self.face_centres = None
+        self.face_areas = None
+        self.cell_centres = None
+        self.cell_volumes = None
+
+    def getBoundingBox(self):
+        """ :return: Minimum and maximum coordinates of the points """
+        if not self.num_points:
+            return numpy.zeros(3), numpy.zeros(3)
+        return self.points.min(axis=0), self.points.max(axis=0)
+
+    def getPatchFaceCounts(self):
+        """ :return: Dictionary of the number of faces of each patch """
+        return {patch['name']: int(patch.get('nFaces', 0)) for patch in self.patches}
+
+    def getFaceOfPoints(self):
+        """ The face of each entry in face_points """
+        return numpy.repeat(numpy.arange(self.num_faces), numpy.diff(self.face_offsets))
+
+    def getFaceGeometry(self):
+        """
+        Face centres and area vectors, from triangles formed by each edge and the average of the face's points
+        :return: Tuple of face centres and area vectors
+        """
+        if self.face_centres is None:
+            starts = self.face_offsets[:-1]
+            sizes = numpy.diff(self.face_offsets)
+            face = self.getFaceOfPoints()
+            p = numpy.asarray(self.points[self.face_points], dtype=float)
+            # The next point around the face
+            next_point = numpy.arange(1, len(p) + 1)
+            next_point[self.face_offsets[1:] - 1] = starts
+            pn = p[next_point]
+            centre_estimate = numpy.add.reduceat(p, starts, axis=0)/sizes[:, numpy.newaxis]
+            c = centre_estimate[face]
+            tri_areas = 0.5*cross(pn - p, c - p)
+            tri_centres = (p + pn + c)/3
+            areas = numpy.add.reduceat(tri_areas, starts, axis=0)
+            weights = numpy.einsum('ij,ij->i', tri_areas, areas[face])
+            sum_weights = numpy.add.reduceat(weights, starts)
+            centres = numpy.add.reduceat(weights[:, numpy.newaxis]*tri_centres, starts, axis=0)
+            degenerate = numpy.abs(sum_weights) < ROOTVSMALL
+            centres[~degenerate] /= sum_weights[~degenerate, numpy.newaxis]
+            centres[degenerate] = centre_estimate[degenerate]
+            self.face_centres = centres
+            self.face_areas = areas
+        return self.face_centres, self.face_areas
+
+    def getCellGeometry(self):
+        """
+        Cell centres and volumes, from pyramids formed by each face and the average of the cell's face centres
+        :return: Tuple of cell centres and volumes
+        """
+        if self.cell_centres is None:
+            face_centres, face_areas = self.getFaceGeometry()
+            n = self.num_internal_faces
+            owner = self.owner
+            neighbour = self.neighbour
+            num_faces = (numpy.bincount(owner, minlength=self.num_cells) +
+                         numpy.bincount(neighbour, minlength=self.num_cells))
+            centre_estimate = (sumPerCell(face_centres, owner, self.num_cells) +
+                               sumPerCell(face_centres[:n], neighbour, self.num_cells))
+            centre_estimate /= numpy.maximum(num_faces, 1)[:, numpy.newaxis]
+            # Three times the volume of the pyramid on each face, on the owner and neighbour sides
+            owner_pyr_3_vol = numpy.einsum('ij,ij->i', face_areas, face_centres - centre_estimate[owner])
+            neighbour_pyr_3_vol = numpy.einsum('ij,ij->i', face_areas[:n], centre_estimate[neighbour] - face_centres[:n])
+            owner_pyr_centres = 0.75*face_centres + 0.25*centre_estimate[owner]
+            neighbour_pyr_centres = 0.75*face_centres[:n] + 0.25*centre_estimate[neighbour]
+            volumes_3 = (numpy.bincount(owner, owner_pyr_3_vol, minlength=self.num_cells) +
+                         numpy.bincount(neighbour, neighbour_pyr_3_vol, minlength=self.num_cells))
+            centres = (sumPerCell(owner_pyr_3_vol[:, numpy.newaxis]*owner_pyr_centres, owner, self.num_cells) +
+                       sumPerCell(neighbour_pyr_3_vol[:, numpy.newaxis]*neighbour_pyr_centres, neighbour,
+                                  self.num_cells))
+            degenerate = numpy.abs(volumes_3) < ROOTVSMALL
+            centres[~degenerate] /= volumes_3[~degenerate, numpy.newaxis]
+            centres[degenerate] = centre_estimate[degenerate]
+            self.cell_centres = centres
+            self.cell_volumes = volumes_3/3
+        return self.cell_centres, self.cell_volumes
+
+    def getNonOrthogonality(self):
+        """ :return: The angle (degrees) between each internal face's normal and the line joining its cell centres """
+        n = self.num_internal_faces
+        face_areas = self.getFaceGeometry()[1][:n]
+        cell_centres = self.getCellGeometry()[0]
+        d = cell_centres[self.neighbour] - cell_centres[self.owner[:n]]
+        cos_angle = numpy.einsum('ij,ij->i', d, face_areas)/(
+            numpy.linalg.norm(d, axis=1)*numpy.linalg.norm(face_areas, axis=1) + ROOTVSMALL)
+        return numpy.degrees(numpy.arccos(numpy.clip(cos_angle, -1, 1)))
+
+    def getSkewness(self):
+        """
+        :return: The skewness of each face: the distance between the face centre and where the line joining the cell
+        centres (or the face normal through the owner cell centre, for boundary faces) crosses the face, relative to
+        the size of the face
+        """
+        n = self.num_internal_faces
+        face_centres, face_areas = self.getFaceGeometry()
+        cell_centres = self.getCellGeometry()[0]
+        owner_to_face = face_centres - cell_centres[self.owner]
+        d = numpy.empty_like(owner_to_face)
+        d[:n] = cell_centres[self.neighbour] - cell_centres[self.owner[:n]]
+        normals = face_areas[n:]/(numpy.linalg.norm(face_areas[n:], axis=1)[:, numpy.newaxis] + ROOTVSMALL)
+        d[n:] = normals*numpy.einsum('ij,ij->i', normals, owner_to_face[n:])[:, numpy.newaxis]
+        skew = owner_to_face - (numpy.einsum('ij,ij->i', face_areas, owner_to_face)/(
+            numpy.einsum('ij,ij->i', face_areas, d) + ROOTVSMALL))[:, numpy.newaxis]*d
+        skew_mag = numpy.linalg.norm(skew, axis=1)
+        skew_dir = skew/(skew_mag[:, numpy.newaxis] + ROOTVSMALL)
+        # Normalise by the approximate distance from the face centre to its edge in the direction of the skewness
+        face = self.getFaceOfPoints()
+        extent = numpy.abs(numpy.einsum(
+            'ij,ij->i', skew_dir[face], self.points[self.face_points] - face_centres[face]))
+        face_size = numpy.maximum.reduceat(extent, self.face_offsets[:-1])
+        d_mag = numpy.linalg.norm(d, axis=1)
+        d_mag[:n] *= 0.2
+        d_mag[n:] *= 0.4
+        return skew_mag/(numpy.maximum(face_size, d_mag) + ROOTVSMALL)
+
+    def getGeometricDirections(self):
+        """ :return: Whether each coordinate direction is resolved, i.e. is not normal to any 'empty' patches """
+        face_areas = self.getFaceGeometry()[1]
+        empty_area = numpy.zeros(3)
+        for patch in self.patches:
+            if patch.get('type') == 'empty':
+                start = int(patch.get('startFace', 0))
+                empty_area += numpy.abs(face_areas[start:start + int(patch.get('nFaces', 0))]).sum(axis=0)
+        empty_area /= numpy.linalg.norm(empty_area) + ROOTVSMALL
+        return empty_area <= 1e-6
+
+    def getAspectRatio(self):
+        """
+        :return: The aspect ratio of each cell: the largest ratio between its projected areas in the coordinate
+        directions, or, if larger and the mesh is 3D, the ratio of its surface area to that of a cube of the same volume
+        """
+        face_areas = numpy.abs(self.getFaceGeometry()[1])
+        volumes = self.getCellGeometry()[1]
+        n = self.num_internal_faces
+        sum_areas = (sumPerCell(face_areas, self.owner, self.num_cells) +
+                     sumPerCell(face_areas[:n], self.neighbour, self.num_cells))
+        directions = self.getGeometricDirections()
+        if not directions.any():
+            return numpy.ones(self.num_cells)
+        resolved = sum_areas[:, directions]
+        aspect_ratio = resolved.max(axis=1)/(resolved.min(axis=1) + ROOTVSMALL)
+        if directions.all():
+            aspect_ratio = numpy.maximum(
+                aspect_ratio, sum_areas.sum(axis=1)/(6*numpy.maximum(volumes, ROOTVSMALL)**(2/3)))
+        return aspect_ratio
+
+    def getSummary(self, quality=True):
+        """
+        The sizes of the mesh, its bounding box and, if quality is True, the quality measures reported by checkMesh
+        :return: Dictionary that can be written as JSON
+        """
+        bound_min, bound_max = self.getBoundingBox()
+        summary = {
+            'points': self.num_points,
+            'faces': self.num_faces,
+            'internalFaces': self.num_internal_faces,
+            'cells': self.num_cells,
+            'patches': [{'name': patch['name'], 'type': patch.get('type', ''), 'faces': int(patch.get('nFaces', 0))}
+                        for patch in self.patches],
+            'boundingBox': [bound_min.tolist(), bound_max.tolist()]
+        }
+        if quality and self.num_cells:
+            non_orthogonality = self.getNonOrthogonality()
+            volumes = self.getCellGeometry()[1]
+            summary.update({
+                'maxNonOrthogonality': float(non_orthogonality.max(initial=0)),
+                'averageNonOrthogonality': float(non_orthogonality.mean()) if len(non_orthogonality) else 0.0,
+                'maxSkewness': float(self.getSkewness().max(initial=0)),
+                'maxAspectRatio': float(self.getAspectRatio().max()),
+                'minVolume': float(volumes.min()),
+                'maxVolume': float(volumes.max()),
+                'totalVolume': float(volumes.sum())
+            })
+        return summary
+
+
+def formatSummary(summary):
+    """ :return: Lines of text describing a mesh summary from PolyMesh.getSummary """
+    lines = ["Points: {}, faces: {} ({} internal), cells: {}".format(
+        summary['points'], summary['faces'], summary['internalFaces'], summary['cells'])]
+    for patch in summary['patches']:
+        lines.append("Patch {} ({}): {} faces".format(patch['name'], patch['type'], patch['faces']))
+    lines.append("Bounding box: ({:g} {:g} {:g}) ({:g} {:g} {:g})".format(*summary['boundingBox'][0],
+                                                                          *summary['boundingBox'][1]))
+    if 'maxNonOrthogonality' in summary:
+        lines.append("Non-orthogonality max: {:.4g}, average: {:.4g}".format(
+            summary['maxNonOrthogonality'], summary['averageNonOrthogonality']))
+        lines.append("Max skewness: {:.4g}".format(summary['maxSkewness']))
+        lines.append("Max aspect ratio: {:.4g}".format(summary['maxAspectRatio']))
+        lines.append("Cell volume min: {:.4g}, max: {:.4g}, total: {:.4g}".format(
+            summary['minVolume'], summary['maxVolume'], summary['totalVolume']))
+    return lines
@@ -0,0 +1,289 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+# Triangulation of surfaces for STL output. Shapes are triangulated from their BREP representation in a pool of
+# worker processes, and the triangulations kept in a cache directory keyed on the BREP and triangulation settings.
+# This module is imported by the workers, so should not import anything from the GUI.
+
+import io
+import os
+import sys
+import atexit
+import platform
+import hashlib
+import multiprocessing
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import FreeCAD
+
+# Pool of worker processes shared by all triangulations, and its number of workers
+_pool = None
+_pool_size = 0
+# Whether starting worker processes has failed, in which case triangulation is done in this process
+_pool_failed = False
+
+# Text of each facet of an ASCII STL file, given its normal and vertices. Formatted with %r, so that numbers are
+# written in the shortest form that reads back exactly.
+_ASCII_STL_FACET = (" facet normal %r %r %r\n  outer loop\n   vertex %r %r %r\n   vertex %r %r %r\n"
+                    "   vertex %r %r %r\n  endloop\n endfacet\n")
+# Number of facets formatted at once
+ASCII_STL_CHUNK_SIZE = 10000
+
+# Record of each facet of a binary STL file
+_BINARY_STL_FACET = numpy.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+# Maximum total size of the triangulations kept in a cache directory (bytes); the least recently used are removed
+CACHE_SIZE_LIMIT = 1 << 30
+
+
+def getFacetArrays(points, facets, scale=1):
+    """
+    The unit normals (N x 3) and scaled vertex coordinates (N x 3 x 3) of the facets of a triangulation, given as its
+    points and the indices of the points of each facet. The normals are calculated from the unscaled points in single
+    precision, in the same way as the facet normals of a FreeCAD mesh, so that the STL output is unchanged from when
+    it was written facet by facet.
+    """
+    corners = points.astype(numpy.float32)[facets]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    length = numpy.sqrt(normals[:, 0]*normals[:, 0] + normals[:, 1]*normals[:, 1] + normals[:, 2]*normals[:, 2])
+    length = length.reshape(-1, 1)
+    normals = numpy.divide(normals, length, out=numpy.zeros_like(normals), where=length > 0)
+    vertices = corners.astype(float)*scale
+    return normals, vertices
+
+
+def writePatchToStl(solid_name, points, facets, fid, scale=1):
+    """ Write a triangulation as a solid of an ASCII STL file """
+    normals, vertices = getFacetArrays(points, facets, scale)
+    data = numpy.concatenate((normals, vertices.reshape(-1, 9)), axis=1)
+    fid.write("solid {}\n".format(solid_name))
+    for start in range(0, len(data), ASCII_STL_CHUNK_SIZE):
+        chunk = data[start:start+ASCII_STL_CHUNK_SIZE]
+        fid.write((_ASCII_STL_FACET*len(chunk)) % tuple(chunk.ravel().tolist()))
+    fid.write("endsolid {}\n".format(solid_name))
+
+
+def writePatchToBinaryStl(solid_name, points, facets, fid, scale=1):
+    """
+    Write a triangulation as a binary STL file. Binary STL holds a single unnamed solid, so the name is only recorded
+    in the header.
+    """
+    normals, vertices = getFacetArrays(points, facets, scale)
+    # The header must not start with 'solid', or the file may be taken to be ASCII
+    fid.write("Binary STL {}".format(solid_name).encode()[:80].ljust(80, b'\0'))
+    fid.write(numpy.array(len(normals), dtype='<u4').tobytes())
+    stl_facets = numpy.zeros(len(normals), dtype=_BINARY_STL_FACET)
+    stl_facets['normal'] = normals
+    stl_facets['vertices'] = vertices
+    fid.write(stl_facets.tobytes())
+
+
+def triangulateBrep(brep, linear_deflection):
+    """
+    Triangulate a shape given as BREP text. Shapes are passed through BREP whether they are triangulated by a worker or
+    in this process, so that the result is the same in either case.
+    :return: The points of the triangulation (as stored by the mesh, in single precision) and the indices of the
+    points of each facet
+    """
+    import Part
+    import MeshPart
+    shape = Part.Shape()
+    shape.importBrepFromString(brep, False)
+    face_mesh = MeshPart.meshFromShape(shape, LinearDeflection=linear_deflection, Relative=True)
+    points, facets = face_mesh.Topology
+    points = numpy.array([(p.x, p.y, p.z) for p in points], dtype=numpy.float32).reshape(-1, 3)
+    facets = numpy.array(facets, dtype=numpy.int32).reshape(-1, 3)
+    return points, facets
+
+
+def getCacheKey(brep, linear_deflection):
+    """ Identify a triangulation by the triangulator and its settings, and the shape's BREP """
+    h = hashlib.sha1()
+    h.update("MeshPart {!r}\n".format(linear_deflection).encode())
+    h.update(brep.encode())
+    return h.hexdigest()
+
+
+def readCachedTriangulation(file_name):
+    """ The points and facets in a cache file, or None if it does not exist or cannot be read """
+    try:
+        with numpy.load(file_name) as data:
+            return data['points'], data['facets']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def writeCachedTriangulation(file_name, points, facets):
+    # Write under a temporary name, so that a partly-written file is never read
+    temp_file_name = "{}.{}.tmp".format(file_name, os.getpid())
+    with open(temp_file_name, 'wb') as fid:
+        numpy.savez(fid, points=points, facets=facets)
+    os.replace(temp_file_name, file_name)
+
+
+def pruneCache(cache_dir, size_limit=CACHE_SIZE_LIMIT):
+    """ Remove the least recently used triangulations from the cache until it is within the size limit """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort(reverse=True)
+    total_size = 0
+    for mtime, size, path in entries:
+        total_size += size
+        if total_size > size_limit:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def triangulateToStl(brep, solid_name, linear_deflection, scale, binary, cache_file=None):
+    """
+    Triangulate a shape given as BREP text, and return the contents of an STL file of it, as binary or as an ASCII
+    solid. If cache_file is given, the triangulation is read from it if present, and otherwise saved to it.
+    """
+    triangulation = readCachedTriangulation(cache_file) if cache_file else None
+    if triangulation is None:
+        triangulation = triangulateBrep(brep, linear_deflection)
+        if cache_file:
+            writeCachedTriangulation(cache_file, *triangulation)
+    if binary:
+        fid = io.BytesIO()
+        writePatchToBinaryStl(solid_name, *triangulation, fid, scale)
+        return fid.getvalue()
+    else:
+        fid = io.StringIO()
+        writePatchToStl(solid_name, *triangulation, fid, scale)
+        return fid.getvalue().encode()
+
+
+def findPythonExecutable():
+    """
+    Find the Python interpreter to run worker processes. Within FreeCAD, sys.executable is usually FreeCAD itself, so
+    look for an interpreter of the same version installed alongside it.
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    if platform.system() == 'Windows':
+        name = 'python.exe'
+    else:
+        name = 'python{}.{}'.format(*sys.version_info[:2])
+    for path in [os.path.dirname(sys.executable), os.path.join(sys.exec_prefix, 'bin'), sys.exec_prefix]:
+        executable = os.path.join(path, name)
+        if os.path.isfile(executable) and os.access(executable, os.X_OK):
+            return executable
+    return None
+
+
+def getPool(max_workers):
+    """ The pool of worker processes, or None if they cannot be started """
+    global _pool, _pool_size
+    if _pool is not None and _pool_size != max_workers:
+        shutdownPool()
+    if _pool is None and not _pool_failed:
+        executable = findPythonExecutable()
+        if executable is None:
+            return None
+        # Workers are started afresh rather than forked, as the GUI process cannot safely be forked
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(executable)
+        _pool = ProcessPoolExecutor(max_workers, mp_context=context)
+        _pool_size = max_workers
+        # Check once that the workers can run, as they may not find FreeCAD's modules
+        try:
+            _pool.submit(probeWorker).result()
+        except Exception as err:
+            failPool(err)
+    return _pool
+
+
+def probeWorker():
+    """ Import the modules needed for triangulation, to check that a worker process can run it """
+    import Part
+    import MeshPart
+
+
+def shutdownPool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+atexit.register(shutdownPool)
+
+
+def failPool(err):
+    """ Stop using worker processes, after they failed with err """
+    global _pool_failed
+    FreeCAD.Console.PrintWarning(
+        "Could not run surface triangulation in parallel ({}); continuing in a single process\n".format(err))
+    _pool_failed = True
+    shutdownPool()
+
+
+def mapInPool(pool, fn, *iterables):
+    """ Yield the results of pool.map, stopping with a warning if the worker processes fail """
+    try:
+        for result in pool.map(fn, *iterables):
+            yield result
+    except (BrokenProcessPool, OSError, ImportError) as err:
+        failPool(err)
+
+
+def triangulateShapes(shapes, linear_deflection, scale, binary, max_workers, output_fn, cache_dir=None):
+    """
+    Triangulate a list of (shape, solid_name), calling output_fn(index, stl) with the contents of the STL file of
+    each (binary, or an ASCII solid), in the order of the list. With more than one shape and worker, the shapes are
+    triangulated in parallel by a pool of worker processes; if these fail to run, the rest are triangulated in this
+    process. If cache_dir is given, triangulations are cached there, so that only shapes whose geometry or
+    triangulation settings have changed since a previous call are triangulated again.
+    """
+    # Without any triangulation stored with the shape, the BREP depends only on the geometry
+    breps = [shape.cleaned().exportBrepToString() for shape, solid_name in shapes]
+    solid_names = [solid_name for shape, solid_name in shapes]
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_files = [os.path.join(cache_dir, getCacheKey(brep, linear_deflection) + '.npz') for brep in breps]
+        for cache_file in cache_files:
+            # Mark as recently used
+            try:
+                os.utime(cache_file)
+            except OSError:
+                pass
+    else:
+        cache_files = [None]*len(shapes)
+    num_done = 0
+    pool = getPool(max_workers) if len(shapes) > 1 and max_workers > 1 else None
+    if pool is not None:
+        for stl in mapInPool(pool, triangulateToStl, breps, solid_names, [linear_deflection]*len(shapes),
+                             [scale]*len(shapes), [binary]*len(shapes), cache_files):
+            output_fn(num_done, stl)
+            num_done += 1
+    for k in range(num_done, len(shapes)):
+        output_fn(k, triangulateToStl(breps[k], solid_names[k], linear_deflection, scale, binary, cache_files[k]))
+    if cache_dir:
+        pruneCache(cache_dir)
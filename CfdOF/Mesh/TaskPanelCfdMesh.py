@@ -35,6 +35,9 @@ from datetime import timedelta
 from CfdOF import CfdTools
 from CfdOF.CfdTools import setQuantity, getQuantity, storeIfChanged
 from CfdOF.Mesh import CfdMeshTools
+from CfdOF.Mesh import CfdPolyMesh
+from CfdOF.Mesh import CfdMeshReport
+from CfdOF.Mesh import CfdMeshEstimate
 from CfdOF.CfdConsoleProcess import CfdConsoleProcess
 if FreeCAD.GuiUp:
     import FreeCADGui
@@ -55,6 +58,7 @@ class TaskPanelCfdMesh:
 
         self.console_message_cart = ''
         self.error_message = ''
+        self.mesh_estimate = None
         self.mesh_obj.Proxy.cart_mesh = CfdMeshTools.CfdMeshTools(self.mesh_obj)
         self.paraviewScriptName = ""
 
@@ -236,11 +240,28 @@ class TaskPanelCfdMesh:
             raise
         else:
             self.analysis_obj.NeedsMeshRerun = True
+            self.mesh_estimate = self.showMeshEstimate()
         finally:
             QApplication.restoreOverrideCursor()
             # Update the UI
             self.updateUI()
 
+    def showMeshEstimate(self):
+        """
+        Show the estimated size of the mesh and the memory needed to make it, warning if there is not enough memory
+        :return: The estimate, or None if it could not be made
+        """
+        try:
+            estimate = CfdMeshEstimate.estimateMesh(self.mesh_obj)
+        except (RuntimeError, ValueError, ZeroDivisionError) as ex:
+            self.consoleMessage("Could not estimate mesh size: " + str(ex), 'Warning')
+            return None
+        for line in CfdMeshEstimate.formatMeshEstimate(estimate):
+            self.consoleMessage(line, timed=False)
+        for warning in estimate['warnings']:
+            self.consoleMessage(warning, 'Warning')
+        return estimate
+
     def progressCallback(self, message):
         self.consoleMessage(message)
 
@@ -259,10 +280,11 @@ class TaskPanelCfdMesh:
             FreeCADGui.doCommand("cmd = CfdTools.makeRunCommand('checkMesh -meshQuality', cart_mesh.mesh_case_dir)")
             FreeCADGui.doCommand("env_vars = CfdTools.getRunEnvironment()")
             self.check_mesh_error = False
+            self.check_mesh_output = []
             FreeCADGui.doCommand("proxy.running_from_macro = True")
             self.mesh_obj.Proxy.running_from_macro = False
             self.mesh_obj.Proxy.check_mesh_process = CfdConsoleProcess(
-                stdout_hook=self.gotOutputLines, stderr_hook=self.gotErrorLines)
+                stdout_hook=self.gotCheckMeshOutputLines, stderr_hook=self.gotErrorLines)
             FreeCADGui.doCommand("if proxy.running_from_macro:\n" +
                                  "  proxy.check_mesh_process = CfdConsoleProcess()\n" +
                                  "  proxy.check_mesh_process.start(cmd, env_vars=env_vars, working_dir=cart_mesh.mesh_case_dir)\n" +
@@ -274,7 +296,9 @@ class TaskPanelCfdMesh:
             else:
                 self.consoleMessage("Error starting mesh check process", 'Error')
             if self.mesh_obj.Proxy.check_mesh_process.waitForFinished():
-                if self.check_mesh_error:
+                check_mesh_report = self.checkMeshFinished()
+                if (self.check_mesh_error or check_mesh_report.get('failedChecks') or
+                        check_mesh_report.get('meshQualityFaces')):
                     self.consoleMessage("Detected error(s) in mesh", 'Error')
                 else:
                     self.consoleMessage("Mesh check OK")
@@ -296,6 +320,7 @@ class TaskPanelCfdMesh:
 
         # Check for changes that require mesh re-write
         self.store()
+        estimate = None
         if self.analysis_obj.NeedsMeshRewrite:
             if FreeCAD.GuiUp:
                 if QtGui.QMessageBox.question(
@@ -310,8 +335,19 @@ class TaskPanelCfdMesh:
                 ) == QtGui.QMessageBox.Yes:
                     self.Start = time.time()
                     self.writeMesh()
+                    estimate = self.mesh_estimate
                 else:
                     self.Start = time.time()
+        if estimate is None:
+            estimate = self.showMeshEstimate()
+        if FreeCAD.GuiUp and estimate is not None and estimate['warnings']:
+            if QtGui.QMessageBox.question(
+                None,
+                translate("Dialogs", "CfdOF Workbench"),
+                translate("Dialogs", "The mesher may run out of memory.\n\nRun the mesher anyway?"),
+                defaultButton=QtGui.QMessageBox.No
+            ) != QtGui.QMessageBox.Yes:
+                return
 
         try:
             QApplication.setOverrideCursor(Qt.WaitCursor)
@@ -372,15 +408,32 @@ class TaskPanelCfdMesh:
             if l.endswith("faces in error to set meshQualityFaces"):
                 self.check_mesh_error = True
 
+    def gotCheckMeshOutputLines(self, lines):
+        self.gotOutputLines(lines)
+        # Kept to be written to the log and analysed once checkMesh has finished
+        self.check_mesh_output.append(lines)
+
     def gotErrorLines(self, lines):
         print_err = self.mesh_obj.Proxy.mesh_process.processErrorOutput(lines)
         if print_err is not None:
             self.consoleMessage(print_err, 'Error')
             self.check_mesh_error = True
 
+    def checkMeshFinished(self):
+        """
+        Save the output of checkMesh as a log in the mesh case, and add its analysis to the mesh report
+        :return: The analysis of the checkMesh output
+        """
+        case_dir = self.mesh_obj.Proxy.cart_mesh.mesh_case_dir
+        output = ''.join(self.check_mesh_output)
+        with open(os.path.join(case_dir, 'log.checkMesh'), 'w') as fid:
+            fid.write(output)
+        return self.showMeshReport().get('checkMesh', {})
+
     def meshFinished(self, exit_code):
         if exit_code == 0:
             self.consoleMessage('Meshing completed')
+            self.showMeshReport()
             self.analysis_obj.NeedsMeshRerun = False
             self.form.pb_run_mesh.setEnabled(True)
             self.form.pb_stop_mesh.setEnabled(False)
@@ -401,6 +454,27 @@ class TaskPanelCfdMesh:
         self.pbClearMeshClicked()
         self.updateUI()
 
+    def showMeshReport(self):
+        """
+        Show the cost, size and quality of the mesh, from the logs of the mesher and checkMesh and from the mesh files,
+        and store them in the mesh case
+        :return: The report
+        """
+        case_dir = self.mesh_obj.Proxy.cart_mesh.mesh_case_dir
+        report = CfdMeshReport.parseMeshLogs(case_dir)
+        try:
+            # The quality measures are left to checkMesh, as calculating them here would hold up the GUI
+            report['polyMesh'] = CfdPolyMesh.readPolyMesh(case_dir).getSummary(quality=False)
+        except (OSError, RuntimeError, ValueError, MemoryError) as ex:
+            self.consoleMessage("Could not read mesh: " + str(ex), 'Warning')
+        try:
+            CfdMeshReport.writeMeshReport(case_dir, report)
+        except OSError as ex:
+            self.consoleMessage("Could not write mesh report: " + str(ex), 'Warning')
+        for line in CfdMeshReport.formatMeshReport(report):
+            self.consoleMessage(line, timed=False)
+        return report
+
     def openParaview(self):
         QApplication.setOverrideCursor(Qt.WaitCursor)
         case_path = os.path.abspath(self.mesh_obj.Proxy.cart_mesh.mesh_case_dir)
@@ -0,0 +1,219 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+import os
+
+import FreeCAD
+import FreeCADGui
+from pivy import coin
+
+from CfdOF import CfdTools
+from CfdOF.CfdTools import addObjectProperty
+
+QT_TRANSLATE_NOOP = FreeCAD.Qt.QT_TRANSLATE_NOOP
+
+# Result monitored by default for each type of reporting function, where none is specified. The probes result
+# is the mean over the sampled locations.
+DEFAULT_RESULT_NAMES = {'Force': 'normalForce', 'ForceCoefficients': 'Cd', 'Probes': 'average({})'}
+
+
+def makeCfdConvergenceCriterion(name="ConvergenceCriterion"):
+    obj = FreeCAD.ActiveDocument.addObject("App::FeaturePython", name)
+    CfdConvergenceCriterion(obj)
+    if FreeCAD.GuiUp:
+        ViewProviderCfdConvergenceCriterion(obj.ViewObject)
+    return obj
+
+
+class CommandCfdConvergenceCriterion:
+    def GetResources(self):
+        icon_path = os.path.join(CfdTools.getModulePath(), "Gui", "Icons", "monitor.svg")
+        return {'Pixmap': icon_path,
+                'MenuText': QT_TRANSLATE_NOOP("CfdOF_ConvergenceCriterion", "Convergence criterion"),
+                'ToolTip': QT_TRANSLATE_NOOP("CfdOF_ConvergenceCriterion",
+                                             "Stop the solver once a reporting function result has converged")}
+
+    def IsActive(self):
+        analysis_obj = CfdTools.getActiveAnalysis()
+        return analysis_obj is not None and len(CfdTools.getReportingFunctionsGroup(analysis_obj)) > 0
+
+    def Activated(self):
+        FreeCAD.ActiveDocument.openTransaction("Create CfdConvergenceCriterion object")
+        FreeCADGui.doCommand("from CfdOF.PostProcess import CfdConvergenceCriterion")
+        FreeCADGui.doCommand("from CfdOF import CfdTools")
+        FreeCADGui.doCommand(
+            "CfdTools.getActiveAnalysis().addObject(CfdConvergenceCriterion.makeCfdConvergenceCriterion())")
+        FreeCADGui.ActiveDocument.setEdit(FreeCAD.ActiveDocument.ActiveObject.Name)
+
+
+class CfdConvergenceCriterion:
+    """
+    Stops the solver, writing the current solution, once a result of a reporting function has converged: i.e. it
+    differs from its running average over the given window by less than the tolerance. Written as a condition of a
+    runTimeControl function object; the run ends when all criteria in the analysis are satisfied.
+    """
+    def __init__(self, obj):
+        obj.Proxy = self
+        self.initProperties(obj)
+
+    def initProperties(self, obj):
+        self.Type = 'CfdConvergenceCriterion'
+        self.Object = obj
+
+        addObjectProperty(
+            obj,
+            "ReportingFunction",
+            None,
+            "App::PropertyLink",
+            "Convergence criterion",
+            QT_TRANSLATE_NOOP("App::Property", "Reporting function whose result is monitored"),
+        )
+        addObjectProperty(
+            obj,
+            "ResultName",
+            "",
+            "App::PropertyString",
+            "Convergence criterion",
+            QT_TRANSLATE_NOOP("App::Property",
+                              "Result to monitor, e.g. Cd or Cl for force coefficients (default for the "
+                              "reporting function type if empty)"),
+        )
+        addObjectProperty(
+            obj,
+            "Window",
+            200.0,
+            "App::PropertyFloat",
+            "Convergence criterion",
+            QT_TRANSLATE_NOOP("App::Property",
+                              "Averaging window (iterations for a steady case, or simulation time in seconds)"),
+        )
+        addObjectProperty(
+            obj,
+            "Tolerance",
+            1e-3,
+            "App::PropertyFloat",
+            "Convergence criterion",
+            QT_TRANSLATE_NOOP("App::Property",
+                              "Largest difference between the result and its running average to be considered "
+                              "converged"),
+        )
+
+    def onDocumentRestored(self, obj):
+        self.initProperties(obj)
+
+    def execute(self, obj):
+        pass
+
+    def __getstate__(self):
+        return None
+
+    def __setstate__(self, state):
+        return None
+
+    # dumps and loads replace __getstate__ and __setstate__ post v. 0.21.2
+    def dumps(self):
+        return None
+
+    def loads(self, state):
+        return None
+
+
+class ViewProviderCfdConvergenceCriterion:
+    """
+    A View Provider for the CfdConvergenceCriterion object
+    """
+    def __init__(self, vobj):
+        vobj.Proxy = self
+        self.taskd = None
+
+    def getIcon(self):
+        icon_path = os.path.join(CfdTools.getModulePath(), "Gui", "Icons", "monitor.svg")
+        return icon_path
+
+    def attach(self, vobj):
+        self.ViewObject = vobj
+        self.Object = vobj.Object
+        self.standard = coin.SoGroup()
+        vobj.addDisplayMode(self.standard, "Standard")
+        return
+
+    def getDisplayModes(self, obj):
+        modes = []
+        return modes
+
+    def getDefaultDisplayMode(self):
+        return "Standard"
+
+    def setDisplayMode(self, mode):
+        return mode
+
+    def updateData(self, obj, prop):
+        analysis_obj = CfdTools.getParentAnalysisObject(obj)
+        if analysis_obj and not analysis_obj.Proxy.loading:
+            analysis_obj.NeedsCaseRewrite = True
+
+    def onChanged(self, vobj, prop):
+        return
+
+    def doubleClicked(self, vobj):
+        doc = FreeCADGui.getDocument(vobj.Object.Document)
+        if not doc.getInEdit():
+            doc.setEdit(vobj.Object.Name)
+        else:
+            FreeCAD.Console.PrintError('Task dialog already active\n')
+            FreeCADGui.Control.showTaskView()
+        return True
+
+    def setEdit(self, vobj, mode):
+        analysis_object = CfdTools.getParentAnalysisObject(self.Object)
+        if analysis_object is None:
+            CfdTools.cfdErrorBox("Convergence criterion must have a parent analysis object")
+            return False
+
+        from CfdOF.PostProcess import TaskPanelCfdConvergenceCriterion
+        import importlib
+        importlib.reload(TaskPanelCfdConvergenceCriterion)
+        self.taskd = TaskPanelCfdConvergenceCriterion.TaskPanelCfdConvergenceCriterion(self.Object)
+        self.taskd.obj = vobj.Object
+        FreeCADGui.Control.showDialog(self.taskd)
+        return True
+
+    def unsetEdit(self, vobj, mode):
+        self.taskd = None
+        FreeCADGui.Control.closeDialog()
+        return
+
+    def __getstate__(self):
+        return None
+
+    def __setstate__(self, state):
+        return None
+
+    # dumps and loads replace __getstate__ and __setstate__ post v. 0.21.2
+    def dumps(self):
+        return None
+
+    def loads(self, state):
+        return None
+
+
+FreeCADGui.addCommand('CfdOF_ConvergenceCriterion', CommandCfdConvergenceCriterion())
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# SPDX-FileNotice: Part of the CfdOF addon.
+
+################################################################################
+#                                                                              #
+#   This program is free software; you can redistribute it and/or              #
+#   modify it under the terms of the GNU Lesser General Public                 #
+#   License as published by the Free Software Foundation; either               #
+#   version 3 of the License, or (at your option) any later version.           #
+#                                                                              #
+#   This program is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of             #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.                       #
+#                                                                              #
+#   See the GNU Lesser General Public License for more details.                #
+#                                                                              #
+#   You should have received a copy of the GNU Lesser General Public License   #
+#   along with this program; if not, write to the Free Software Foundation,    #
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.        #
+#                                                                              #
+################################################################################
+
+
+import os
+import FreeCAD
+from CfdOF import CfdTools
+from CfdOF.CfdTools import setQuantity, storeIfChanged
+from CfdOF.PostProcess import CfdConvergenceCriterion
+if FreeCAD.GuiUp:
+    import FreeCADGui
+
+
+class TaskPanelCfdConvergenceCriterion:
+    """
+    Task panel for convergence criteria
+    """
+    def __init__(self, obj):
+        self.obj = obj
+        self.analysis_obj = CfdTools.getActiveAnalysis()
+
+        ui_path = os.path.join(CfdTools.getModulePath(), 'Gui', "TaskPanelCfdConvergenceCriterion.ui")
+        self.form = FreeCADGui.PySideUic.loadUi(ui_path)
+
+        self.reporting_functions = CfdTools.getReportingFunctionsGroup(self.analysis_obj)
+        self.form.comboReportingFunction.addItems([rf.Label for rf in self.reporting_functions])
+        self.form.comboReportingFunction.currentIndexChanged.connect(self.updateUI)
+
+        self.form.inputResultName.setToolTip("Result of the reporting function to monitor")
+        self.form.inputWindow.setToolTip(
+            "Averaging window (iterations for a steady case, or simulation time in seconds)")
+        self.form.inputTolerance.setToolTip(
+            "Largest difference between the result and its running average to be considered converged")
+
+        self.load()
+        self.updateUI()
+
+    def load(self):
+        if self.obj.ReportingFunction in self.reporting_functions:
+            self.form.comboReportingFunction.setCurrentIndex(
+                self.reporting_functions.index(self.obj.ReportingFunction))
+        self.form.inputResultName.setText(self.obj.ResultName)
+        setQuantity(self.form.inputWindow, self.obj.Window)
+        setQuantity(self.form.inputTolerance, self.obj.Tolerance)
+
+    def updateUI(self):
+        # Show the result that will be monitored if none is entered
+        index = self.form.comboReportingFunction.currentIndex()
+        if index >= 0:
+            rf = self.reporting_functions[index]
+            self.form.inputResultName.setPlaceholderText(
+                CfdConvergenceCriterion.DEFAULT_RESULT_NAMES[rf.ReportingFunctionType].format(rf.SampleFieldName))
+
+    def accept(self):
+        doc = FreeCADGui.getDocument(self.obj.Document)
+        doc.resetEdit()
+
+        index = self.form.comboReportingFunction.currentIndex()
+        if index >= 0:
+            rf = self.reporting_functions[index]
+            if self.obj.ReportingFunction != rf:
+                FreeCADGui.doCommand("FreeCAD.ActiveDocument.{}.ReportingFunction "
+                                     "= FreeCAD.ActiveDocument.{}".format(self.obj.Name, rf.Name))
+        storeIfChanged(self.obj, 'ResultName', self.form.inputResultName.text().strip())
+        storeIfChanged(self.obj, 'Window', self.form.inputWindow.property("quantity").Value)
+        storeIfChanged(self.obj, 'Tolerance', self.form.inputTolerance.property("quantity").Value)
+
+        FreeCADGui.doCommand("FreeCAD.ActiveDocument.recompute()")
+
+    def reject(self):
+        doc = FreeCADGui.getDocument(self.obj.Document)
+        doc.resetEdit()
+        return True
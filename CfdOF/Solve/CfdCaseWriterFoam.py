@@ -27,12 +27,45 @@
 
 import os
 import os.path
+import glob
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import FreeCAD
 from FreeCAD import Units, Vector
 from CfdOF import CfdTools
-from CfdOF.TemplateBuilder import TemplateBuilder
+from CfdOF import CfdDecomposition
+from CfdOF.TemplateBuilder import TemplateBuilder, MemorySink
 from CfdOF.CfdTools import cfdMessage
 from CfdOF.Mesh import CfdMeshTools
+from CfdOF.Mesh import CfdMeshEstimate
 from CfdOF.Mesh import CfdDynamicMeshRefinement
+from CfdOF.PostProcess import CfdConvergenceCriterion
+
+# Pre-processing steps in Allrun which can be skipped after an incremental case write, in the order
+# they are run. Each is listed with the case files that feed it (a trailing '/' matches a whole
+# directory) and the later steps that have to be repeated whenever it is.
+_PRE_PROCESSING_STEPS = [
+    ('mesh', ['system/createPatchDict', 'system/topoSetBafflesDict', 'system/createBafflesDict',
+              'system/changeDictionaryDict'], ['topoSet', 'setFields', 'decompose']),
+    ('topoSet', ['system/topoSetZonesDict', 'constant/triSurface/'], ['decompose']),
+    ('setFields', ['system/setFieldsDict', '0/'], ['decomposeFields']),
+    ('decompose', ['system/decomposeParDict'], []),
+    ('decomposeFields', ['0/'], []),
+]
+
+
+def findStaleSteps(changed_files):
+    """ Return the pre-processing steps which must be repeated after changed_files were modified """
+    stale_steps = []
+    triggered = set()
+    for step, inputs, dependents in _PRE_PROCESSING_STEPS:
+        if step in triggered or any(f == i or (i.endswith('/') and f.startswith(i))
+                                    for f in changed_files for i in inputs):
+            stale_steps.append(step)
+            triggered.update(dependents)
+    return stale_steps
+
 
 class CfdCaseWriterFoam:
     def __init__(self, analysis_obj):
@@ -58,6 +91,7 @@ class CfdCaseWriterFoam:
         if not self.initial_conditions:
             raise RuntimeError("No initial conditions object was found in analysis " + analysis_obj.Label)
         self.reporting_functions = CfdTools.getReportingFunctionsGroup(analysis_obj)
+        self.convergence_criteria = CfdTools.getConvergenceCriteria(analysis_obj)
         self.scalar_transport_objs = CfdTools.getScalarTransportFunctionsGroup(analysis_obj)
         _all_mvf_objs = CfdTools.getMeanVelocityForceObjects(analysis_obj)
         _all_mode_objs = [o for o in _all_mvf_objs if o.SelectionMode == 'all']
@@ -71,6 +105,7 @@ class CfdCaseWriterFoam:
         self.mesh_generated = False
         self.working_dir = CfdTools.getOutputPath(self.analysis_obj)
         self.progressCallback = None
+        self.tri_surface_path = None
 
         self.settings = None
         self.SnappySettings = None
@@ -116,6 +151,8 @@ class CfdCaseWriterFoam:
             'boundaries': dict((b.Label, CfdTools.propsToDict(b)) for b in self.bc_group),
             'reportingFunctions': dict((fo.Label, CfdTools.propsToDict(fo)) for fo in self.reporting_functions),
             'reportingFunctionsEnabled': False,
+            'convergenceCriteria': dict((cc.Label, CfdTools.propsToDict(cc)) for cc in self.convergence_criteria),
+            'convergenceCriteriaEnabled': False,
             'scalarTransportFunctions': dict((st.Label, CfdTools.propsToDict(st)) for st in self.scalar_transport_objs),
             'scalarTransportFunctionsEnabled': False,
             'meanVelocityForce': CfdTools.propsToDict(self.mean_velocity_force_obj) if self.mean_velocity_force_obj else {},
@@ -168,6 +205,10 @@ class CfdCaseWriterFoam:
             self.settings['meshDir'] = '/tmp/{}'.format(mesh_d)
 
         self.settings['meshDir'] = self.settings['meshDir'].replace('\\', '/')
+        # Relative, so that the link is also valid inside a container
+        self.settings['meshLinkTarget'] = os.path.relpath(
+            os.path.join(self.working_dir, self.mesh_obj.CaseName, 'constant', 'polyMesh'),
+            os.path.join(self.case_folder, 'constant')).replace('\\', '/')
 
         self.processSystemSettings()
         self.processSolverSettings()
@@ -175,38 +216,67 @@ class CfdCaseWriterFoam:
         self.processBoundaryConditions()
         self.processReferenceFrames()
         self.processInitialConditions()
-        CfdTools.clearCase(self.case_folder)
-
-        self.exportZoneStlSurfaces()
-        if self.porous_zone_objs:
-            self.processPorousZoneProperties()
-        self.processInitialisationZoneProperties()
-
-        if self.mean_velocity_force_cellzone_objs:
-            cfdMessage('Mean velocity force cell zone(s) present\n')
-            self.exportMeanVelocityForceCellZoneStlSurfaces()
-            self.processMeanVelocityForceCellZoneProperties()
-
-        if self.reporting_functions:
-            cfdMessage('Reporting functions present\n')
-            self.processReportingFunctions()
 
-        if self.scalar_transport_objs:
-            cfdMessage('Scalar transport functions present\n')
-            self.processScalarTransportFunctions()
-
-        if self.dynamic_mesh_refinement_obj:
-            cfdMessage('Dynamic mesh adaptation rule present\n')
-            self.processDynamicMeshRefinement()
-
-        self.settings['createPatchesFromSnappyBaffles'] = False
-        self.settings['createPatchesForPeriodics'] = False
-        cfdMessage("Matching boundary conditions ...\n")
-        if self.progressCallback:
-            self.progressCallback("Matching boundary conditions ...")
-        self.setupPatchNames()
+        # In incremental mode, keep the existing case (apart from results) if it was also written incrementally
+        incremental = self.solver_obj.IncrementalCaseWrite
+        manifest = CfdTools.readCaseManifest(self.case_folder) if incremental else None
+        if manifest is None:
+            CfdTools.clearCase(self.case_folder)
+        else:
+            CfdTools.clearCaseResults(self.case_folder)
+        if incremental:
+            # Export surfaces separately so that they can be compared with those already in the case
+            self.tri_surface_path = tempfile.mkdtemp()
+        else:
+            self.tri_surface_path = os.path.join(self.case_folder, "constant", "triSurface")
 
-        TemplateBuilder(self.case_folder, self.template_path, self.settings)
+        try:
+            self.exportZoneStlSurfaces()
+            if self.porous_zone_objs:
+                self.processPorousZoneProperties()
+            self.processInitialisationZoneProperties()
+
+            if self.mean_velocity_force_cellzone_objs:
+                cfdMessage('Mean velocity force cell zone(s) present\n')
+                self.exportMeanVelocityForceCellZoneStlSurfaces()
+                self.processMeanVelocityForceCellZoneProperties()
+
+            if self.reporting_functions:
+                cfdMessage('Reporting functions present\n')
+                self.processReportingFunctions()
+
+            if self.convergence_criteria:
+                cfdMessage('Convergence criteria present\n')
+                self.processConvergenceCriteria()
+
+            if self.scalar_transport_objs:
+                cfdMessage('Scalar transport functions present\n')
+                self.processScalarTransportFunctions()
+
+            if self.dynamic_mesh_refinement_obj:
+                cfdMessage('Dynamic mesh adaptation rule present\n')
+                self.processDynamicMeshRefinement()
+
+            self.settings['createPatchesFromSnappyBaffles'] = False
+            self.settings['createPatchesForPeriodics'] = False
+            cfdMessage("Matching boundary conditions ...\n")
+            if self.progressCallback:
+                self.progressCallback("Matching boundary conditions ...")
+            self.setupPatchNames()
+
+            if incremental:
+                sink = MemorySink()
+                self.buildCaseFiles(sink)
+                case_files = sink.files
+                for f in os.listdir(self.tri_surface_path):
+                    with open(os.path.join(self.tri_surface_path, f), 'rb') as fid:
+                        case_files['constant/triSurface/' + f] = fid.read()
+                self.writeChangedCaseFiles(case_files, manifest)
+            else:
+                self.buildCaseFiles()
+        finally:
+            if incremental:
+                shutil.rmtree(self.tri_surface_path, ignore_errors=True)
 
         # Update Allrun permission - will fail silently on Windows
         file_name = os.path.join(self.case_folder, "Allrun")
@@ -220,6 +290,77 @@ class CfdCaseWriterFoam:
 
         return True
 
+    def buildCaseFiles(self, sink=None):
+        """
+        Generate the case files from the template, into sink if given or otherwise the case folder. The files
+        are rendered concurrently by a pool of threads if the preferences allow more than one.
+        """
+        prefs = CfdTools.getPreferencesLocation()
+        max_num_threads = FreeCAD.ParamGet(prefs).GetUnsigned("CaseWriterMaxThreads", 1)
+        if max_num_threads < 1:
+            max_num_threads = os.cpu_count() or 1
+        if max_num_threads == 1:
+            TemplateBuilder(self.case_folder, self.template_path, self.settings, sink=sink)
+        else:
+            with ThreadPoolExecutor(max_num_threads) as executor:
+                TemplateBuilder(self.case_folder, self.template_path, self.settings, sink=sink, executor=executor)
+
+    def writeChangedCaseFiles(self, case_files, manifest):
+        """
+        Write those case files whose contents differ from the previous incremental write recorded in
+        manifest (None if there was none) and remove those no longer generated. The pre-processing
+        steps that Allrun needs to repeat as a result are written to the file 'staleSteps'.
+        """
+        hashes = {f: CfdTools.hashFileContents(contents) for f, contents in case_files.items()}
+        if manifest is None:
+            manifest = {}
+            stale_steps = ['all']
+        else:
+            stale_steps = []
+            # Steps not yet run since the last write are still outstanding
+            try:
+                with open(os.path.join(self.case_folder, 'staleSteps')) as fid:
+                    stale_steps = fid.read().split()
+            except OSError:
+                stale_steps = ['all']
+        changed = set(f for f, h in hashes.items()
+                      if manifest.get(f) != h or not os.path.isfile(os.path.join(self.case_folder, f)))
+        removed = set(manifest) - set(hashes)
+        for step in findStaleSteps(changed | removed):
+            if step not in stale_steps:
+                stale_steps.append(step)
+        if 'all' in stale_steps:
+            stale_steps = ['all']
+        if 'all' in stale_steps or 'setFields' in stale_steps:
+            # Allrun modifies the initial fields in place, so they have to be restored before it is re-run
+            changed.update(f for f in hashes if f.startswith('0/'))
+
+        for f in removed:
+            paths = [os.path.join(self.case_folder, f)]
+            if f.startswith('0/'):
+                paths += glob.glob(os.path.join(self.case_folder, 'processor*', f))
+            for path in paths:
+                if os.path.isfile(path) and not os.path.islink(os.path.dirname(path)):
+                    os.remove(path)
+        for f in changed:
+            path = os.path.join(self.case_folder, f)
+            if os.path.islink(os.path.dirname(path)):
+                # Replace a link to the mesh case's mesh rather than writing through it; Allrun restores the link
+                os.unlink(os.path.dirname(path))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fid:
+                fid.write(case_files[f])
+
+        with open(os.path.join(self.case_folder, 'staleSteps'), 'w') as fid:
+            fid.write(' '.join(stale_steps) + '\n')
+        CfdTools.writeCaseManifest(self.case_folder, hashes)
+
+        cfdMessage("Updated {} and removed {} of {} case files\n".format(len(changed), len(removed), len(hashes)))
+        if stale_steps:
+            cfdMessage("Pre-processing steps to be repeated: {}\n".format(', '.join(stale_steps)))
+        else:
+            cfdMessage("Existing mesh, fields and decomposition are up to date\n")
+
     def getSolverName(self):
         """
         Solver name is selected based on selected physics. This should only be extended as additional physics are
@@ -273,11 +414,75 @@ class CfdCaseWriterFoam:
 
     def processSolverSettings(self):
         solver_settings = self.settings['solver']
+        solver_settings['DecompositionMethod'] = 'scotch'
         if solver_settings['Parallel']:
+            if solver_settings['AutoParallelCores']:
+                self.processAutoDecomposition()
             if solver_settings['ParallelCores'] < 2:
                 solver_settings['ParallelCores'] = 2
+        else:
+            solver_settings['ParallelPreProcessing'] = False
+        # Otherwise, the full mesh is modified by pre-processing, so the case needs its own copy
+        solver_settings['ReuseMesh'] = solver_settings['ReuseMesh'] and solver_settings['ParallelPreProcessing']
+        # The PowerShell Allrun used with MinGW and blueCFD copies the mesh and decomposes it afresh each time
+        runtime = self.settings['system']['FoamRuntime']
+        if runtime == 'MinGW' or runtime.startswith('BlueCFD'):
+            solver_settings['ReuseMesh'] = False
         solver_settings['SolverName'] = self.getSolverName()
 
+    def processAutoDecomposition(self):
+        """
+        Choose the number of subdomains from the number of cells in the mesh, up to the number of physical cores (or
+        the slots in the hostfile), and the decomposition method: hierarchical for extruded and 2D meshes, otherwise
+        KaHIP if OpenFOAM has it, or else Scotch
+        """
+        solver_settings = self.settings['solver']
+        system_settings = self.settings['system']
+
+        mesh_dir = os.path.join(self.working_dir, self.mesh_obj.CaseName)
+        num_cells = CfdDecomposition.getMeshCellCount(mesh_dir)
+        if num_cells is None:
+            try:
+                num_cells = CfdMeshEstimate.estimateMesh(self.mesh_obj)['cells']
+            except (RuntimeError, ValueError, ZeroDivisionError):
+                CfdTools.cfdWarning("The size of the mesh is not known, so {} parallel cores will be used\n".format(
+                    solver_settings['ParallelCores']))
+                return
+            cfdMessage("No mesh found; decomposing for an estimated {} cells\n".format(num_cells))
+
+        if system_settings['hostFileRequired']:
+            hostfile = system_settings['hostFileName']
+        else:
+            hostfile = CfdDecomposition.findHostfile(system_settings['MPIOptionsOMPI']) or \
+                CfdDecomposition.findHostfile(system_settings['MPIOptionsMSMPI'])
+        max_cores = None
+        if hostfile:
+            max_cores = CfdDecomposition.readHostfileSlots(os.path.join(self.case_folder, hostfile))
+        if max_cores is None:
+            max_cores = CfdDecomposition.getPhysicalCoreCount()
+        num_subdomains = CfdDecomposition.getNumberOfSubdomains(
+            num_cells, solver_settings['CellsPerCore'], max_cores)
+        solver_settings['ParallelCores'] = num_subdomains
+
+        extrusion_objs = [mr for mr in CfdTools.getMeshRefinementObjs(self.mesh_obj) if mr.Extrusion]
+        if extrusion_objs:
+            solver_settings['DecompositionMethod'] = 'hierarchical'
+            bound_box = self.mesh_obj.Part.Shape.BoundBox
+            lengths = [bound_box.XLength, bound_box.YLength, bound_box.ZLength]
+            for mr in extrusion_objs:
+                if mr.ExtrusionType in ['2DPlanar', '2DWedge']:
+                    # Do not divide the empty direction, normal to the 2D face
+                    normal = mr.Shape.Faces[0].normalAt(0.5, 0.5)
+                    bound_box = mr.Shape.BoundBox
+                    lengths = [bound_box.XLength, bound_box.YLength, bound_box.ZLength]
+                    lengths[max(range(3), key=lambda i: abs(normal[i]))] = 0
+            solver_settings['HierarchicalCoeffs'] = CfdDecomposition.getHierarchicalCoefficients(
+                num_subdomains, lengths)
+        elif not CfdTools.DockerContainer.usedocker and CfdDecomposition.isKahipAvailable(CfdTools.getFoamDir()):
+            solver_settings['DecompositionMethod'] = 'kahip'
+        cfdMessage("Decomposing {} cells into {} subdomains using {}\n".format(
+            num_cells, num_subdomains, solver_settings['DecompositionMethod']))
+
     def processSystemSettings(self):
         installation_path = CfdTools.getFoamDir()
         if CfdTools.getFoamRuntime() == 'BlueCFD2':
@@ -656,6 +861,22 @@ class CfdCaseWriterFoam:
                 rf['Pitch'] = Vector(rf['Lift']).cross(Vector(rf['Drag']))
                 rf['Pitch'] = tuple(p for p in rf['Pitch'])
 
+    def processConvergenceCriteria(self):
+        """ Check the reporting function monitored by each criterion, and find the result to monitor """
+        settings = self.settings
+        settings['convergenceCriteriaEnabled'] = True
+
+        for name in settings['convergenceCriteria']:
+            cc = settings['convergenceCriteria'][name]
+            rf = cc['ReportingFunction']
+            if rf is None or rf not in self.reporting_functions:
+                raise RuntimeError("Convergence criterion '{}' does not refer to a reporting function in the "
+                                   "analysis".format(name))
+            cc['FunctionObjectName'] = rf.Label
+            if not cc['ResultName']:
+                cc['ResultName'] = CfdConvergenceCriterion.DEFAULT_RESULT_NAMES[rf.ReportingFunctionType].format(
+                    rf.SampleFieldName)
+
     def processScalarTransportFunctions(self):
         settings = self.settings
         settings['scalarTransportFunctionsEnabled'] = True
@@ -691,18 +912,18 @@ class CfdCaseWriterFoam:
 
     # Zones
     def exportZoneStlSurfaces(self):
+        surface_meshes = []
         for zo in self.zone_objs:
             for r in zo.ShapeRefs:
-                path = os.path.join(self.working_dir,
-                                    self.solver_obj.InputCaseName,
-                                    "constant",
-                                    "triSurface")
+                path = self.tri_surface_path
                 if not os.path.exists(path):
                     os.makedirs(path)
                 sel_obj = r[0]
                 shape = sel_obj.Shape
-                CfdMeshTools.writeSurfaceMeshFromShape(shape, path, r[0].Name, self.mesh_obj)
-                print("Successfully wrote stl surface\n")
+                surface_meshes.append((shape, path, r[0].Name))
+        CfdMeshTools.writeSurfaceMeshesFromShapes(
+            surface_meshes, self.mesh_obj, lambda file_name: print("Successfully wrote stl surface\n"),
+            cache_dir=CfdMeshTools.getTriangulationCacheDir(self.working_dir))
 
     def processPorousZoneProperties(self):
         settings = self.settings
@@ -748,17 +969,18 @@ class CfdCaseWriterFoam:
 
     # Mean velocity force cell zones
     def exportMeanVelocityForceCellZoneStlSurfaces(self):
+        surface_meshes = []
         for o in self.mean_velocity_force_cellzone_objs:
             for r in o.ShapeRefs:
-                path = os.path.join(self.working_dir,
-                                    self.solver_obj.InputCaseName,
-                                    "constant",
-                                    "triSurface")
+                path = self.tri_surface_path
                 if not os.path.exists(path):
                     os.makedirs(path)
                 shape = r[0].Shape
-                CfdMeshTools.writeSurfaceMeshFromShape(shape, path, r[0].Name, self.mesh_obj)
-                print("Successfully wrote stl surface for mean velocity force cell zone\n")
+                surface_meshes.append((shape, path, r[0].Name))
+        CfdMeshTools.writeSurfaceMeshesFromShapes(
+            surface_meshes, self.mesh_obj,
+            lambda file_name: print("Successfully wrote stl surface for mean velocity force cell zone\n"),
+            cache_dir=CfdMeshTools.getTriangulationCacheDir(self.working_dir))
 
     def processMeanVelocityForceCellZoneProperties(self):
         settings = self.settings
@@ -29,14 +29,58 @@
 from __future__ import print_function
 
 import os
+import re
+import base64
+import json
+from array import array
+import numpy
 import FreeCAD
 from FreeCAD import Units
 from CfdOF import CfdTools
 from CfdOF import CfdAnalysis
+from CfdOF import CfdDecomposition
 from PySide.QtCore import QObject, Signal
 from collections import OrderedDict
 
 from CfdOF.CfdTimePlot import TimePlot
+from CfdOF.CfdLogTailer import LogTailer
+
+
+# Plot labels of the residuals of known fields, in plotting order. Fields sharing a label share a
+# history. Any other field is added, labelled with its own name, when it is first solved for.
+_RESIDUAL_LABELS = OrderedDict([
+    ('rho', '$\\rho$'),
+    ('Ux', '$U_x$'),
+    ('Uy', '$U_y$'),
+    ('Uz', '$U_z$'),
+    ('p', '$p$'),
+    ('p_rgh', '$p$'),
+    ('h', '$E$'),
+    ('k', '$k$'),
+    ('epsilon', '$\\epsilon$'),
+    ('nuTilda', '$\\tilde{\\nu}$'),
+    ('omega', '$\\omega$'),
+    ('gammaInt', '$\\gamma$'),
+    ('ReThetat', '$Re_{\\theta}$')])
+
+# Lines of the solver log read by the residual parser. These begin with a literal string so that they
+# can be searched for quickly; the rest of the line is checked when a match is found.
+_TIME_REGEX = re.compile(r'Time = (.*?)s?[ \t\r]*$', re.MULTILINE)
+_OUTER_ITER_REGEX = re.compile(r': iteration ')
+_COUPLED_RESIDUAL_REGEX = re.compile(r'Residual:')
+_RESIDUAL_REGEX = re.compile(r'Solving for ([^\s,]+), Initial residual = ([^\s,]+),')
+
+# Lines of the solver log read by the performance parser, found only at the start of a line
+_COURANT_REGEX = re.compile(r'Courant Number mean: (\S+) max: (\S+)')
+_DELTA_T_REGEX = re.compile(r'deltaT = (\S+)')
+_EXECUTION_TIME_REGEX = re.compile(r'ExecutionTime = (\S+) s +ClockTime = (\S+) s')
+
+# Summary of solver performance saved in the case directory
+RUN_SUMMARY_NAME = 'runSummary.json'
+
+# Wall-clock period (s) over which rates are averaged. OpenFOAM reports ClockTime in whole seconds, so rates over
+# shorter periods are too noisy to use.
+_RATE_WINDOW = 10.0
 
 
 class CfdRunnable(QObject, object):
@@ -76,10 +120,12 @@ class CfdRunnableFoam(CfdRunnable):
         self.force_coeffs = {}
         self.probes = {}
         self.postproc_readers = []
+        self.log_tailer = None
 
         self.constructReportingFunctionPlotters()
 
         self.initResiduals()
+        self.initPerformance()
         self.initMonitors()
 
     def constructReportingFunctionPlotters(self):
@@ -107,28 +153,14 @@ class CfdRunnableFoam(CfdRunnable):
                         self.solver.Proxy.probes_plotters[rf.Label].y_label = rf.SampleFieldName
 
     def initResiduals(self):
-        self.UxResiduals = []
-        self.UyResiduals = []
-        self.UzResiduals = []
-        self.pResiduals = []
-        self.rhoResiduals = []
-        self.EResiduals = []
-        self.kResiduals = []
-        self.epsilonResiduals = []
-        self.omegaResiduals = []
-        self.nuTildaResiduals = []
-        self.gammaIntResiduals = []
-        self.ReThetatResiduals = []
-
-        self.time = []
-        self.niter = 0
-        self.latest_time = 0
-        self.prev_time = 0
-        self.latest_outer_iter = 0
-        self.prev_num_outer_iters = 0
-
+        self.residual_parser = ResidualParser()
         self.solver.Proxy.residual_plotter.reInitialise(self.analysis)
 
+    def initPerformance(self):
+        self.performance_parser = PerformanceParser()
+        self.solver.Proxy.throughput_plotter.reInitialise(self.analysis)
+        self.solver.Proxy.time_step_plotter.reInitialise(self.analysis)
+
     def initMonitors(self):
         working_dir = CfdTools.getOutputPath(self.analysis)
         case_name = self.solver.InputCaseName
@@ -136,46 +168,48 @@ class CfdRunnableFoam(CfdRunnable):
         self.postproc_readers = []
 
         for fn in self.forces:
+            function_dir = os.path.join(solver_dir, 'postProcessing', fn)
             # OpenCFD
-            file_name = os.path.join(solver_dir, 'postProcessing', fn, '0', 'force.dat')
             legends = ["$F_X$ (pressure)", "$F_Y$ (pressure)", "$F_Z$ (pressure)", 
                        "$F_X$ (viscous)", "$F_Y$ (viscous)", "$F_Z$ (viscous)"]
             self.postproc_readers += [PostProcessingReader(
-                file_name, [4, 5, 6, 7, 8, 9], legends, self.solver.Proxy.forces_plotters[fn])]
+                function_dir, 'force.dat', [4, 5, 6, 7, 8, 9], legends, self.solver.Proxy.forces_plotters[fn])]
             # Foundation
-            file_name = os.path.join(solver_dir, 'postProcessing', fn, '0', 'forces.dat')
             legends = ["$F${} (pressure)", "$F${} (viscous)"]
             self.postproc_readers += [PostProcessingReader(
-                file_name, [1, 2], legends, self.solver.Proxy.forces_plotters[fn])]
+                function_dir, 'forces.dat', [1, 2], legends, self.solver.Proxy.forces_plotters[fn])]
             self.solver.Proxy.forces_plotters[fn].reInitialise(self.analysis)
 
         for fcn in self.force_coeffs:
+            function_dir = os.path.join(solver_dir, 'postProcessing', fcn)
             legends = ["$C_D$", "$C_L$"]
             # OpenCFD
-            file_name = os.path.join(solver_dir, 'postProcessing', fcn, '0', 'coefficient.dat')
             self.postproc_readers += [PostProcessingReader(
-                file_name, [1, 4], legends, self.solver.Proxy.force_coeffs_plotters[fcn])]
+                function_dir, 'coefficient.dat', [1, 4], legends, self.solver.Proxy.force_coeffs_plotters[fcn])]
             # Foundation
-            file_name = os.path.join(solver_dir, 'postProcessing', fcn, '0', 'forceCoeffs.dat')
             self.postproc_readers += [PostProcessingReader(
-                file_name, [2, 3], legends, self.solver.Proxy.force_coeffs_plotters[fcn])]
+                function_dir, 'forceCoeffs.dat', [2, 3], legends, self.solver.Proxy.force_coeffs_plotters[fcn])]
             self.solver.Proxy.force_coeffs_plotters[fcn].reInitialise(self.analysis)
 
         for pn in self.probes:
             p = self.probes[pn]
-            file_name = os.path.join(solver_dir, 'postProcessing', pn, '0', p['field'])
+            function_dir = os.path.join(solver_dir, 'postProcessing', pn)
             legends = []
             for pi in p['points']:
                 points_str = '({}, {}, {}) m'.format(
                     *(Units.Quantity(pij, Units.Length).getValueAs('m') for pij in (pi.x, pi.y, pi.z)))
                 legends.append('{}{{}} @ '.format(p['field']) + points_str)
             self.postproc_readers += [PostProcessingReader(
-                file_name, range(1, len(p['points'])+1), legends, self.solver.Proxy.probes_plotters[pn])]
+                function_dir, p['field'], range(1, len(p['points'])+1), legends,
+                self.solver.Proxy.probes_plotters[pn])]
             self.solver.Proxy.probes_plotters[pn].reInitialise(self.analysis)
 
 
     def getSolverCmd(self, case_dir):
+        # Output now comes from the process we start
+        self.log_tailer = None
         self.initResiduals()
+        self.initPerformance()
         self.initMonitors()
 
         # Environment is sourced in run script, so no need to include in run command
@@ -187,163 +221,585 @@ class CfdRunnableFoam(CfdRunnable):
         return cmd
 
     def processOutput(self, text):
-        log_lines = text.split('\n')[:-1]
-        prev_niter = self.niter
-        for line in log_lines:
-            line = line.rstrip()
-            split = line.split()
-
-            # Only record the first residual per outer iteration
-            if line.startswith(u"Time = "):
-                try:
-                    time_val = float(line.lstrip(u"Time = ").rstrip("s"))
-                except ValueError:
-                    pass
-                else:
-                    self.prev_time = self.latest_time
-                    self.latest_time = time_val
-                    self.prev_num_outer_iters = self.latest_outer_iter
-                    if self.latest_time > 0:
-                        # Don't keep spurious time zero
-                        self.latest_outer_iter = 0
-                        self.niter += 1
-                    self.in_forces_section = None
-                    self.in_forcecoeffs_section = None
-
-            if line.find(u"PIMPLE: iteration ") >= 0 or line.find(u"pseudoTime: iteration ") >= 0:
-                self.latest_outer_iter += 1
-                # Don't increment counter on first outer iter as this was already done with time
-                if self.latest_outer_iter > 1:
-                    self.niter += 1
-
-            # Add a point to the time axis for each outer iteration
-            if self.niter > len(self.time):
-                self.time.append(self.latest_time)
-                if self.latest_outer_iter > 0:
-                    # Outer-iteration case
-                    # Create virtual times to space the residuals of the outer iterations nicely on the time graph
-                    self.prev_num_outer_iters = max(self.prev_num_outer_iters, self.latest_outer_iter)
-                    for i in range(self.latest_outer_iter):
-                        self.time[-(self.latest_outer_iter-i)] = self.prev_time + (
-                            self.latest_time-self.prev_time)*((i+1)/self.prev_num_outer_iters)
-
-            if "Ux," in split and self.niter > len(self.UxResiduals):
-                self.UxResiduals.append(float(split[7].split(',')[0]))
-            if "Uy," in split and self.niter > len(self.UyResiduals):
-                self.UyResiduals.append(float(split[7].split(',')[0]))
-            if "Uz," in split and self.niter > len(self.UzResiduals):
-                self.UzResiduals.append(float(split[7].split(',')[0]))
-            if "p," in split and self.niter > len(self.pResiduals):
-                self.pResiduals.append(float(split[7].split(',')[0]))
-            if "p_rgh," in split and self.niter > len(self.pResiduals):
-                self.pResiduals.append(float(split[7].split(',')[0]))
-            if "h," in split and self.niter > len(self.EResiduals):
-                self.EResiduals.append(float(split[7].split(',')[0]))
-            # HiSA coupled residuals
-            if "Residual:" in split and self.niter > len(self.rhoResiduals):
-                self.rhoResiduals.append(float(split[4]))
-                self.UxResiduals.append(float(split[5].lstrip('(')))
-                self.UyResiduals.append(float(split[6]))
-                self.UzResiduals.append(float(split[7].rstrip(')')))
-                self.EResiduals.append(float(split[8]))
-            if "k," in split and self.niter > len(self.kResiduals):
-                self.kResiduals.append(float(split[7].split(',')[0]))
-            if "epsilon," in split and self.niter > len(self.epsilonResiduals):
-                self.epsilonResiduals.append(float(split[7].split(',')[0]))
-            if "omega," in split and self.niter > len(self.omegaResiduals):
-                self.omegaResiduals.append(float(split[7].split(',')[0]))
-            if "nuTilda," in split and self.niter > len(self.nuTildaResiduals):
-                self.nuTildaResiduals.append(float(split[7].split(',')[0]))
-            if "gammaInt," in split and self.niter > len(self.gammaIntResiduals):
-                self.gammaIntResiduals.append(float(split[7].split(',')[0]))
-            if "ReThetat," in split and self.niter > len(self.ReThetatResiduals):
-                self.ReThetatResiduals.append(float(split[7].split(',')[0]))
-
         # Update plots
-        if self.niter > 1 and self.niter > prev_niter:
-            self.solver.Proxy.residual_plotter.updateValues(self.time, OrderedDict([
-                ('$\\rho$', self.rhoResiduals),
-                ('$U_x$', self.UxResiduals),
-                ('$U_y$', self.UyResiduals),
-                ('$U_z$', self.UzResiduals),
-                ('$p$', self.pResiduals),
-                ('$E$', self.EResiduals),
-                ('$k$', self.kResiduals),
-                ('$\\epsilon$', self.epsilonResiduals),
-                ('$\\tilde{\\nu}$', self.nuTildaResiduals),
-                ('$\\omega$', self.omegaResiduals),
-                ('$\\gamma$', self.gammaIntResiduals),
-                ('$Re_{\\theta}$', self.ReThetatResiduals)]))
+        if self.residual_parser.parse(text):
+            self.solver.Proxy.residual_plotter.updateValues(
+                self.residual_parser.time, self.residual_parser.residuals)
+        if self.performance_parser.parse(text):
+            self.updatePerformancePlots()
 
         # postProcessing readers
         for r in self.postproc_readers:
             r.read()
 
+    def updatePerformancePlots(self):
+        parser = self.performance_parser
+        step_execution_time, step_clock_time, cpu_ratio, time_rate = parser.getRates()
+        self.solver.Proxy.throughput_plotter.updateValues(parser.time, OrderedDict([
+            ("Clock time", step_clock_time),
+            ("Execution time", step_execution_time)]))
+        delta_t = numpy.array(parser.delta_t)
+        if numpy.isfinite(delta_t).any():
+            self.solver.Proxy.time_step_plotter.updateValues(parser.time, OrderedDict([("$\\Delta t$", delta_t)]))
+
+    def getEndTime(self):
+        """ The simulation time (or iteration, for a steady case) at which the solver will stop """
+        if CfdTools.getPhysicsModel(self.analysis).Time == 'Transient':
+            return self.solver.EndTime.getValueAs('s').Value
+        else:
+            return self.solver.MaxIterations
+
+    def writeRunSummary(self):
+        """ Save a summary of the solver's performance in the case directory """
+        summary = self.performance_parser.getSummary()
+        if not summary:
+            return
+        case_dir = os.path.join(CfdTools.getOutputPath(self.analysis), self.solver.InputCaseName)
+        if self.solver.Parallel:
+            # The number of cores may have been chosen automatically when the case was written
+            summary['cores'] = CfdDecomposition.readNumberOfSubdomains(case_dir) or self.solver.ParallelCores
+        else:
+            summary['cores'] = 1
+        try:
+            with open(os.path.join(case_dir, RUN_SUMMARY_NAME), 'w') as fid:
+                json.dump(summary, fid, indent=1, sort_keys=True)
+        except OSError as e:
+            CfdTools.cfdMessage("Could not save run summary: {}\n".format(e))
+
     def solverFinished(self):
         for r in self.postproc_readers:
             r.end()
+        self.writeRunSummary()
+
+    def findSolverLog(self, case_dir):
+        """ Return the path of the most recently written solver log in the case, or None if there is none """
+        log_names = ['log.foamRun']
+        try:
+            with open(os.path.join(case_dir, 'system', 'controlDict')) as fid:
+                match = re.search(r'^application\s+(\S+);', fid.read(), re.MULTILINE)
+            if match:
+                log_names.append('log.' + match.group(1))
+        except OSError:
+            pass
+        log_files = [os.path.join(case_dir, n) for n in log_names if os.path.isfile(os.path.join(case_dir, n))]
+        return max(log_files, key=os.path.getmtime) if log_files else None
+
+    def attachToLog(self, case_dir):
+        """
+        Follow the solver log written in case_dir by a job not started from here (e.g. from the command line,
+        or in an earlier session). Reading resumes from the position saved when last detached, if the log
+        has not been restarted since. Returns False if there is no solver log.
+        """
+        file_name = self.findSolverLog(case_dir)
+        if file_name is None:
+            return False
+        state_file_name = os.path.join(case_dir, '.' + os.path.basename(file_name) + '.monitor')
+        self.log_tailer = LogTailer(file_name, state_file_name, restart_hook=self.restartMonitoring)
+        state = self.log_tailer.load()
+        if state is not None:
+            try:
+                self.residual_parser.setState(state['residuals'])
+                self.performance_parser.setState(state['performance'])
+            except (KeyError, TypeError, ValueError):
+                # Not a state we can resume from, so read the whole log again
+                self.log_tailer.restart()
+            else:
+                self.solver.Proxy.residual_plotter.updateValues(
+                    self.residual_parser.time, self.residual_parser.residuals)
+                self.updatePerformancePlots()
+        self.monitorLog()
+        return True
+
+    def restartMonitoring(self):
+        self.initResiduals()
+        self.initPerformance()
+        self.initMonitors()
+
+    def monitorLog(self):
+        """ Process any output added to the log being followed since the last call """
+        if self.log_tailer is not None:
+            self.processOutput(self.log_tailer.read())
+
+    def detachFromLog(self):
+        """ Stop following the solver log, saving the position reached for next time """
+        if self.log_tailer is not None:
+            self.log_tailer.save({'residuals': self.residual_parser.getState(),
+                                  'performance': self.performance_parser.getState()})
+            self.log_tailer = None
+            self.writeRunSummary()
+
+
+class ResidualParser:
+    """
+    Extracts the history of initial residuals from solver log output. The first residual of each field in every
+    (outer) iteration is stored, with the time of the iteration, in arrays of doubles.
+    """
+    def __init__(self):
+        self.time = array('d')
+        self.residuals = OrderedDict((label, array('d')) for label in _RESIDUAL_LABELS.values())
+        self.niter = 0
+        self.latest_time = 0
+        self.prev_time = 0
+        self.latest_outer_iter = 0
+        self.prev_num_outer_iters = 0
+        self.partial_line = ''
+
+    def parse(self, text):
+        """
+        Parse a chunk of log output, which may contain any number of lines. An incomplete last line is
+        kept until the rest of it arrives. Returns True if the plot needs to be updated.
+        """
+        text = self.partial_line + text
+        end = text.rfind('\n') + 1
+        self.partial_line = text[end:]
+        prev_niter = self.niter
+
+        # Find the lines that start a new iteration (or give coupled residuals). Between them the iteration
+        # number is constant, so the ordinary residual lines can be processed in bulk.
+        markers = []
+        for match in _TIME_REGEX.finditer(text, 0, end):
+            # Exclude e.g. ExecutionTime
+            if match.start() == 0 or text[match.start()-1] == '\n':
+                markers.append((match.start(), match))
+        for match in _OUTER_ITER_REGEX.finditer(text, 0, end):
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            if text.endswith(('PIMPLE', 'pseudoTime'), line_start, match.start()):
+                markers.append((match.start(), None))
+        for match in _COUPLED_RESIDUAL_REGEX.finditer(text, 0, end):
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            markers.append((match.start(), text[line_start:text.find('\n', match.start())]))
+        markers.sort(key=lambda m: m[0])
+
+        pos = 0
+        for marker_pos, marker in markers:
+            self.parseResiduals(text, pos, marker_pos)
+            pos = marker_pos
+            if marker is None:
+                self.latest_outer_iter += 1
+                # Don't increment counter on first outer iter as this was already done with time
+                if self.latest_outer_iter > 1:
+                    self.niter += 1
+                self.addTimePoint()
+            elif isinstance(marker, str):
+                # HiSA coupled residuals
+                split = marker.split()
+                if "Residual:" in split and self.niter > len(self.residuals['$\\rho$']):
+                    self.residuals['$\\rho$'].append(float(split[4]))
+                    self.residuals['$U_x$'].append(float(split[5].lstrip('(')))
+                    self.residuals['$U_y$'].append(float(split[6]))
+                    self.residuals['$U_z$'].append(float(split[7].rstrip(')')))
+                    self.residuals['$E$'].append(float(split[8]))
+            else:
+                # Only record the first residual per outer iteration
+                try:
+                    time_val = float(marker.group(1))
+                except ValueError:
+                    continue
+                self.prev_time = self.latest_time
+                self.latest_time = time_val
+                self.prev_num_outer_iters = self.latest_outer_iter
+                if self.latest_time > 0:
+                    # Don't keep spurious time zero
+                    self.latest_outer_iter = 0
+                    self.niter += 1
+                self.addTimePoint()
+        self.parseResiduals(text, pos, end)
+
+        return self.niter > 1 and self.niter > prev_niter
+
+    def parseResiduals(self, text, start, end):
+        """ Record the initial residuals solved for between start and end, all of which are in the same iteration """
+        residuals = self.residuals
+        for match in _RESIDUAL_REGEX.finditer(text, start, end):
+            field, residual = match.groups()
+            label = _RESIDUAL_LABELS.get(field, field)
+            history = residuals.get(label)
+            if history is None:
+                history = residuals[label] = array('d')
+            if self.niter <= len(history):
+                continue
+            # The diagonal solver does not produce a meaningful residual
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            if text.startswith('diagonal:', line_start):
+                continue
+            try:
+                history.append(float(residual))
+            except ValueError:
+                pass
+
+    def getState(self):
+        """ Return the parse history and position as a JSON-serialisable dict """
+        state = {k: getattr(self, k) for k in (
+            'niter', 'latest_time', 'prev_time', 'latest_outer_iter', 'prev_num_outer_iters', 'partial_line')}
+        state['time'] = base64.b64encode(self.time.tobytes()).decode('ascii')
+        state['residuals'] = [(label, base64.b64encode(values.tobytes()).decode('ascii'))
+                              for label, values in self.residuals.items()]
+        return state
+
+    def setState(self, state):
+        """ Restore a state returned by getState """
+        for k in ('niter', 'latest_time', 'prev_time', 'latest_outer_iter', 'prev_num_outer_iters', 'partial_line'):
+            setattr(self, k, state[k])
+        self.time = array('d', base64.b64decode(state['time']))
+        self.residuals = OrderedDict((label, array('d', base64.b64decode(values)))
+                                     for label, values in state['residuals'])
+
+    def addTimePoint(self):
+        """ Add a point to the time axis for each outer iteration """
+        if self.niter > len(self.time):
+            self.time.append(self.latest_time)
+            if self.latest_outer_iter > 0:
+                # Outer-iteration case
+                # Create virtual times to space the residuals of the outer iterations nicely on the time graph
+                self.prev_num_outer_iters = max(self.prev_num_outer_iters, self.latest_outer_iter)
+                for i in range(self.latest_outer_iter):
+                    self.time[-(self.latest_outer_iter-i)] = self.prev_time + (
+                        self.latest_time-self.prev_time)*((i+1)/self.prev_num_outer_iters)
+
+
+class PerformanceParser:
+    """
+    Extracts the time step, Courant number and the execution (CPU) and clock (wall) times of each time step or
+    iteration from solver log output, storing them in arrays of doubles. Values not reported by the solver are
+    stored as NaN.
+    """
+    def __init__(self):
+        self.time = array('d')
+        self.delta_t = array('d')
+        self.courant_mean = array('d')
+        self.courant_max = array('d')
+        self.execution_time = array('d')
+        self.clock_time = array('d')
+        self.latest_time = float('nan')
+        self.latest_delta_t = float('nan')
+        self.latest_courant = (float('nan'), float('nan'))
+        self.partial_line = ''
+
+    def parse(self, text):
+        """
+        Parse a chunk of log output, keeping an incomplete last line until the rest of it arrives. Returns True if
+        any time steps were completed.
+        """
+        text = self.partial_line + text
+        end = text.rfind('\n') + 1
+        self.partial_line = text[end:]
+        prev_nsteps = len(self.execution_time)
+
+        # Lines are processed in order, as a step is only complete when its execution time is reported
+        matches = []
+        for regex in (_TIME_REGEX, _COURANT_REGEX, _DELTA_T_REGEX, _EXECUTION_TIME_REGEX):
+            for match in regex.finditer(text, 0, end):
+                if match.start() == 0 or text[match.start()-1] == '\n':
+                    matches.append(match)
+        matches.sort(key=lambda m: m.start())
+
+        for match in matches:
+            try:
+                values = [float(v) for v in match.groups()]
+            except ValueError:
+                continue
+            if match.re is _TIME_REGEX:
+                self.latest_time = values[0]
+            elif match.re is _COURANT_REGEX:
+                self.latest_courant = tuple(values)
+            elif match.re is _DELTA_T_REGEX:
+                self.latest_delta_t = values[0]
+            else:
+                self.time.append(self.latest_time)
+                self.delta_t.append(self.latest_delta_t)
+                self.courant_mean.append(self.latest_courant[0])
+                self.courant_max.append(self.latest_courant[1])
+                self.execution_time.append(values[0])
+                self.clock_time.append(values[1])
+                self.latest_delta_t = float('nan')
+                self.latest_courant = (float('nan'), float('nan'))
+
+        return len(self.execution_time) > prev_nsteps
+
+    def getRates(self):
+        """
+        Return, for each step, the execution time taken by the step, and the clock time per step, ratio of
+        execution to clock time and rate of advance of simulation time per clock second, averaged over the
+        preceding _RATE_WINDOW seconds (NaN where not yet available)
+        """
+        time = numpy.array(self.time)
+        execution_time = numpy.array(self.execution_time)
+        clock_time = numpy.array(self.clock_time)
+        step_execution_time = numpy.diff(execution_time, prepend=0.0)
+
+        index = numpy.arange(len(clock_time))
+        start = numpy.maximum(numpy.searchsorted(clock_time, clock_time - _RATE_WINDOW, side='right') - 1, 0)
+        clock_period = clock_time - clock_time[start]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            valid = clock_period > 0
+            step_clock_time = numpy.where(valid, clock_period/(index - start), numpy.nan)
+            cpu_ratio = numpy.where(valid, (execution_time - execution_time[start])/clock_period, numpy.nan)
+            time_rate = numpy.where(valid, (time - time[start])/clock_period, numpy.nan)
+        return step_execution_time, step_clock_time, cpu_ratio, time_rate
+
+    def getEta(self, end_time):
+        """ Estimate the clock time in seconds to reach end_time at the current rate, or None if unknown """
+        if not len(self.time):
+            return None
+        time_rate = self.getRates()[3][-1]
+        if not time_rate > 0:
+            return None
+        return max(end_time - self.time[-1], 0.0)/time_rate
+
+    def getSummary(self):
+        """ Return a JSON-serialisable summary of the performance of the run so far """
+        if not len(self.time):
+            return {}
+        step_execution_time, step_clock_time, cpu_ratio, time_rate = self.getRates()
+        delta_t = numpy.array(self.delta_t)
+        courant_max = numpy.array(self.courant_max)
+
+        def finite(value):
+            return float(value) if numpy.isfinite(value) else None
+
+        nsteps = len(self.time)
+        summary = {
+            'steps': nsteps,
+            'startTime': finite(self.time[0]),
+            'endTime': finite(self.time[-1]),
+            'executionTime': self.execution_time[-1],
+            'clockTime': self.clock_time[-1],
+            'executionTimePerStep': finite(numpy.median(step_execution_time[1:])) if nsteps > 1 else None,
+            'clockTimePerStep': self.clock_time[-1]/nsteps,
+            'executionToClockTimeRatio':
+                self.execution_time[-1]/self.clock_time[-1] if self.clock_time[-1] > 0 else None,
+        }
+        if numpy.isfinite(delta_t).any():
+            summary['deltaT'] = {'min': float(numpy.nanmin(delta_t)), 'max': float(numpy.nanmax(delta_t)),
+                                 'final': finite(delta_t[-1])}
+        if numpy.isfinite(courant_max).any():
+            summary['maxCourantNumber'] = float(numpy.nanmax(courant_max))
+        return summary
+
+    def getState(self):
+        """ Return the parse history and position as a JSON-serialisable dict """
+        state = {k: getattr(self, k) for k in ('latest_time', 'latest_delta_t', 'latest_courant', 'partial_line')}
+        for k in ('time', 'delta_t', 'courant_mean', 'courant_max', 'execution_time', 'clock_time'):
+            state[k] = base64.b64encode(getattr(self, k).tobytes()).decode('ascii')
+        return state
+
+    def setState(self, state):
+        """ Restore a state returned by getState """
+        for k in ('latest_time', 'latest_delta_t', 'partial_line'):
+            setattr(self, k, state[k])
+        self.latest_courant = tuple(state['latest_courant'])
+        for k in ('time', 'delta_t', 'courant_mean', 'courant_max', 'execution_time', 'clock_time'):
+            setattr(self, k, array('d', base64.b64decode(state[k])))
+
+
+class _RowBuffer:
+    """
+    Rows of values, appended in an array whose capacity is doubled when full, so that the time taken to append
+    grows only with the number of rows added. Rows already stored are never changed, so views of them stay valid.
+    """
+    def __init__(self, num_columns):
+        self.data = numpy.zeros((0, num_columns))
+        self.num_rows = 0
+
+    def append(self, rows):
+        num_rows = self.num_rows + len(rows)
+        if num_rows > len(self.data):
+            data = numpy.empty((max(num_rows, 2*len(self.data), 64), self.data.shape[1]))
+            data[:self.num_rows] = self.data[:self.num_rows]
+            self.data = data
+        self.data[self.num_rows:num_rows] = rows
+        self.num_rows = num_rows
+
+    def get(self):
+        return self.data[:self.num_rows]
 
 
 class PostProcessingReader:
-    def __init__(self, file_name, column_numbers, legends, plotter):
+    """
+    Reads the output file of a function object, postProcessing/<function>/<start time>/<file_name>, as it is
+    written. A run restarted from a later time writes to a new start-time directory, so all of them are read
+    and stitched together in time order, the values in each directory being superseded by those in the next
+    from its start time onwards. Only the given columns are kept; a vector column gives three plot series.
+    """
+    def __init__(self, function_dir, file_name, column_numbers, legends, plotter):
+        self.function_dir = function_dir
         self.file_name = file_name
-        self.file = None
-        self.time = []
         self.column_numbers = column_numbers
         self.column_legends = legends
-        self.legends = []
-        self.values = []
+        self.legends = None
+        self.files = {}
+        self.time = numpy.zeros(0)
+        self.values = OrderedDict()
         self.plotter = plotter
+        # Stitched rows, and the files they came from: each as the file, the number of its rows read and the number
+        # of those kept, which is fewer where the next file starts
+        self.rows = None
+        self.segments = []
 
     def read(self):
-        if self.file is None:
-            try:
-                self.file = open(self.file_name)
-            except OSError:
-                pass
-        if self.file:
-            ntimes = len(self.time)
-            
-            for l in self.file.readlines():
-                l = l.strip()
-                if len(l) and not l.startswith('#'):
-                    s = l.split()
-                    self.time.append(float(s[0]))
-                    
-                    col_num = 1
-                    val_num = 0
-                    output_num = 0
-                    in_vector = False
-                    for i in range(1, len(s)):
-                        if s[i].startswith('('):
-                            in_vector = True
-                        v = s[i].lstrip('(').rstrip(')')
-                        if v and col_num in self.column_numbers:
-                            while len(self.values) < val_num+1:
-                                if in_vector:
-                                    self.legends.append(self.column_legends[output_num].format('$_x$'))
-                                    self.legends.append(self.column_legends[output_num].format('$_y$'))
-                                    self.legends.append(self.column_legends[output_num].format('$_z$'))
-                                    self.values.append([])
-                                    self.values.append([])
-                                    self.values.append([])
-                                else:
-                                    self.legends.append(self.column_legends[output_num].format(''))
-                                    self.values.append([])
-                            self.values[val_num].append(float(v))
-                            val_num += 1
-                        if s[i].endswith(')'):
-                            in_vector = False
-                        if v and not in_vector:
-                            if col_num in self.column_numbers:
-                                output_num += 1
-                            col_num += 1
-
-            if len(self.time) > ntimes:
-                self.plotter.updateValues(self.time, OrderedDict(
-                    zip(self.legends, self.values)))
+        try:
+            start_dirs = os.listdir(self.function_dir)
+        except OSError:
+            return
+        updated_files = []
+        for start_dir in start_dirs:
+            data_file = self.files.get(start_dir)
+            if data_file is None:
+                path = os.path.join(self.function_dir, start_dir, self.file_name)
+                try:
+                    start_time = float(start_dir)
+                except ValueError:
+                    continue
+                if not os.path.isfile(path):
+                    continue
+                data_file = self.files[start_dir] = _PostProcessingFile(path, start_time)
+            if data_file.read(self.column_numbers):
+                updated_files.append(data_file)
+                if self.legends is None:
+                    self.legends = data_file.getLegends(self.column_legends)
+        if updated_files:
+            self.stitch(updated_files)
+            self.plotter.updateValues(self.time, self.values)
+
+    def stitch(self, updated_files):
+        """
+        Combine the rows read from each start-time directory. Usually only the latest file has new rows, and these
+        are appended; otherwise the rows are combined again from the first file whose part has changed.
+        """
+        data_files = sorted((f for f in self.files.values()
+                             if f.rows is not None and f.rows.shape[1] == len(self.legends) + 1),
+                            key=lambda f: f.start_time)
+        num_same = 0
+        while num_same < min(len(data_files), len(self.segments)) and \
+                self.segments[num_same][0] is data_files[num_same] and data_files[num_same] not in updated_files:
+            num_same += 1
+        if num_same == len(data_files) == len(self.segments):
+            return
+        if num_same == len(data_files) - 1 == len(self.segments) - 1 and self.segments[-1][0] is data_files[-1]:
+            data_file, num_read, num_kept = self.segments.pop()
+            rows = data_file.rows[num_read:]
+            self.rows.append(rows)
+            self.segments.append((data_file, len(data_file.rows), num_kept + len(rows)))
+        else:
+            # The part from a file ends where the next file starts, so it changes when the next file does. The rows
+            # are combined into a new buffer, leaving those already passed to the plotter unchanged.
+            num_same = max(num_same - 1, 0)
+            del self.segments[num_same:]
+            rows = _RowBuffer(len(self.legends) + 1)
+            if self.rows is not None:
+                rows.append(self.rows.get()[:sum(num_kept for f, num_read, num_kept in self.segments)])
+            self.rows = rows
+            for i in range(num_same, len(data_files)):
+                rows = data_files[i].rows
+                if i + 1 < len(data_files):
+                    rows = rows[rows[:, 0] < data_files[i+1].start_time]
+                self.rows.append(rows)
+                self.segments.append((data_files[i], len(data_files[i].rows), len(rows)))
+        rows = self.rows.get()
+        self.time = rows[:, 0]
+        for i, legend in enumerate(self.legends):
+            self.values[legend] = rows[:, i+1]
 
     def end(self):
-        if self.file:
-            self.file.close()
-            self.file = None
+        # Pick up any output written since the last read
+        self.read()
+
+
+# Comment (header) lines in function object output files
+_COMMENT_LINE_REGEX = re.compile(r'^[ \t]*#.*$', re.MULTILINE)
+
+_BRACKETS_TO_SPACES = str.maketrans('()', '  ')
+
+
+class _PostProcessingFile:
+    """
+    A function object output file in one start-time directory, read incrementally. The layout of the columns
+    is found from the first row; each row then has the same number of values, so new rows can be parsed
+    together.
+    """
+    def __init__(self, path, start_time):
+        self.path = path
+        self.start_time = start_time
+        self.offset = 0
+        # Layout: number of values in each row, and positions within a row of the time and selected values
+        self.row_length = None
+        self.value_indices = None
+        self.vector_columns = None
+        self.buffer = None
+        self.rows = None
+
+    def read(self, column_numbers):
+        """ Read any complete rows added since the last read; returns True if there were any """
+        try:
+            with open(self.path, 'rb') as fid:
+                fid.seek(self.offset)
+                data = fid.read()
+        except OSError:
+            return False
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        text = _COMMENT_LINE_REGEX.sub('', data[:end].decode('utf-8', errors='replace'))
+        if self.row_length is None:
+            first_row = next((line for line in text.splitlines() if line.strip()), None)
+            if first_row is None:
+                return False
+            self.findLayout(first_row, column_numbers)
+        tokens = text.translate(_BRACKETS_TO_SPACES).split()
+        try:
+            values = numpy.array(tokens, dtype=float)
+        except ValueError:
+            values = None
+        if values is None or len(values) % self.row_length:
+            # Irregular rows; keep only those with the expected layout
+            values = []
+            for line in text.splitlines():
+                row = line.translate(_BRACKETS_TO_SPACES).split()
+                if len(row) == self.row_length:
+                    try:
+                        values.extend(float(v) for v in row)
+                    except ValueError:
+                        pass
+            values = numpy.array(values, dtype=float)
+        if not len(values):
+            return False
+        if self.buffer is None:
+            self.buffer = _RowBuffer(len(self.value_indices))
+        self.buffer.append(values.reshape(-1, self.row_length)[:, self.value_indices])
+        self.rows = self.buffer.get()
+        return True
+
+    def findLayout(self, line, column_numbers):
+        """ Find which values in a row belong to the selected columns, counting a vector as one column """
+        self.value_indices = [0]
+        self.vector_columns = []
+        col_num = 0
+        num_values = 0
+        in_vector = False
+        for token in line.replace('(', ' ( ').replace(')', ' ) ').split():
+            # Brackets around a group of vectors (e.g. Foundation forces.dat) do not form a column of their own
+            if token == '(':
+                if not in_vector and col_num in column_numbers:
+                    self.vector_columns.append(True)
+                in_vector = True
+            elif token == ')':
+                if in_vector:
+                    col_num += 1
+                in_vector = False
+            else:
+                if col_num in column_numbers and col_num > 0:
+                    self.value_indices.append(num_values)
+                    if not in_vector:
+                        self.vector_columns.append(False)
+                num_values += 1
+                if not in_vector:
+                    col_num += 1
+        self.row_length = num_values
+
+    def getLegends(self, column_legends):
+        legends = []
+        for legend, is_vector in zip(column_legends, self.vector_columns):
+            if is_vector:
+                legends += [legend.format('$_x$'), legend.format('$_y$'), legend.format('$_z$')]
+            else:
+                legends.append(legend.format(''))
+        return legends
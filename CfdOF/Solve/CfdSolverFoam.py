@@ -31,6 +31,7 @@ import os.path
 import FreeCAD
 
 from CfdOF import CfdTools
+from CfdOF import CfdDecomposition
 from CfdOF.CfdTimePlot import TimePlot
 from CfdOF.CfdTools import addObjectProperty
 
@@ -114,6 +115,53 @@ class CfdSolverFoam(object):
             "Solver",
             QT_TRANSLATE_NOOP("App::Property", "Number of cores on which to run parallel analysis"),
         )
+        addObjectProperty(
+            obj,
+            "AutoParallelCores",
+            False,
+            "App::PropertyBool",
+            "Solver",
+            QT_TRANSLATE_NOOP(
+                "App::Property",
+                "Choose the number of parallel cores and the decomposition method from the mesh, instead of using "
+                "ParallelCores",
+            ),
+        )
+        addObjectProperty(
+            obj,
+            "CellsPerCore",
+            CfdDecomposition.DEFAULT_CELLS_PER_CORE,
+            "App::PropertyInteger",
+            "Solver",
+            QT_TRANSLATE_NOOP(
+                "App::Property",
+                "Number of mesh cells per core when choosing the number of parallel cores automatically",
+            ),
+        )
+        addObjectProperty(
+            obj,
+            "ParallelPreProcessing",
+            False,
+            "App::PropertyBool",
+            "Solver",
+            QT_TRANSLATE_NOOP(
+                "App::Property",
+                "Decompose the mesh as soon as it is copied into the case, and run the pre-processing utilities "
+                "(createPatch, topoSet, setFields, createBaffles, changeDictionary) in parallel",
+            ),
+        )
+        addObjectProperty(
+            obj,
+            "ReuseMesh",
+            False,
+            "App::PropertyBool",
+            "Solver",
+            QT_TRANSLATE_NOOP(
+                "App::Property",
+                "With parallel pre-processing, link to the mesh in the mesh case instead of copying it, and keep "
+                "the decomposed mesh there for reuse while the mesh and decomposition settings are unchanged",
+            ),
+        )
         addObjectProperty(
             obj,
             "PurgeWrite",
@@ -125,6 +173,18 @@ class CfdSolverFoam(object):
                 "Sets a limit on the number of time directories that are stored by overwriting time directories on a cyclic basis.  Set to 0 to disable",
             ),
         )
+        addObjectProperty(
+            obj,
+            "IncrementalCaseWrite",
+            False,
+            "App::PropertyBool",
+            "Solver",
+            QT_TRANSLATE_NOOP(
+                "App::Property",
+                "Only rewrite case files that have changed since the last write, and re-run only the affected "
+                "pre-processing steps (mesh copy, topoSet, setFields, decomposition)",
+            ),
+        )
 
         addObjectProperty(
             obj,
@@ -247,11 +307,17 @@ class CfdSolverFoam(object):
         )
 
         self.residual_plotter = TimePlot(
-            title="Simulation residuals", y_label="Residual", is_log=True
+            title="Simulation residuals", y_label="Residual", is_log=True, blit=True
         )
         self.forces_plotters = {}
         self.force_coeffs_plotters = {}
         self.probes_plotters = {}
+        self.throughput_plotter = TimePlot(
+            title="Solver throughput", y_label="Time per step [s]", is_log=False
+        )
+        self.time_step_plotter = TimePlot(
+            title="Time step", y_label="Time step [s]", is_log=False
+        )
 
 
     def onDocumentRestored(self, obj):
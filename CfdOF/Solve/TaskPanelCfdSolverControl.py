@@ -76,6 +76,10 @@ class TaskPanelCfdSolverControl:
         self.Start = time.time()
         self.Timer.start()
 
+        # Pick up the output of a solver job started elsewhere or in an earlier session
+        if self.solver_runner.attachToLog(os.path.join(self.working_dir, self.solver_object.InputCaseName)):
+            self.consoleMessage("Monitoring existing solver log {}".format(self.solver_runner.log_tailer.file_name))
+
     def updateUI(self):
         solverDirectory = os.path.join(self.working_dir, self.solver_object.InputCaseName)
         self.form.pb_edit_inp.setEnabled(os.path.exists(solverDirectory))
@@ -95,6 +99,29 @@ class TaskPanelCfdSolverControl:
     def updateText(self):
         if self.solver_object.Proxy.solver_process.state() == QtCore.QProcess.ProcessState.Running:
             self.form.l_time.setText('Time: ' + CfdTools.formatTimer(time.time() - self.Start))
+        else:
+            self.solver_runner.monitorLog()
+        self.form.l_performance.setText(self.performanceText())
+
+    def performanceText(self):
+        """ Summarise the solver's recent progress """
+        parser = self.solver_runner.performance_parser
+        if not len(parser.time):
+            return ''
+        step_execution_time, step_clock_time, cpu_ratio, time_rate = parser.getRates()
+        lines = ['Execution time per step: {:.3g} s'.format(step_execution_time[-1])]
+        if step_clock_time[-1] > 0:
+            lines.append('Clock time per step: {:.3g} s (execution/clock: {:.0%})'.format(
+                step_clock_time[-1], cpu_ratio[-1]))
+        if parser.delta_t[-1] > 0:
+            lines.append('Time step: {:.3g} s'.format(parser.delta_t[-1]))
+        if parser.courant_max[-1] >= 0:
+            lines.append('Courant number: {:.3g} mean, {:.3g} max'.format(
+                parser.courant_mean[-1], parser.courant_max[-1]))
+        eta = parser.getEta(self.solver_runner.getEndTime())
+        if eta is not None:
+            lines.append('Estimated time remaining: ' + (CfdTools.formatTimer(eta)))
+        return '\n'.join(lines)
 
     def getStandardButtons(self):
         return QtGui.QDialogButtonBox.Close
@@ -107,6 +134,7 @@ class TaskPanelCfdSolverControl:
         self.solver_object.Proxy.solver_process.terminate()
         self.solver_object.Proxy.solver_process.waitForFinished()
         self.Timer.stop()
+        self.solver_runner.detachFromLog()
 
     def write_input_file_handler(self):
         self.Start = time.time()
@@ -28,29 +28,147 @@ from __future__ import print_function
 
 import re
 import os
+import io
+import time
+import tarfile
 
 
 class BracketError(ValueError):
     pass
 
 
+# Parsed template files, shared by all builders in this process. Keyed on the absolute path of
+# the template file; the modification time is checked on each use so that edited templates are
+# picked up.
+_template_cache = {}
+
+_markup_regex = re.compile(r'%[()\[\]{}:]')
+_integer_regex = re.compile('[0-9]+')
+_brackets = {'%(': '%)', '%[': '%]', '%{': '%}'}
+
+# Marks the position of a '%:' tag in the raw token stream
+_SWITCH = object()
+
+
+class DiskSink(object):
+    """ Write generated files into a directory on disk """
+    def __init__(self, case_path):
+        self.case_path = case_path
+        # Directories already known to exist, to avoid re-creating them for every file
+        self.made_dirs = set()
+
+    def writeFile(self, rel_file, contents):
+        # Make sure directory tree exists
+        rel_dir = os.path.dirname(rel_file)
+        if rel_dir not in self.made_dirs:
+            os.makedirs(os.path.join(self.case_path, rel_dir), exist_ok=True)
+            self.made_dirs.add(rel_dir)
+        # Write file - always want unix line endings so use binary
+        with open(os.path.join(self.case_path, rel_file), 'wb') as ofid:
+            ofid.write(contents)
+
+    def close(self):
+        pass
+
+
+class MemorySink(object):
+    """ Collect generated files in the dict 'files', mapping relative path to contents """
+    def __init__(self):
+        self.files = {}
+
+    def writeFile(self, rel_file, contents):
+        self.files[rel_file] = contents
+
+    def close(self):
+        pass
+
+
+class TarSink(object):
+    """
+    Write generated files to a tar archive, given either a file name or a writable file object. A
+    file object is written as a stream, so it need not be seekable (e.g. a pipe or socket).
+    The files named in 'executables' (by default the run scripts of case and mesh templates) are
+    marked as executable in the archive.
+    """
+    def __init__(self, file, compression='', executables=('Allrun', 'Allmesh')):
+        if isinstance(file, str):
+            self.tar = tarfile.open(file, 'w:' + compression)
+        else:
+            self.tar = tarfile.open(fileobj=file, mode='w|' + compression)
+        self.executables = executables
+        self.mtime = time.time()
+
+    def writeFile(self, rel_file, contents):
+        info = tarfile.TarInfo(rel_file)
+        info.size = len(contents)
+        info.mtime = self.mtime
+        info.mode = 0o755 if rel_file in self.executables else 0o644
+        self.tar.addfile(info, io.BytesIO(contents))
+
+    def close(self):
+        self.tar.close()
+
+
 class TemplateBuilder(object):
     """
     Build a case directory from a template directory by substituting
     values in a python settings dictionary
+
+    If compiled is True, each template file is parsed once into a tree of blocks, conditionals,
+    variables and includes, which is cached and rendered in a single pass. Otherwise the
+    template text is re-scanned and substituted in place every time it is used.
+
+    Generated files are passed, as UTF-8 encoded bytes with their '/'-separated path relative to the
+    case, to the writeFile method of sink. By default this is a DiskSink writing into case_path;
+    a MemorySink or TarSink can be given instead. The sink is not closed by the builder.
+
+    If executor (a concurrent.futures.Executor, such as a ThreadPoolExecutor) is given, the top-level
+    template files are rendered as independent tasks on it. The settings must not be modified while
+    the builder runs, and a ProcessPoolExecutor also requires them to be picklable. The outputs are
+    passed to the sink in the same order as for a serial build, and the first error (in that order)
+    is raised.
     """
-    def __init__(self, case_path, template_path, settings):
+    def __init__(self, case_path, template_path, settings, compiled=True, sink=None, executor=None):
         if case_path[0] == "~":
             case_path = os.path.expanduser(case_path)
 
         self.case_path = os.path.abspath(case_path)
         self.settings = settings
         self.template_path = template_path
+        self.compiled = compiled
+        self.sink = sink if sink is not None else DiskSink(self.case_path)
+        self.executor = executor
 
         self.buildDir('.')
 
     def buildDir(self, rel_dir):
         """ Recursively build files in dir (relative to case base) """
+        rel_files = self.findTemplateFiles(rel_dir)
+        if self.executor is None:
+            for rel_file in rel_files:
+                contents = self.buildFile(rel_file, [])
+                # Do not write a blank file - provides a way for optional creation of files
+                if len(contents):
+                    self.writeToFile(rel_file, contents)
+        else:
+            futures = [self.executor.submit(
+                _renderFile, self.case_path, self.template_path, self.settings, self.compiled, rel_file)
+                for rel_file in rel_files]
+            try:
+                for rel_file, future in zip(rel_files, futures):
+                    extra_files, contents = future.result()
+                    # Files written from inside the template come first, as in a serial build
+                    for extra_file, extra_contents in extra_files.items():
+                        self.sink.writeFile(extra_file, extra_contents)
+                    if len(contents):
+                        self.writeToFile(rel_file, contents)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def findTemplateFiles(self, rel_dir):
+        """ List the files to be built in dir (relative to case base) and its subdirectories """
+        rel_files = []
         full_dir = os.path.join(self.template_path, rel_dir)
         for f in os.listdir(full_dir):
             rel_file = os.path.join(rel_dir, f)
@@ -58,32 +176,18 @@ class TemplateBuilder(object):
             # and ignore the files that start with . because they can be swap files
             if os.path.basename(rel_file)[0] != '_' and os.path.basename(rel_file)[0] != '.':
                 if os.path.isdir(os.path.join(self.template_path, rel_dir, f)):
-                    self.buildDir(rel_file)
+                    rel_files += self.findTemplateFiles(rel_file)
                 else:
-                    contents = self.buildFile(rel_file, [])
-                    # Do not write a blank file - provides a way for optional creation of files
-                    if len(contents):
-                        self.writeToFile(rel_file, contents)
+                    rel_files.append(rel_file)
+        return rel_files
 
     def writeToFile(self, rel_file, contents):
-        # Make sure directory tree exists
-        path = os.path.join(self.case_path, os.path.dirname(rel_file))
-        try:
-            os.makedirs(path)
-        except OSError as exc:
-            import errno
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else:
-                raise
-        # Write file - always want unix line endings so use binary
-        with open(os.path.join(self.case_path, rel_file), 'wb') as ofid:
-            ofid.write(contents.encode('utf-8'))
+        self.sink.writeFile(os.path.normpath(rel_file).replace(os.sep, '/'), contents.encode('utf-8'))
 
     def buildFile(self, rel_file, params):
         """ Open the specified template file, make replacements, and return as a string """
         try:
-            fid = open(os.path.join(self.template_path, rel_file))
+            template = self.loadTemplate(rel_file)
         except IOError:
             # Special cases:
             # 1. Don't worry if files that end with "None" do not exist
@@ -92,16 +196,17 @@ class TemplateBuilder(object):
             # 2. If a file is not found, try the same file with 'default' after the last underscore
             rel_file_default = rel_file.rsplit("_", 1)[0] + "_default"
             try:
-                fid = open(os.path.join(self.template_path, rel_file_default))
+                template = self.loadTemplate(rel_file_default)
             except IOError:
                 raise IOError("Error reading file {} in template path {}".format(rel_file, self.template_path))
             finally:
                 rel_file = rel_file_default
-        contents = fid.read()
-        fid.close()
 
         try:
-            contents = self.process(contents, rel_file, params)
+            if self.compiled:
+                contents = self.render(template.parse(), rel_file, params)
+            else:
+                contents = self.process(template, rel_file, params)
         except BracketError as err:
             raise ValueError("Bracket matching error in {}: {}".format(rel_file, str(err)))
         except ValueError as err:
@@ -111,6 +216,71 @@ class TemplateBuilder(object):
             raise
         return contents
 
+    def loadTemplate(self, rel_file):
+        """
+        Return the template file as a string, or, in compiled mode, as a cached _TemplateFile which is
+        re-read only if the file has been modified
+        """
+        full_path = os.path.join(self.template_path, rel_file)
+        if not self.compiled:
+            with open(full_path) as fid:
+                return fid.read()
+        mtime = os.stat(full_path).st_mtime_ns
+        key = os.path.abspath(full_path)
+        template = _template_cache.get(key)
+        if template is None or template.mtime != mtime:
+            with open(full_path) as fid:
+                template = _TemplateFile(mtime, fid.read())
+            _template_cache[key] = template
+        return template
+
+    def render(self, nodes, curr_file, params):
+        """ Render a compiled node list using the current settings and parameter stack """
+        out = []
+        for node in nodes:
+            if isinstance(node, str):
+                out.append(node)
+            else:
+                out.append(node.render(self, curr_file, params))
+        return ''.join(out)
+
+    def lookupVariable(self, key, params):
+        """ Return the string value of a (fully substituted) variable key - see makeVarSubstitutions """
+        # Special case - if key is a number, treat as positional parameter
+        if _integer_regex.fullmatch(key):
+            try:
+                return str(params[int(key)])
+            except IndexError as ex:
+                raise ValueError("Index " + key + " of stack variables is out of range") from ex
+        # Otherwise, navigate the settings dict for the key
+        keys = key.split('/')
+        dic = self.settings
+        for k in keys:
+            # Special key to list contents
+            if k == "LIST":
+                print("Contents:")
+                print(dic)
+            if isinstance(dic, dict) and (k in dic):
+                dic = dic[k]
+            elif isinstance(dic, list):
+                # Lists must be indexed with an integer
+                if _integer_regex.fullmatch(k):
+                    dic = dic[int(k)]
+                else:
+                    dic = "None"
+            else:
+                # Not found. Replace with "None"
+                dic = "None"
+        if isinstance(dic, dict) or isinstance(dic, tuple):
+            # Dictionary type - print keys
+            # Tuple type - print values
+            return ' '.join(str(k) for k in dic)
+        elif isinstance(dic, list):
+            # List type - print indices
+            return ' '.join(str(i) for i in range(len(dic)))
+        else:
+            return str(dic)
+
     def findAtCurrentLevel(self, string, find_string, start):
         """ Find the specified string, ignoring anything inside brackets """
         brackets = {'%(': '%)', '%[': '%]', '%{': '%}'}
@@ -253,49 +423,7 @@ class TemplateBuilder(object):
             key = contents[start+2:end]
             # Make any replacements
             key = self.process(key, curr_file, params)
-            # Special case - if key is a number, treat as positional parameter
-            match = re.match("[0-9]+", key)
-            if match and match.span() == (0, len(key)):
-                try:
-                    replace = str(params[int(key)])
-                except IndexError as ex:
-                    raise ValueError("Index " + key + " of stack variables is out of range") from ex
-            # Otherwise, navigate the settings dict for the key
-            else:
-                keys = key.split('/')
-                dic = self.settings
-                for k in keys:
-                    # Special key to list contents
-                    if k == "LIST":
-                        print("Contents:")
-                        print(dic)
-                    if isinstance(dic, dict) and (k in dic):
-                        dic = dic[k]
-                    elif isinstance(dic, list):
-                        # Lists must be indexed with an integer
-                        match = re.match("[0-9]+", k)
-                        if match and match.span() == (0, len(k)):
-                            dic = dic[int(k)]
-                        else:
-                            dic = "None"
-                    else:
-                        # Not found. Replace with "None"
-                        dic = "None"
-                if isinstance(dic, dict) or isinstance(dic, tuple):
-                    # Dictionary type - print keys
-                    # Tuple type - print values
-                    replacement = ""
-                    for k in dic:
-                        replacement += str(k) + " "
-                    replace = replacement[:-1]  # Trim trailing space
-                elif isinstance(dic, list):
-                    # List type - print indices
-                    replacement = ""
-                    for i in range(len(dic)):
-                        replacement += str(i) + " "
-                    replace = replacement[:-1]  # Trim trailing space
-                else:
-                    replace = str(dic)
+            replace = self.lookupVariable(key, params)
             contents = contents[:start] + replace + contents[end+2:]
         return contents
 
@@ -313,3 +441,255 @@ class TemplateBuilder(object):
             afterEnd = (end+3 if contents[end+2:end+3] == '\n' else end+2)
             contents = contents[:start] + replacement + contents[afterEnd:]
         return contents
+
+
+class _FileBuilder(TemplateBuilder):
+    """ Builder for a single top-level file in a worker task, which captures any files written from inside it """
+    def __init__(self, case_path, template_path, settings, compiled):
+        self.case_path = case_path
+        self.settings = settings
+        self.template_path = template_path
+        self.compiled = compiled
+        self.sink = MemorySink()
+        self.executor = None
+
+
+def _renderFile(case_path, template_path, settings, compiled, rel_file):
+    """ Worker task: return the files written while building rel_file, and its contents """
+    builder = _FileBuilder(case_path, template_path, settings, compiled)
+    contents = builder.buildFile(rel_file, [])
+    return builder.sink.files, contents
+
+
+class _TemplateFile:
+    """ Contents of a template file, parsed on first use """
+    def __init__(self, mtime, contents):
+        self.mtime = mtime
+        self.contents = contents
+        self.nodes = None
+
+    def parse(self):
+        if self.nodes is None:
+            self.nodes = _compileLevel(_tokenise(self.contents))
+        return self.nodes
+
+
+class _Bracket:
+    """ Bracketed group in the raw token stream: the opening bracket and the items inside it """
+    __slots__ = ('bra', 'items', 'start')
+
+    def __init__(self, bra, start):
+        self.bra = bra
+        self.items = []
+        self.start = start
+
+
+class _Variable:
+    """ %(key%) """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def render(self, builder, curr_file, params):
+        return builder.lookupVariable(builder.render(self.key, curr_file, params), params)
+
+
+class _Include:
+    """ %[filename%] """
+    __slots__ = ('file_name',)
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def render(self, builder, curr_file, params):
+        new_file = builder.render(self.file_name, curr_file, params)
+        if curr_file == new_file:
+            raise ValueError("File cannot include itself: " + curr_file)
+        return builder.buildFile(new_file, params)
+
+
+class _Block:
+    """ %{keys\\n body %} [output-file] """
+    __slots__ = ('keys', 'body', 'output_file', 'output_file_items')
+
+    def __init__(self, keys, body, output_file_items):
+        self.keys = keys
+        self.body = body
+        self.output_file_items = output_file_items
+        self.output_file = _compileLevel(output_file_items) if output_file_items else None
+
+    def render(self, builder, curr_file, params):
+        replacement = []
+        for v in builder.render(self.keys, curr_file, params).split(' '):
+            block_params = [v] + params
+            filename = None
+            if self.output_file:
+                filename = builder.render(self.output_file, curr_file, block_params)
+                if not filename:
+                    raise ValueError("File name parameter " + _itemsToText(self.output_file_items) +
+                                     "evaluates to nothing")
+            processed = builder.render(self.body, filename if filename else curr_file, block_params)
+            if filename:
+                builder.writeToFile(filename, processed)
+            else:
+                replacement.append(processed)
+        return ''.join(replacement)
+
+
+class _Switch:
+    """ Sequence of %:key1 key2 ...\\n clauses, running to the end of the enclosing block """
+    __slots__ = ('cases',)
+
+    def __init__(self, cases):
+        # List of (match keys, body), where the match keys are pre-split if they contain no markup
+        self.cases = []
+        for keys, body in cases:
+            if all(isinstance(k, str) for k in keys):
+                keys = frozenset(''.join(keys).split())
+            self.cases.append((keys, body))
+
+    def render(self, builder, curr_file, params):
+        for keys, body in self.cases:
+            if not isinstance(keys, frozenset):
+                keys = builder.render(keys, curr_file, params).split()
+            if params[0] in keys or "default" in keys:
+                # Remove first (matching) param inside block
+                return builder.render(body, curr_file, params[1:])
+        return ""
+
+
+def _tokenise(contents):
+    """ Split template text into a nested list of strings, bracketed groups and '%:' markers """
+    top = []
+    items = top
+    stack = []
+    pos = 0
+    for match in _markup_regex.finditer(contents):
+        start = match.start()
+        if start > pos:
+            items.append(contents[pos:start])
+        tag = match.group()
+        if tag == '%:':
+            items.append(_SWITCH)
+        elif tag in _brackets:
+            group = _Bracket(tag, start)
+            items.append(group)
+            stack.append((items, group))
+            items = group.items
+        else:
+            if not stack or _brackets[stack[-1][1].bra] != tag:
+                raise BracketError("Unmatched {} ...".format(contents[start:start+40]))
+            items = stack.pop()[0]
+        pos = match.end()
+    if pos < len(contents):
+        items.append(contents[pos:])
+    if stack:
+        start = stack[-1][1].start
+        raise BracketError("Error matching {} ...".format(contents[start:start+40]))
+    return top
+
+
+def _splitAtNewline(items):
+    """
+    Split a raw item list at the first newline that is not inside brackets, dropping the newline.
+    Returns None if there is no such newline.
+    """
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            n = item.find('\n')
+            if n >= 0:
+                before = items[:i]
+                after = items[i+1:]
+                if n > 0:
+                    before.append(item[:n])
+                if n+1 < len(item):
+                    after.insert(0, item[n+1:])
+                return before, after
+    return None
+
+
+def _stripItems(items):
+    """ Strip leading and trailing white space from a raw item list """
+    items = list(items)
+    while items and isinstance(items[0], str):
+        items[0] = items[0].lstrip()
+        if items[0]:
+            break
+        items.pop(0)
+    while items and isinstance(items[-1], str):
+        items[-1] = items[-1].rstrip()
+        if items[-1]:
+            break
+        items.pop()
+    return items
+
+
+def _itemsToText(items):
+    """ Reconstruct template source text from a raw item list, for error messages """
+    text = ""
+    for item in items:
+        if isinstance(item, str):
+            text += item
+        elif item is _SWITCH:
+            text += '%:'
+        else:
+            text += item.bra + _itemsToText(item.items) + _brackets[item.bra]
+    return text
+
+
+def _compileLevel(items):
+    """
+    Compile a raw item list into a list of nodes, where any '%:' clauses at this level extend to the
+    end of the list
+    """
+    segments = [[]]
+    for item in items:
+        if item is _SWITCH:
+            segments.append([])
+        else:
+            segments[-1].append(item)
+    nodes = _compileSequence(segments[0])
+    if len(segments) > 1:
+        cases = []
+        for segment in segments[1:]:
+            split = _splitAtNewline(segment)
+            keys, body = split if split is not None else (segment, [])
+            cases.append((_compileLevel(keys), _compileSequence(body)))
+        nodes.append(_Switch(cases))
+    return nodes
+
+
+def _compileSequence(items):
+    """ Compile a raw item list containing no '%:' markers into a list of strings and nodes """
+    nodes = []
+    items = list(items)
+    i = 0
+    while i < len(items):
+        item = items[i]
+        i += 1
+        if isinstance(item, str):
+            if nodes and isinstance(nodes[-1], str):
+                nodes[-1] += item
+            elif item:
+                nodes.append(item)
+        elif item.bra == '%(':
+            nodes.append(_Variable(_compileLevel(item.items)))
+        elif item.bra == '%[':
+            nodes.append(_Include(_compileLevel(item.items)))
+            # Swallow a newline immediately following the include
+            if i < len(items) and isinstance(items[i], str) and items[i].startswith('\n'):
+                items[i] = items[i][1:]
+        else:
+            # First line of the block contains the keys
+            split = _splitAtNewline(item.items)
+            keys, body = split if split is not None else (item.items, [])
+            # Remainder of the line after the closing bracket is the optional output file name
+            output_file_items = None
+            trailing = _splitAtNewline(items[i:])
+            if trailing is not None:
+                output_file_items = _stripItems(trailing[0])
+                items = trailing[1]
+                i = 0
+            nodes.append(_Block(_compileLevel(keys), _compileLevel(body), output_file_items))
+    return nodes
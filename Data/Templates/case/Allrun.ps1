@@ -25,15 +25,44 @@ function runParallel([int]$NumProcs, [string]$cmd)
     }
 }
 
+%{%(solver/IncrementalCaseWrite%)
+%:True
+function isStale([string]$step)
+{
+    return ($STALE -contains "all") -or ($STALE -contains $step)
+}
+
+%}
 # Set piping to file to ascii
 $PSDefaultParameterValues['Out-File:Encoding'] = 'ascii'
 
+%{%(solver/IncrementalCaseWrite%)
+%:True
+# Pre-processing steps to repeat, if only some were made stale by an incremental case write
+$STALE = @("all")
+if( Test-Path -PathType Leaf staleSteps )
+{
+    $STALE = -split (Get-Content -Raw staleSteps)
+}
+
+%}
 # Copy mesh from mesh case dir if available
 $MESHDIR = "%(meshDir%)"
 if( Test-Path -PathType Leaf $MESHDIR/constant/polyMesh/faces )
 {
+%{%(solver/IncrementalCaseWrite%)
+%:True
+    if( (isStale mesh) -or !(Test-Path -PathType Leaf constant/polyMesh/faces) -or
+        (Get-Item $MESHDIR/constant/polyMesh/faces).LastWriteTime -gt (Get-Item constant/polyMesh/faces).LastWriteTime )
+    {
+        rm -ErrorAction SilentlyContinue -Recurse -Force constant/polyMesh
+        cp -Recurse $MESHDIR/constant/polyMesh constant/polyMesh
+        $STALE = @("all")
+    }
+%:False
     rm -ErrorAction SilentlyContinue -Recurse -Force constant/polyMesh
     cp -Recurse $MESHDIR/constant/polyMesh constant/polyMesh
+%}
 }
 elseif( !(Test-Path -PathType Leaf constant/polyMesh/faces) )
 {
@@ -102,20 +131,87 @@ if ( $Env:WM_PROJECT_VERSION[0] -ne "v" -and 10 -le $Env:WM_PROJECT_VERSION )
     cp system/fvOptionsScalarTransport_OF10 system/fvOptionsScalarTransport
 }
 
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+# Decompose the mesh straight away, and run the pre-processing utilities on the decomposed case. The fields cannot
+# be decomposed until createPatch has given the patches their final names, so the initial fields are copied to
+# each processor instead, where they give the processor patches the internal value.
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( !(Test-Path -PathType Container processor0) -or (isStale decompose) -or (isStale decomposeFields) )
+{
+    # The decomposed mesh and fields have to be pre-processed again from the start
+    $STALE = @("all")
+}
+if( isStale decompose )
+{
+%}
+runCommand decomposePar -force -copyZero
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
+
+# Pick up number of parallel processes
+$NPROC = foamDictionary -entry "numberOfSubdomains" -value system/decomposeParDict
+
 %}
 # Update patch name and type
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale mesh )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC createPatch -overwrite
+%:False
 runCommand createPatch -overwrite
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 %{%(zonesPresent%)
 %:True
 # Set cell zones contained inside the .stl surfaces
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale topoSet )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC topoSet -dict system/topoSetZonesDict
+%:False
 runCommand topoSet -dict system/topoSetZonesDict
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 %}
 %{%(initialisationZonesPresent%)
 %:True
 # Set internal fields according to setFieldsDict
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale setFields )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC setFields
+%:False
 runCommand setFields
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 %}
 %{%(bafflesPresent%)
@@ -123,17 +219,59 @@ runCommand setFields
 %{%(createPatchesFromSnappyBaffles%)
 %:False
 # Combine mesh faceZones
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale mesh )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC topoSet -dict system/topoSetBafflesDict
+%:False
 runCommand topoSet -dict system/topoSetBafflesDict
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 # Creating baffles
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale mesh )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC createBaffles -overwrite
+%:False
 runCommand createBaffles -overwrite
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 %}
 %}
 %{%(runChangeDictionary%)
 %:True
 # Update patch name and type
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale mesh )
+{
+%}
+%{%(solver/ParallelPreProcessing%)
+%:True
+runParallel $NPROC changeDictionary
+%:False
 runCommand changeDictionary
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 
 %}
 %{%(initialValues/PotentialFlow%)
@@ -148,21 +286,49 @@ $PNAME = "p"
 %}
 %{%(solver/Parallel%)
 %:True
+%{%(solver/ParallelPreProcessing%)
+%:False
 # Parallel decomposition
+%{%(solver/IncrementalCaseWrite%)
+%:True
 if( !(Test-Path -PathType Container processor0) )
+{
+    $STALE += "decompose"
+}
+if( isStale decompose )
 {
     runCommand decomposePar -force
 }
+elseif( isStale decomposeFields )
+{
+    runCommand decomposePar -fields
+}
+%:False
+if( !(Test-Path -PathType Container processor0) )
+{
+    runCommand decomposePar -force
+}
+%}
 
 # Pick up number of parallel processes
 $NPROC = foamDictionary -entry "numberOfSubdomains" -value system/decomposeParDict
 
+%}
 %{%(dynamicMeshEnabled%)
 %:False
 %{%(MovingMeshRegionsPresent%)
 %:False
 # Mesh renumbering
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale decompose )
+{
+%}
 runParallel $NPROC renumberMesh -overwrite
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 %}
 %:True
 # Mesh renumbering does not work in Foundation with dynamic mesh
@@ -190,6 +356,15 @@ runParallel $NPROC potentialFoam -initialiseUBCs -pName $PNAME
 rm -ErrorAction SilentlyContinue processor*/0/phi
 %}
 
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+# Pre-processing is now up to date
+if( Test-Path -PathType Leaf staleSteps )
+{
+    echo "" > staleSteps
+}
+
 %}
 # Run application in parallel
 # Detect new foamRun in Foundation versions >= 11 and translate solver
@@ -216,7 +391,16 @@ else
 %{%(dynamicMeshEnabled%)
 %:False
 # Mesh renumbering
+%{%(solver/IncrementalCaseWrite%)
+%:True
+if( isStale mesh )
+{
+%}
 runCommand renumberMesh -overwrite
+%{%(solver/IncrementalCaseWrite%)
+%:True
+}
+%}
 %:True
 # Mesh renumbering does not currently work in Foundation with dynamic mesh
 # runCommand renumberMesh -overwrite
@@ -243,6 +427,15 @@ runCommand potentialFoam -initialiseUBCs -pName $PNAME
 rm -ErrorAction SilentlyContinue 0/phi
 %}
 
+%}
+%{%(solver/IncrementalCaseWrite%)
+%:True
+# Pre-processing is now up to date
+if( Test-Path -PathType Leaf staleSteps )
+{
+    echo "" > staleSteps
+}
+
 %}
 # Run application
 # Detect new foamRun in Foundation versions >= 11 and translate solver
@@ -66,6 +66,7 @@ class CfdOFWorkbench(Workbench):
         import CfdOF.Solve.CfdZone
         import CfdOF.Mesh.CfdDynamicMeshRefinement
         import CfdOF.PostProcess.CfdReportingFunction
+        import CfdOF.PostProcess.CfdConvergenceCriterion
         import CfdOF.Solve.CfdScalarTransportFunction
         import CfdOF.Solve.CfdMeanVelocityForce
         import CfdOF.CfdOpenPreferencesPage
@@ -82,7 +83,7 @@ class CfdOFWorkbench(Workbench):
                   'CfdOF_PhysicsModel', 'CfdOF_FluidMaterial',
                   'CfdOF_FluidBoundary', 'CfdOF_InitialiseInternal',
                   'CfdOF_InitialisationZone', 'CfdOF_PorousZone', 'CfdOF_MeanVelocityForce',
-                  'CfdOF_ReportingFunctions', 'CfdOF_ScalarTransportFunctions',
+                  'CfdOF_ReportingFunctions', 'CfdOF_ConvergenceCriterion', 'CfdOF_ScalarTransportFunctions',
                   'CfdOF_SolverControl',
                   ('M', 'CfdOF_OpenPreferences',),
                   ('M', QT_TRANSLATE_NOOP("Workbench", "Development"),
@@ -28,6 +28,8 @@
 
 import FreeCAD
 import FreeCADGui
+import Part
+from PySide import QtCore
 
 from CfdOF import CfdAnalysis as CfdAnalysis
 from CfdOF.Solve import CfdSolverFoam
@@ -40,11 +42,24 @@ from CfdOF import CfdTools
 from CfdOF.Solve import CfdCaseWriterFoam
 from CfdOF.Mesh import CfdMeshTools
 from CfdOF.Solve import CfdRunnableFoam
+from CfdOF import CfdDecomposition
+from CfdOF import CfdFaceSelectWidget
+from CfdOF.Mesh import CfdPolyMesh
+from CfdOF.Mesh import CfdMeshReport
+from CfdOF.Mesh import CfdMeshEstimate
+from CfdOF.Mesh import CfdSurfaceTriangulation
+from CfdOF.TemplateBuilder import TemplateBuilder, MemorySink, TarSink
 
 import tempfile
 import unittest
 import os
+import io
+import math
 import shutil
+import tarfile
+import functools
+import importlib
+from concurrent.futures import ThreadPoolExecutor
 
 # ***************************************************************************
 #                                                                           *
@@ -326,6 +341,10 @@ class MacroTest:
         case_dir = self.writer.case_folder
         comparePaths(ref_dir, case_dir, self.child_instance)
 
+        fccPrint('Comparing compiled and legacy templates for {} ...'.format(dir_name))
+        compareTemplateModes(self.meshwriter.template_path, self.meshwriter.settings, self.child_instance)
+        compareTemplateModes(self.writer.template_path, self.writer.settings, self.child_instance)
+
         fccPrint('--------------- End of CFD tests ---------------')
 
         FreeCAD.ParamGet(prefs).SetBool("AppendDocNameToOutputPath", original_append_setting)
@@ -454,6 +473,28 @@ class DamBreak3DTest(unittest.TestCase, MacroTest):
         self.closeDoc()
 
 
+class ThreadedCaseWriteTest(unittest.TestCase, MacroTest):
+    """ The case files are the same when rendered by a pool of threads """
+    __dir_name = 'Elbow'
+    __macros = ['elbow.FCMacro']
+
+    def __init__(self, var):
+        super().__init__(var)
+        MacroTest.child_instance = self
+
+    def test_run(self):
+        prefs = CfdTools.getPreferencesLocation()
+        original_max_threads = FreeCAD.ParamGet(prefs).GetUnsigned("CaseWriterMaxThreads", 1)
+        FreeCAD.ParamGet(prefs).SetUnsigned("CaseWriterMaxThreads", 4)
+        try:
+            self.runTest(self.__class__.__dir_name, self.__class__.__macros)
+        finally:
+            FreeCAD.ParamGet(prefs).SetUnsigned("CaseWriterMaxThreads", original_max_threads)
+
+    def tearDown(self):
+        self.closeDoc()
+
+
 class PropellerTest(unittest.TestCase, MacroTest):
     __dir_name = 'Propeller'
     __macros = ['01-geom.FCMacro', '02-mesh.FCMacro', '03-MovingMeshRegion.FCMacro']
@@ -565,6 +606,668 @@ class MeanVelocityForceCellZoneTest(unittest.TestCase, MacroTest):
         self.closeDoc()
 
 
+class IncrementalCaseWriteTest(unittest.TestCase, MacroTest):
+    """ Incremental rewriting of a case, and the pre-processing steps that Allrun has to repeat as a result """
+    __dir_name = 'DamBreak3D'
+    __macros = ['01-geom.FCMacro', '02-analysis.FCMacro']
+
+    def __init__(self, var):
+        super().__init__(var)
+        MacroTest.child_instance = self
+
+    def setUp(self):
+        for m in self.__class__.__macros:
+            CfdTools.executeMacro(os.path.join(home_path, "Demos", self.__class__.__dir_name, m))
+        self.analysis = CfdTools.getActiveAnalysis()
+        self.working_dir = tempfile.mkdtemp()
+        self.analysis.OutputPath = self.working_dir
+        self.solver_object = CfdTools.getSolver(self.analysis)
+        self.solver_object.IncrementalCaseWrite = True
+
+    def writeCase(self):
+        """ Write the case and return the steps made stale, as if Allrun had been run after the previous write """
+        writer = CfdCaseWriterFoam.CfdCaseWriterFoam(self.analysis)
+        writer.writeCase()
+        self.case_folder = writer.case_folder
+        with open(os.path.join(self.case_folder, 'staleSteps')) as fid:
+            stale_steps = fid.read().split()
+        # Allrun empties the list once pre-processing is up to date
+        with open(os.path.join(self.case_folder, 'staleSteps'), 'w') as fid:
+            fid.write('\n')
+        return stale_steps
+
+    def readCaseFile(self, rel_file):
+        with open(os.path.join(self.case_folder, rel_file), 'rb') as fid:
+            return fid.read()
+
+    def writeCaseFile(self, rel_file, contents):
+        with open(os.path.join(self.case_folder, rel_file), 'wb') as fid:
+            fid.write(contents)
+
+    def test_find_stale_steps(self):
+        self.assertEqual(CfdCaseWriterFoam.findStaleSteps(['system/controlDict']), [])
+        self.assertEqual(CfdCaseWriterFoam.findStaleSteps(['system/createPatchDict']),
+                         ['mesh', 'topoSet', 'setFields', 'decompose', 'decomposeFields'])
+        self.assertEqual(CfdCaseWriterFoam.findStaleSteps(['constant/triSurface/zone.stl']), ['topoSet', 'decompose'])
+        self.assertEqual(CfdCaseWriterFoam.findStaleSteps(['0/U']), ['setFields', 'decomposeFields'])
+        self.assertEqual(CfdCaseWriterFoam.findStaleSteps(['system/decomposeParDict']), ['decompose'])
+
+    def test_rewrite(self):
+        self.assertEqual(self.writeCase(), ['all'])
+        manifest = CfdTools.readCaseManifest(self.case_folder)
+        for rel_file in ['Allrun', 'system/controlDict', 'system/setFieldsDict', '0/U']:
+            self.assertEqual(manifest[rel_file], CfdTools.hashFileContents(self.readCaseFile(rel_file)), rel_file)
+
+        # Nothing changed: no file is rewritten, so local edits survive
+        self.writeCaseFile('system/fvSchemes', b'Edited')
+        self.assertEqual(self.writeCase(), [])
+        self.assertEqual(self.readCaseFile('system/fvSchemes'), b'Edited')
+        self.assertEqual(CfdTools.readCaseManifest(self.case_folder), manifest)
+
+        self.solver_object.EndTime = '20 s'
+        self.assertEqual(self.writeCase(), [])
+        self.assertNotEqual(CfdTools.readCaseManifest(self.case_folder)['system/controlDict'],
+                            manifest['system/controlDict'])
+
+        # The fields modified by setFields are restored before it is run again
+        u = self.readCaseFile('0/U')
+        self.writeCaseFile('0/U', b'Initialised')
+        FreeCAD.ActiveDocument.InitialisationZone.VolumeFractions = {'water': '0.5'}
+        self.assertEqual(self.writeCase(), ['setFields', 'decomposeFields'])
+        self.assertEqual(self.readCaseFile('0/U'), u)
+
+        self.solver_object.ParallelCores = self.solver_object.ParallelCores + 2
+        self.assertEqual(self.writeCase(), ['decompose'])
+
+        FreeCAD.ActiveDocument.CfdFluidBoundary001.Label = 'walls'
+        self.assertEqual(self.writeCase(), ['mesh', 'topoSet', 'setFields', 'decompose', 'decomposeFields'])
+
+        # Steps not yet re-run by Allrun remain stale at the next write
+        self.solver_object.ParallelCores = self.solver_object.ParallelCores + 2
+        self.writeCaseFile('staleSteps', b'setFields\n')
+        self.assertEqual(self.writeCase(), ['setFields', 'decompose'])
+
+    def tearDown(self):
+        self.closeDoc()
+        shutil.rmtree(self.working_dir)
+
+
+class MeshReportTest(unittest.TestCase):
+    """ Analysis of the logs of the meshers and checkMesh """
+    log_dir = os.path.join(test_file_dir, 'meshLogs')
+
+    def readLog(self, application):
+        with open(os.path.join(self.log_dir, 'log.' + application)) as fid:
+            return fid.read()
+
+    def test_check_mesh(self):
+        report = CfdMeshReport.parseCheckMeshLog(self.readLog('checkMesh'))
+        self.assertEqual(report['cells'], 2000)
+        self.assertEqual(report['internalFaces'], 5700)
+        self.assertEqual(report['facesPerCell'], 6.04)
+        self.assertEqual(report['cellTypes']['prisms'], 100)
+        self.assertEqual([p['name'] for p in report['patches']], ['movingWall', 'fixedWalls', 'frontAndBack'])
+        self.assertEqual(report['boundingBox'], [[0, 0, 0], [0.1, 0.1, 0.01]])
+        self.assertEqual(report['maxNonOrthogonality'], 71.3)
+        self.assertEqual(report['maxSkewness'], 5.3)
+        self.assertEqual(report['totalVolume'], 0.0001)
+        self.assertEqual(report['failedChecks'], 2)
+        self.assertEqual(len(report['failedCheckMessages']), 1)
+        self.assertEqual(report['meshQualityFaces'], 5)
+        self.assertEqual(report['clockTime'], 1)
+
+    def test_snappy_hex_mesh(self):
+        report = CfdMeshReport.parseSnappyHexMeshLog(self.readLog('snappyHexMesh'))
+        self.assertEqual(report['phaseTimes'], {'refine': 12.41, 'snap': 5.02, 'addLayers': 8.3, 'total': 26.4})
+        self.assertEqual(report['phaseMeshes']['snap'], {'cells': 35500, 'faces': 109000, 'points': 39800})
+        self.assertEqual([(l['patch'], l['faces'], l['layers']) for l in report['layers']],
+                         [('wall', 1234, 2.87), ('inlet_wall', 56, 0)])
+        self.assertAlmostEqual(report['layers'][0]['thicknessFraction'], 0.874)
+        self.assertEqual(report['executionTime'], 26.1)
+
+    def test_cartesian_mesh(self):
+        report = CfdMeshReport.parseCartesianMeshLog(self.readLog('cartesianMesh'))
+        self.assertEqual(report, {'executionTime': 14.31, 'clockTime': 15})
+
+    def test_gmsh(self):
+        report = CfdMeshReport.parseGmshLog(self.readLog('gmsh'))
+        self.assertEqual(report['phaseTimes'], {'1D': 0.0123, '2D': 1.5, '3D': 12.25})
+        # The size after optimisation
+        self.assertEqual((report['nodes'], report['elements']), (12400, 68000))
+        self.assertEqual(report['warnings'], 1)
+
+    def test_mesh_logs(self):
+        report = CfdMeshReport.parseMeshLogs(self.log_dir)
+        self.assertEqual(sorted(report), sorted(CfdMeshReport.LOG_PARSERS))
+        self.assertTrue(CfdMeshReport.formatMeshReport(report))
+
+
+class PolyMeshTest(unittest.TestCase):
+    """ Reading of OpenFOAM meshes: two hexahedral cells of 0.5 and 1.5 m x 1 m x 1 m, in ASCII and binary """
+
+    def checkMesh(self, case_dir):
+        self.assertEqual(CfdPolyMesh.readCellCount(case_dir), 2)
+        mesh = CfdPolyMesh.readPolyMesh(case_dir)
+        summary = mesh.getSummary(quality=False)
+        self.assertEqual(summary['points'], 12)
+        self.assertEqual(summary['faces'], 11)
+        self.assertEqual(summary['internalFaces'], 1)
+        self.assertEqual(summary['cells'], 2)
+        self.assertEqual([(p['name'], p['faces']) for p in summary['patches']],
+                         [('xmin', 1), ('xmax', 1), ('ymin', 2), ('ymax', 2), ('zmin', 2), ('zmax', 2)])
+        self.assertEqual(summary['boundingBox'], [[0.0, 0.0, 0.0], [2.0, 1.0, 1.0]])
+        self.assertNotIn('maxNonOrthogonality', summary)
+
+        summary = mesh.getSummary()
+        self.assertAlmostEqual(summary['minVolume'], 0.5)
+        self.assertAlmostEqual(summary['maxVolume'], 1.5)
+        self.assertAlmostEqual(summary['totalVolume'], 2.0)
+        self.assertAlmostEqual(summary['maxNonOrthogonality'], 0.0)
+        self.assertAlmostEqual(summary['maxSkewness'], 0.0)
+        self.assertAlmostEqual(summary['maxAspectRatio'], 2.0)
+        return mesh
+
+    def test_read(self):
+        ascii_mesh = self.checkMesh(os.path.join(test_file_dir, 'polyMesh', 'ascii'))
+        binary_mesh = self.checkMesh(os.path.join(test_file_dir, 'polyMesh', 'binary'))
+        for name in ['points', 'face_offsets', 'face_points', 'owner', 'neighbour']:
+            self.assertTrue((getattr(ascii_mesh, name) == getattr(binary_mesh, name)).all(), name)
+
+
+class DecompositionTest(unittest.TestCase):
+    """ Automatic choice of the number of subdomains and the decomposition method """
+    __doc_name = 'block'
+    __part_name = 'Box'
+
+    def setUp(self):
+        part_file = os.path.join(test_file_dir, 'parts', self.__class__.__doc_name + '.fcstd')
+        FreeCAD.open(part_file)
+        FreeCAD.setActiveDocument(self.__class__.__doc_name)
+        self.active_doc = FreeCAD.ActiveDocument
+        self.working_dir = tempfile.mkdtemp()
+
+    def createAnalysis(self):
+        self.analysis = CfdAnalysis.makeCfdAnalysis('CfdAnalysis')
+        CfdTools.setActiveAnalysis(self.analysis)
+        self.analysis.OutputPath = self.working_dir
+        self.analysis.addObject(CfdPhysicsSelection.makeCfdPhysicsSelection())
+        self.analysis.addObject(CfdInitialiseFlowField.makeCfdInitialFlowField())
+        self.analysis.addObject(CfdFluidMaterial.makeCfdFluidMaterial('FluidProperties'))
+        self.mesh_object = CfdMesh.makeCfdMesh('mesh')
+        self.analysis.addObject(self.mesh_object)
+        self.mesh_object.Part = self.active_doc.getObject(self.__class__.__part_name)
+        self.mesh_object.CaseName = 'meshCase'
+        self.solver_object = CfdSolverFoam.makeCfdSolverFoam()
+        self.analysis.addObject(self.solver_object)
+        self.solver_object.Parallel = True
+        self.solver_object.AutoParallelCores = True
+        self.solver_object.CellsPerCore = 1000
+        self.active_doc.recompute()
+
+    def writeOwnerHeader(self, num_cells):
+        """ Write only the header of the owner file of the mesh case, which is all that is read for the cell count """
+        poly_mesh_dir = os.path.join(self.working_dir, 'meshCase', 'constant', 'polyMesh')
+        os.makedirs(poly_mesh_dir)
+        with open(os.path.join(poly_mesh_dir, 'owner'), 'w') as f:
+            f.write('FoamFile\n{{\n    version     2.0;\n    format      ascii;\n    class       labelList;\n'
+                    '    note        "nPoints:1 nCells:{} nFaces:1 nInternalFaces:0";\n'
+                    '    object      owner;\n}}\n'.format(num_cells))
+
+    def processAutoDecomposition(self, hostfile_slots):
+        writer = CfdCaseWriterFoam.CfdCaseWriterFoam(self.analysis)
+        writer.case_folder = os.path.join(self.working_dir, 'case')
+        os.makedirs(writer.case_folder)
+        with open(os.path.join(writer.case_folder, 'hostfile'), 'w') as f:
+            f.write('localhost slots={}\n'.format(hostfile_slots))
+        solver_settings = CfdTools.propsToDict(self.solver_object)
+        solver_settings['DecompositionMethod'] = 'scotch'
+        writer.settings = {
+            'solver': solver_settings,
+            'system': {'hostFileRequired': False, 'MPIOptionsOMPI': '--hostfile hostfile', 'MPIOptionsMSMPI': ''}}
+        writer.processAutoDecomposition()
+        return solver_settings
+
+    def test_auto_decomposition(self):
+        self.createAnalysis()
+        self.writeOwnerHeader(5500)
+        solver_settings = self.processAutoDecomposition(hostfile_slots=16)
+        self.assertEqual(solver_settings['ParallelCores'], 6)
+        self.assertIn(solver_settings['DecompositionMethod'], ['scotch', 'kahip'])
+
+        # The number of subdomains is limited by the slots in the hostfile
+        shutil.rmtree(os.path.join(self.working_dir, 'case'))
+        solver_settings = self.processAutoDecomposition(hostfile_slots=4)
+        self.assertEqual(solver_settings['ParallelCores'], 4)
+
+    def test_number_of_subdomains(self):
+        self.assertEqual(CfdDecomposition.getNumberOfSubdomains(100001, 50000, 64), 3)
+        self.assertEqual(CfdDecomposition.getNumberOfSubdomains(10, 50000, 64), 2)
+        self.assertEqual(CfdDecomposition.getNumberOfSubdomains(10**7, 50000, 8), 8)
+
+    def test_hierarchical_coefficients(self):
+        self.assertEqual(CfdDecomposition.getHierarchicalCoefficients(8, [1, 1, 1]), (2, 2, 2))
+        self.assertEqual(CfdDecomposition.getHierarchicalCoefficients(12, [1000, 100, 0]), (12, 1, 1))
+        # The empty direction of a 2D mesh is never divided, even when it is cheapest to
+        self.assertEqual(CfdDecomposition.getHierarchicalCoefficients(7, [1, 0, 2]), (1, 1, 7))
+        self.assertEqual(CfdDecomposition.getHierarchicalCoefficients(4, [2, 2, 0]), (2, 2, 1))
+        self.assertRaises(ValueError, CfdDecomposition.getHierarchicalCoefficients, 2, [0, 0, 0])
+
+    def test_reuse_mesh(self):
+        self.createAnalysis()
+        self.solver_object.AutoParallelCores = False
+        self.solver_object.ParallelPreProcessing = True
+        self.solver_object.ReuseMesh = True
+        writer = CfdCaseWriterFoam.CfdCaseWriterFoam(self.analysis)
+
+        def reuseMesh(runtime):
+            writer.settings = {'solver': CfdTools.propsToDict(self.solver_object), 'system': {'FoamRuntime': runtime}}
+            writer.processSolverSettings()
+            return writer.settings['solver']['ReuseMesh']
+
+        # Only the bash Allrun links to the mesh case's mesh and keeps its decomposition
+        self.assertTrue(reuseMesh('Posix'))
+        self.assertTrue(reuseMesh('PosixDocker'))
+        self.assertFalse(reuseMesh('MinGW'))
+        self.assertFalse(reuseMesh('BlueCFD2'))
+        # Without parallel pre-processing, pre-processing modifies the full mesh, so the case needs its own copy
+        self.solver_object.ParallelPreProcessing = False
+        self.assertFalse(reuseMesh('Posix'))
+
+    def test_reuse_mesh_allrun(self):
+        settings = {
+            'solver': {'Parallel': True, 'ParallelPreProcessing': True, 'ReuseMesh': True, 'ParallelCores': 2,
+                       'IncrementalCaseWrite': False, 'SolverName': 'simpleFoam'},
+            'system': {'FoamRuntime': 'Posix'},
+            'meshDir': '../meshCase',
+            'meshLinkTarget': '../../meshCase/constant/polyMesh'}
+        sink = MemorySink()
+        TemplateBuilder(self.working_dir, os.path.join(home_path, 'Data', 'Templates', 'case'), settings, sink=sink)
+        allrun = sink.files['Allrun'].decode()
+        self.assertIn('ln -s "../../meshCase/constant/polyMesh" constant/polyMesh', allrun)
+        # The decomposition is keyed on checksums of the mesh files, not on locale-dependent directory listings
+        self.assertIn('cksum "$MESHDIR"/constant/polyMesh/* system/decomposeParDict', allrun)
+        self.assertNotIn('ls -l', allrun)
+        # The fields are copied to the processors, to be pre-processed there along with the mesh
+        self.assertIn('decomposePar -force -copyZero', allrun)
+        self.assertNotIn('decomposePar -fields', allrun)
+        self.assertIn('"procBoundary.*"', sink.files['0/U'].decode())
+
+    def tearDown(self):
+        FreeCAD.closeDocument(self.__class__.__doc_name)
+        shutil.rmtree(self.working_dir)
+
+
+class MeshEstimateTest(unittest.TestCase):
+    """ Estimates of the size of a mesh before it is made """
+
+    def setUp(self):
+        self.doc = FreeCAD.newDocument('meshEstimate')
+        box = self.doc.addObject('Part::Box', 'Box')
+        box.Length = '100 mm'
+        box.Width = '200 mm'
+        box.Height = '300 mm'
+        self.mesh_obj = CfdMesh.makeCfdMesh('mesh')
+        self.mesh_obj.Part = box
+        self.mesh_obj.CharacteristicLengthMax = '10 mm'
+        self.doc.recompute()
+
+    def test_estimate_box(self):
+        # 6000 cells of the base size fill the box; counts are truncated, so may be one less than exact
+        self.mesh_obj.MeshUtility = 'cfMesh'
+        estimate = CfdMeshEstimate.estimateMesh(self.mesh_obj)
+        self.assertAlmostEqual(estimate['cells'], 6000, delta=1)
+        self.assertEqual(estimate['meshingCells'], estimate['cells'])
+        self.assertAlmostEqual(
+            estimate['memory'],
+            CfdMeshEstimate.MEMORY_PER_PROCESS + 6000*CfdMeshEstimate.MEMORY_PER_CELL['cfMesh'],
+            delta=CfdMeshEstimate.MEMORY_PER_CELL['cfMesh'])
+        self.assertEqual(estimate['numberOfProcesses'], 1)
+
+        self.mesh_obj.ConvertToDualMesh = True
+        self.assertAlmostEqual(CfdMeshEstimate.estimateMesh(self.mesh_obj)['cells'], 6000/5.5, delta=1)
+        self.mesh_obj.ConvertToDualMesh = False
+
+        # Tetrahedra are smaller than hexahedra of the same edge length
+        self.mesh_obj.MeshUtility = 'gmsh'
+        self.assertAlmostEqual(CfdMeshEstimate.estimateMesh(self.mesh_obj)['cells'], 6000*6*math.sqrt(2), delta=1)
+
+        # One level of edge refinement adds bands of three cells of half the size along the 2400 mm of edges
+        self.mesh_obj.MeshUtility = 'snappyHexMesh'
+        self.mesh_obj.EdgeRefinement = 0.5
+        self.assertAlmostEqual(CfdMeshEstimate.estimateMesh(self.mesh_obj)['cells'], 6000 + math.pi*9*240*2,
+                               delta=1)
+
+    def tearDown(self):
+        FreeCAD.closeDocument(self.doc.Name)
+
+
+class ShapeMatchingTest(unittest.TestCase):
+    """ Geometric matching of the elements of shapes """
+
+    def test_match_box_faces(self):
+        box = Part.makeBox(1, 2, 3)
+        # Shares the face at x = 1 with box
+        next_box = Part.makeBox(1, 2, 3, FreeCAD.Vector(1, 0, 0))
+        box_sig = CfdTools.ShapeSignatures(box.Faces)
+        next_box_sig = CfdTools.ShapeSignatures(next_box.Faces)
+        self.assertEqual(CfdTools.matchShapeSignatures(box_sig, next_box_sig), ([1], [0]))
+        self.assertEqual(CfdTools.matchShapeSignatures(box_sig, box_sig), (list(range(6)), list(range(6))))
+        for i, f1 in enumerate(box.Faces):
+            for j, f2 in enumerate(next_box.Faces):
+                self.assertEqual(CfdTools.isSameGeometry(f1, f2), (i, j) == (1, 0))
+
+        # A separate face with the geometry of one of the box's
+        face = Part.Face(Part.makePolygon([FreeCAD.Vector(0, 0, 3), FreeCAD.Vector(1, 0, 3),
+                                           FreeCAD.Vector(1, 2, 3), FreeCAD.Vector(0, 2, 3),
+                                           FreeCAD.Vector(0, 0, 3)]))
+        self.assertEqual(CfdTools.matchShapeSignatures(CfdTools.ShapeSignatures([face]), box_sig), ([0], [5]))
+        self.assertEqual(CfdTools.matchFaces([(face, 'top')], [(f, k) for k, f in enumerate(box.Faces)]),
+                         [('top', 5)])
+        self.assertEqual(CfdTools.findElementInShape(box, face), 'Face6')
+
+    def test_shape_element_index(self):
+        box = Part.makeBox(1, 2, 3)
+        next_box = Part.makeBox(1, 2, 3, FreeCAD.Vector(1, 0, 0))
+        # The two solids share the face between them
+        shape, shape_map = box.generalFuse([next_box])
+        index = CfdTools.getShapeElementIndex(shape)
+        self.assertIs(CfdTools.getShapeElementIndex(shape), index)
+
+        for name in ['Solid2', 'Face1', 'Face11', 'Edge20', 'Vertex12']:
+            self.assertTrue(index.getElement(name).isSame(shape.getElement(name)), name)
+        self.assertIsNone(index.getElement('Face12'))
+        self.assertIsNone(index.getElement('Solid3'))
+
+        shared = index.findSameGeometry(box.Faces[1])
+        self.assertIsNotNone(shared)
+        shared_face = index.getElement('Face{}'.format(shared + 1))
+        self.assertEqual(sorted(index.getSolidsContaining(shared_face)), [0, 1])
+        self.assertEqual(sorted(index.getSolidsContaining(shared_face.Edges[0])), [0, 1])
+        # The face at x = 0 is only part of the solid made from box
+        outer_face = index.getElement('Face{}'.format(index.findSameGeometry(box.Faces[0]) + 1))
+        solids = index.getSolidsContaining(outer_face)
+        self.assertEqual(len(solids), 1)
+        self.assertAlmostEqual(shape.Solids[solids[0]].BoundBox.XMax, 1)
+
+    def test_signature_cache_bound(self):
+        doc = FreeCAD.newDocument('signatureCache')
+        cache_size = CfdTools.SIGNATURE_CACHE_SIZE
+        try:
+            box = doc.addObject('Part::Box', 'Box')
+            doc.recompute()
+            CfdTools.SIGNATURE_CACHE_SIZE = 4
+            CfdTools._signature_cache.clear()
+
+            def key(i):
+                return doc.Name, box.Name, ('Face{}'.format(i),), 'Faces'
+
+            signatures = {}
+            for i in range(1, 7):
+                signatures[i] = CfdTools.getReferenceSignatures((box, ('Face{}'.format(i),)))
+            # Only the most recently used are kept
+            self.assertEqual(list(CfdTools._signature_cache), [key(i) for i in range(3, 7)])
+
+            # A hit returns the same signatures and makes the entry the most recently used, so that the next entry
+            # added drops the least recently used instead
+            self.assertIs(CfdTools.getReferenceSignatures((box, ('Face3',))), signatures[3])
+            CfdTools.getReferenceSignatures((box, ('Face1',)))
+            self.assertEqual(list(CfdTools._signature_cache), [key(5), key(6), key(3), key(1)])
+
+            # Changing the shape invalidates the entry
+            box.Length = 2
+            doc.recompute()
+            resized = CfdTools.getReferenceSignatures((box, ('Face3',)))
+            self.assertIsNot(resized, signatures[3])
+            self.assertNotEqual(resized[0].getHash(), signatures[3][0].getHash())
+        finally:
+            CfdTools.SIGNATURE_CACHE_SIZE = cache_size
+            CfdTools._signature_cache.clear()
+            FreeCAD.closeDocument(doc.Name)
+
+
+class ElementListModelTest(unittest.TestCase):
+    """ Filtering and incremental fetching of the element list of the face selection widget """
+
+    def test_filter(self):
+        model = CfdFaceSelectWidget.ElementListModel()
+        model.setElements([('Face', 2500), ('Solid', 12)], ['Face3', 'Solid12'])
+        self.assertEqual(model.numElements(), 2512)
+        self.assertEqual(model.elementName(0), 'Face1')
+        self.assertEqual(model.elementName(2500), 'Solid1')
+
+        # Rows are added in batches
+        self.assertEqual(model.rowCount(), CfdFaceSelectWidget.ELEMENT_LIST_FETCH_SIZE)
+        while model.canFetchMore(QtCore.QModelIndex()):
+            model.fetchMore(QtCore.QModelIndex())
+        self.assertEqual(model.rowCount(), 2512)
+
+        # Filtering is by substring, ignoring case and surrounding space
+        model.setFilter('solid1')
+        self.assertEqual([model.elementName(row) for row in range(model.rowCount())],
+                         ['Solid1', 'Solid10', 'Solid11', 'Solid12'])
+        self.assertEqual([model.isChecked(row) for row in range(model.rowCount())], [False, False, False, True])
+        self.assertEqual(model.data(model.index(3), QtCore.Qt.DisplayRole), 'Solid12')
+        model.setFilter(' FACE25 ')
+        self.assertEqual(model.numElements(), 12)
+        self.assertEqual(model.elementName(11), 'Face2500')
+        model.setFilter('Edge')
+        self.assertEqual(model.numElements(), 0)
+        self.assertFalse(model.canFetchMore(QtCore.QModelIndex()))
+
+        # Rows are checked by the names of the elements they show
+        model.setFilter('face25')
+        self.assertEqual(model.setChecked([0, 1], True), ['Face25', 'Face250'])
+        self.assertEqual(model.setChecked([0, 1], True), [])
+        self.assertEqual(model.setChecked([0], False), ['Face25'])
+        self.assertEqual(model.checked, {'Face3', 'Face250', 'Solid12'})
+
+        # Clearing the filter shows every element again, starting from the first batch
+        model.setFilter('')
+        self.assertEqual(model.numElements(), 2512)
+        self.assertEqual(model.rowCount(), CfdFaceSelectWidget.ELEMENT_LIST_FETCH_SIZE)
+
+
+class SurfaceTriangulationTest(unittest.TestCase):
+    """ Triangulation of surfaces to STL, in worker processes or in this process """
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.shapes = [(face, 'face{}'.format(k)) for k, face in enumerate(Part.makeCylinder(1, 2).Faces)]
+
+    def triangulate(self, max_workers, cache_dir=None, linear_deflection=0.1):
+        stls = {}
+
+        def output(k, stl):
+            stls[k] = stl
+
+        CfdSurfaceTriangulation.triangulateShapes(self.shapes, linear_deflection, 1, False, max_workers, output,
+                                                  cache_dir)
+        # Output in the order of the shapes
+        self.assertEqual(list(stls), list(range(len(self.shapes))))
+        return stls
+
+    def test_single_process_fallback(self):
+        serial_stls = self.triangulate(1)
+        for k, (face, name) in enumerate(self.shapes):
+            self.assertTrue(serial_stls[k].startswith('solid {}\n'.format(name).encode()))
+
+        # Workers that cannot import the modules needed leave triangulation to this process, with the same result
+        probe_worker = CfdSurfaceTriangulation.probeWorker
+        CfdSurfaceTriangulation.shutdownPool()
+        CfdSurfaceTriangulation.probeWorker = functools.partial(importlib.import_module, 'CfdOFMissingModule')
+        try:
+            self.assertEqual(self.triangulate(2), serial_stls)
+            if CfdSurfaceTriangulation.findPythonExecutable() is not None:
+                self.assertTrue(CfdSurfaceTriangulation._pool_failed)
+            self.assertIsNone(CfdSurfaceTriangulation._pool)
+        finally:
+            CfdSurfaceTriangulation.probeWorker = probe_worker
+            CfdSurfaceTriangulation._pool_failed = False
+
+    def test_reference_stl(self):
+        prefs = CfdTools.getPreferencesLocation()
+        original_append_setting = FreeCAD.ParamGet(prefs).GetBool("AppendDocNameToOutputPath", 0)
+        FreeCAD.ParamGet(prefs).SetBool("AppendDocNameToOutputPath", 0)
+        try:
+            for m in ['01-geom.FCMacro', '02-mesh.FCMacro', '03-MovingMeshRegion.FCMacro']:
+                CfdTools.executeMacro(os.path.join(home_path, "Demos", "Propeller", m))
+            analysis = CfdTools.getActiveAnalysis()
+            analysis.OutputPath = self.working_dir
+            mesh_obj = CfdTools.getMeshObject(analysis)
+            mesh_obj.CaseName = "meshCase"
+            meshwriter = CfdMeshTools.CfdMeshTools(mesh_obj)
+            meshwriter.writeMesh()
+        finally:
+            FreeCAD.ParamGet(prefs).SetBool("AppendDocNameToOutputPath", original_append_setting)
+            FreeCAD.closeDocument(FreeCAD.ActiveDocument.Name)
+
+        # The STL files are written exactly as before they were formatted from arrays, apart from the line endings
+        # the reference files may have been checked out with
+        ref_dir = os.path.join(test_file_dir, "cases", "Propeller", "meshCase", "constant", "triSurface")
+        for file_name in os.listdir(ref_dir):
+            with open(os.path.join(ref_dir, file_name), 'rb') as f:
+                ref_stl = f.read().replace(b'\r\n', b'\n')
+            with open(os.path.join(meshwriter.mesh_case_dir, "constant", "triSurface", file_name), 'rb') as f:
+                stl = f.read()
+            self.assertEqual(stl, ref_stl, "File '{}' differs from the reference".format(file_name))
+
+    def test_cache_hit(self):
+        cache_dir = os.path.join(self.working_dir, 'triangulationCache')
+        stls = self.triangulate(1, cache_dir)
+        self.assertEqual(len([f for f in os.listdir(cache_dir) if f.endswith('.npz')]), len(self.shapes))
+
+        # Unchanged shapes are not triangulated again
+        def triangulateBrep(brep, linear_deflection):
+            raise AssertionError("Shape triangulated again")
+
+        triangulate_brep = CfdSurfaceTriangulation.triangulateBrep
+        CfdSurfaceTriangulation.triangulateBrep = triangulateBrep
+        try:
+            self.assertEqual(self.triangulate(1, cache_dir), stls)
+            # A change in the settings misses the cache
+            self.assertRaises(AssertionError, self.triangulate, 1, cache_dir, 0.05)
+        finally:
+            CfdSurfaceTriangulation.triangulateBrep = triangulate_brep
+        self.assertEqual(self.triangulate(1, cache_dir, 0.05).keys(), stls.keys())
+        self.assertEqual(len([f for f in os.listdir(cache_dir) if f.endswith('.npz')]), 2*len(self.shapes))
+
+    def test_split_stl_solids(self):
+        facet = (b" facet normal 0 0 1\n  outer loop\n   vertex 0 0 0\n   vertex 1 0 0\n   vertex 0 1 0\n"
+                 b"  endloop\n endfacet\n")
+        crlf_facet = facet.replace(b"\n", b"\r\n")
+        # Names are stripped of trailing space, line endings are kept and the final endsolid may be missing
+        stl = (b"solid patch0\n" + facet + b"endsolid patch0\n" + b"solid patch1 \r\n" + crlf_facet +
+               b"endsolid patch1\r\n" + b"solid\n" + facet + facet)
+        solids = CfdMeshTools.splitStlSolids(stl)
+        self.assertEqual(list(solids), ['patch0', 'patch1', ''])
+        self.assertEqual(solids['patch0'], facet)
+        self.assertEqual(solids['patch1'], crlf_facet)
+        self.assertEqual(solids[''], facet + facet)
+        self.assertEqual(CfdMeshTools.splitStlSolids(b""), {})
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+
+class TemplateBuilderTest(unittest.TestCase):
+    """ Output of the template builder, independent of any analysis """
+    template_files = {
+        'Allrun': '#!/bin/bash\nrunCommand %(solver%)\n',
+        'system/controlDict': '%[_header%]application %(solver%);\n',
+        'system/setFieldsDict': '%{%(setFields%)\n%:True\ndefaultFieldValues ();\n%}\n',
+        '_header': '// Header\n'}
+    settings = {'solver': 'simpleFoam', 'setFields': False}
+    case_files = {
+        'Allrun': b'#!/bin/bash\nrunCommand simpleFoam\n',
+        'system/controlDict': b'// Header\napplication simpleFoam;\n'}
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.template_dir = os.path.join(self.working_dir, 'template')
+        self.case_dir = os.path.join(self.working_dir, 'case')
+        for rel_file, contents in self.template_files.items():
+            os.makedirs(os.path.join(self.template_dir, os.path.dirname(rel_file)), exist_ok=True)
+            with open(os.path.join(self.template_dir, rel_file), 'w') as f:
+                f.write(contents)
+
+    def test_memory_sink(self):
+        sink = MemorySink()
+        TemplateBuilder(self.case_dir, self.template_dir, self.settings, sink=sink)
+        self.assertEqual(sink.files, self.case_files)
+        self.assertFalse(os.path.exists(self.case_dir))
+
+    def checkTar(self, tar):
+        self.assertEqual(sorted(tar.getnames()), sorted(self.case_files))
+        for rel_file, contents in self.case_files.items():
+            self.assertEqual(tar.extractfile(rel_file).read(), contents)
+        self.assertEqual(tar.getmember('Allrun').mode, 0o755)
+        self.assertEqual(tar.getmember('system/controlDict').mode, 0o644)
+
+    def test_tar_sink(self):
+        tar_file = os.path.join(self.working_dir, 'case.tar.gz')
+        sink = TarSink(tar_file, compression='gz')
+        TemplateBuilder(self.case_dir, self.template_dir, self.settings, sink=sink)
+        sink.close()
+        with tarfile.open(tar_file) as tar:
+            self.checkTar(tar)
+
+        # Streamed to a file object
+        stream = io.BytesIO()
+        sink = TarSink(stream)
+        TemplateBuilder(self.case_dir, self.template_dir, self.settings, sink=sink)
+        sink.close()
+        stream.seek(0)
+        with tarfile.open(fileobj=stream) as tar:
+            self.checkTar(tar)
+        self.assertFalse(os.path.exists(self.case_dir))
+
+    def test_executor_errors(self):
+        # With errors in two files, the one raised is that from the first in build order, as in a serial build
+        for rel_file in ['system/fvSchemes', 'system/fvSolution']:
+            with open(os.path.join(self.template_dir, rel_file), 'w') as f:
+                f.write('%{%(solver%)\n')
+        serial_sink = MemorySink()
+        with self.assertRaises(ValueError) as serial:
+            TemplateBuilder(self.case_dir, self.template_dir, self.settings, sink=serial_sink)
+        threaded_sink = MemorySink()
+        with ThreadPoolExecutor(4) as executor:
+            with self.assertRaises(ValueError) as threaded:
+                TemplateBuilder(self.case_dir, self.template_dir, self.settings, sink=threaded_sink, executor=executor)
+        self.assertEqual(str(threaded.exception), str(serial.exception))
+        self.assertEqual(list(threaded_sink.files.items()), list(serial_sink.files.items()))
+
+    def test_surface_mesh_template(self):
+        settings = {
+            'Name': 'surfaces',
+            'OutputFileName': 'surfaces.stl',
+            'AngularMeshDensity': 12,
+            'ScalingFactor': 0.001,
+            'Patches': {'patch0': '1, 2', 'patch1': '3'}}
+        compareTemplateModes(os.path.join(home_path, 'Data', 'Templates', 'surfaceMesh'), settings, self)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+
+def compareTemplateModes(template_path, settings, unit_test):
+    """ Checks that the compiled and legacy template builders generate the same files """
+    compiled_sink = MemorySink()
+    TemplateBuilder(temp_dir, template_path, settings, compiled=True, sink=compiled_sink)
+    legacy_sink = MemorySink()
+    TemplateBuilder(temp_dir, template_path, settings, compiled=False, sink=legacy_sink)
+    unit_test.assertTrue(compiled_sink.files)
+    unit_test.assertEqual(sorted(compiled_sink.files), sorted(legacy_sink.files))
+    for rel_file in compiled_sink.files:
+        unit_test.assertEqual(compiled_sink.files[rel_file], legacy_sink.files[rel_file],
+                              "File '{}' differs between compiled and legacy templates".format(rel_file))
+
+    # Rendered concurrently, the same files are passed to the sink in the same order
+    threaded_sink = MemorySink()
+    with ThreadPoolExecutor(4) as executor:
+        TemplateBuilder(temp_dir, template_path, settings, sink=threaded_sink, executor=executor)
+    unit_test.assertEqual(list(threaded_sink.files.items()), list(compiled_sink.files.items()))
+
+
 def compareInpFiles(file_name1, file_name2):
     file1 = open(file_name1, 'r')
     f1 = file1.readlines()